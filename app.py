@@ -6,11 +6,11 @@ __author__ = "shawnxhong"
 __copyright__ = "assignment of The University of Queensland, 2019"
 
 import math
+import random
 import tkinter as tk
+from functools import partial
 from tkinter import filedialog, messagebox, simpledialog
-from typing import Tuple, List
-from PIL import ImageTk, Image, ImageOps
-from threading import Timer
+from typing import Dict, Hashable, Iterable, Tuple, List
 
 import pymunk
 
@@ -18,18 +18,30 @@ from game.block import Block, MysteryBlock
 from game.item import DroppedItem
 from game.entity import Entity, BoundaryWall
 from game.mob import Mob, CloudMob, Fireball
+from game.ai import AIScheduler, default_batch_ai
+from game.gc_control import GCController
+from game.particles import DEBRIS, MAX_PARTICLES, SHINE, SPARK, ParticleLayer, ParticleSystem
+from game.navigation import get_nav_graph
+from game.assets import AssetManager
 from game.view import GameView, ViewRenderer
 from game.util import get_collision_direction
 from game.item import Coin
-from game.world import World
+from game.world import World, ANY_ID, NEVER_COLLIDE, STEP_SIZE
 
 from player import Player
-from level import load_world, WorldBuilder
+from level import (load_level, build_world, level_entity_types, EntityFactory, LevelReloader, LevelWatcher,
+                   WorldBuilder)
+from recording import Recording
+from scores import ScoreStore, TOP_SCORES
+from tasks import TaskRunner
 
 
 BLOCK_SIZE = 2 ** 4
 MAX_WINDOW_SIZE = (1080, math.inf)
 
+# The integer factors the game can be enlarged by on screen, see MarioApp.set_scale
+RENDER_SCALES = (1, 2, 3, 4)
+
 GOAL_SIZES = {
     "flag": (0.2, 9),
     "tunnel": (2, 2)
@@ -60,6 +72,70 @@ MOBS = {
     'g': 'gang'
 }
 
+# Bits of a player input command, see GameSession.set_input
+INPUT_LEFT = 1 << 0
+INPUT_RIGHT = 1 << 1
+INPUT_JUMP = 1 << 2
+INPUT_DUCK = 1 << 3
+INPUT_SHOOT = 1 << 4
+
+# The input bit of each key symbol
+KEY_INPUTS = {
+    'a': INPUT_LEFT,
+    'Left': INPUT_LEFT,
+    'd': INPUT_RIGHT,
+    'Right': INPUT_RIGHT,
+    'w': INPUT_JUMP,
+    'Up': INPUT_JUMP,
+    'space': INPUT_JUMP,
+    's': INPUT_DUCK,
+    'Down': INPUT_DUCK,
+    'b': INPUT_SHOOT,
+}
+
+# Milliseconds between each check for finished I/O tasks
+TASK_POLL_INTERVAL = 10
+
+# Milliseconds between each check of whether the level file was saved, whose
+# edits are then applied to the running level, see MarioApp._watch_level
+LEVEL_WATCH_INTERVAL = 500
+
+# Milliseconds between the end of one frame and the start of the next; garbage
+# is collected in this idle time, see GCController
+FRAME_DELAY = 10
+
+# The horizontal speed of the player walking, in pixels per second
+WALK_SPEED = 150
+
+# Seconds of invincibility given by a star
+STAR_DURATION = 10
+
+# Blocks without any state or behaviour, which share a single flyweight per id
+PLAIN_BLOCKS = {'brick', 'brick_base', 'cube'}
+
+# Mobs that destroy themselves, and whatever they hit, on collision
+PROJECTILES = ('fireball', 'bullet_l', 'bullet_r')
+
+# The particle bursts of each visual effect, as (sprite, count, speed, lifetime)
+EFFECTS = {
+    "debris": ((DEBRIS, 12, 160, 1.2), (SPARK, 6, 60, .3)),
+    "explosion": ((SPARK, 16, 120, .4),),
+    "sparkle": ((SHINE, 8, 50, .5),),
+}
+
+# Pairs of things that pass through each other, see game.world.NEVER_COLLIDE
+NEVER_COLLIDE = NEVER_COLLIDE | {
+    (("mob", "gang"), ("mob", "gang")),
+    (("mob", "gang"), ("mob", "mushroom")),
+}
+
+
+def remove_mob_if_present(world: World, mob: Mob):
+    """Remove 'mob' from 'world', unless it has already been removed (e.g. destroyed
+    by a projectile while waiting to be removed)"""
+    if world.has_thing(mob):
+        world.remove_mob(mob)
+
 
 class Switch(Block):
     """
@@ -102,10 +178,8 @@ class Switch(Block):
                     world.remove_block(thing)
 
             #  count down 10 seconds to set the switch back to on, and bring back the bricks
-            timer_active = Timer(10, self.set_active, [True])
-            timer_active.start()
-            timer_blocks = Timer(10, self.blocks_recover, [brick_list, world])
-            timer_blocks.start()
+            world.schedule(10, self.set_active, True)
+            world.schedule(10, self.blocks_recover, brick_list, world)
 
     def blocks_recover(self, brick_list, world: World):
         """Recover the hidden bricks
@@ -141,8 +215,7 @@ class Bounce(Block):
         if get_collision_direction(player, self) == "A":
             self._active = True
             player.set_velocity((0, -400))
-            timer = Timer(0.5, self.set_active, [False])  # this is for the animation
-            timer.start()
+            world.schedule(0.5, self.set_active, False)  # this is for the animation
 
 
 class Mushroom(Mob):
@@ -171,8 +244,7 @@ class Mushroom(Mob):
             player.set_velocity((0, -100))  # player slightly bounce off
             self.set_tempo(0)  # stop moving when squished
             #  destroy the mob after 0.4 seconds. just for the animation
-            timer = Timer(0.4, world.remove_mob, [self])
-            timer.start()
+            world.schedule(0.4, remove_mob_if_present, world, self)
         elif get_collision_direction(player, self) == "R":
             player.change_health(-1)
             player.set_velocity((50, 0))
@@ -185,9 +257,11 @@ class Mushroom(Mob):
 
 class Gang(Mob):
     """
-    A monster looks like gangster which seeks out the player on the ground
+    A monster looks like gangster which seeks out the player on the ground,
+    finding its way along the navigation graph of the level (see NavigateAI)
     """
     _id = "gang"
+    _ai_kind = "navigate"
 
     def __init__(self):
         super().__init__(self._id, size=(16, 16), weight=800, tempo=-80)
@@ -209,8 +283,7 @@ class Gang(Mob):
             player.set_velocity((0, -100))
             self.set_tempo(0)  # stop moving when squished
             #  destroy the mob after 0.4 seconds. just for the animation
-            timer = Timer(0.4, world.remove_mob, [self])
-            timer.start()
+            world.schedule(0.4, remove_mob_if_present, world, self)
         elif get_collision_direction(player, self) == "R":
             player.change_health(-1)
             player.set_velocity((50, 0))
@@ -245,10 +318,9 @@ class Star(DroppedItem):
         super().__init__()
 
     def collect(self, player):
-        """Collect star, set the player to be invincible"""
+        """Collect star, set the player to be invincible for STAR_DURATION seconds
+        (see GameSession._handle_player_collect_item)"""
         player.set_niubi(True)
-        timer = Timer(10, player.set_niubi, [False])
-        timer.start()
 
 
 class Flower(DroppedItem):
@@ -321,226 +393,189 @@ class BulletRight(Mob):
 class SpriteSheetReader:
     """
     Class used to grab images out of a sprite sheet.
-    All the cropped images are stored in __init__ to avoid multiple cropping.
-    Otherwise the game will be extremely slow
+    Each image is cropped, scaled and mirrored once and kept by the asset
+    manager (see AssetManager), otherwise the game will be extremely slow
     """
-    def __init__(self):
-        # crop player right side images
-        self._player_right = []
-        img = Image.open('spritesheets/characters.png')
-        for i in range(1, 4):
-            im = img.crop((80 + i * 17, 34, 96 + i * 17, 50))
-            self._player_right.append(ImageTk.PhotoImage(im))
-
-        # crop player left side images
-        self._player_left = []
-        img = Image.open('spritesheets/characters.png')
-        for i in range(1, 4):
-            im = img.crop((80 + i * 17, 34, 96 + i * 17, 50))
-            im_flip = ImageOps.mirror(im)
-            self._player_left.append(ImageTk.PhotoImage(im_flip))
-
-        # crop player jump/fall images, first one jump, second on fall
-        self._player_air = []
-        img = Image.open('spritesheets/characters.png')
-        im = img.crop((80 + 5 * 17, 34, 96 + 5 * 17, 50))
-        self._player_air.append(ImageTk.PhotoImage(im))
-        fall = img.crop((80 + 6 * 17, 34, 96 + 6 * 17, 50))
-        self._player_air.append(ImageTk.PhotoImage(fall))
-
-        # crop coin spinning images
-        self._coin = []
-        img = Image.open("spritesheets/items.png")
-        for i in range(2):
-            im = img.crop((0 + i * 16, 112, 16 + i * 16, 127))
-            self._coin.append(ImageTk.PhotoImage(im))
-        im = img.crop((0, 96, 16, 112))
-        self._coin.append(ImageTk.PhotoImage(im))
-
-        # crop mushroom walking images
-        self._mushroom = []
-        img = Image.open("spritesheets/enemies.png")
-        for i in range(2):
-            im = img.crop((0 + i * 16, 16, 16 + i * 16, 32))
-            self._mushroom.append(ImageTk.PhotoImage(im))
-
-        # crop the mushroom squished image
-        self._dead_mushroom = []
-        img = Image.open("spritesheets/enemies.png")
-        im = img.crop((0 + 2 * 16, 16, 16 + 2 * 16, 32))
-        self._dead_mushroom.append(ImageTk.PhotoImage(im))
-
-        # crop bounce block image
-        self._bounce = []
-        img = Image.open("spritesheets/items.png")
-        for i in range(3):
-            im = img.crop((80 + i * 16, 0, 96 + i * 16, 32))
-            self._bounce.append(ImageTk.PhotoImage(im))
-
-        # crop gang monster images
-        self._gang = []
-        img = Image.open("spritesheets/enemies.png")
-        for i in range(3,5):
-            im = img.crop((0 + i * 16, 16, 16 + i * 16, 32))
-            self._gang.append(ImageTk.PhotoImage(im))
-
-        # crop the squished gang monster image
-        self._dead_gang = []
-        img = Image.open("spritesheets/enemies.png")
-        im = img.crop((0 + 5 * 16, 16, 16 + 5 * 16, 32))
-        self._dead_gang.append(ImageTk.PhotoImage(im))
-
-        # crop bullet image
-        self._bullet = []
-        img = Image.open("spritesheets/items.png")
-        im = img.crop((114, 146, 126, 158))
-        self._bullet.append(ImageTk.PhotoImage(im))
-
-        # crop flower image
-        self._flower = []
-        img = Image.open("spritesheets/items.png")
-        im = img.crop((0, 32, 16, 48))
-        self._flower.append(ImageTk.PhotoImage(im))
+    def __init__(self, assets: AssetManager):
+        """
+        Parameters:
+            assets (AssetManager): The manager of the images drawn
+        """
+        self._assets = assets
+
+        characters = 'spritesheets/characters.png'
+        items = 'spritesheets/items.png'
+        enemies = 'spritesheets/enemies.png'
+
+        # the sprites of each animation, as (source, mirrored), see AssetManager.get
+        self._animations = animations = {}
+
+        # player right side images
+        animations["player_right"] = [((characters, (80 + i * 17, 34, 96 + i * 17, 50)), False)
+                                      for i in range(1, 4)]
+
+        # player left side images
+        animations["player_left"] = [(source, True) for source, _ in animations["player_right"]]
+
+        # player jump/fall images, first one jump, second on fall
+        animations["player_air"] = [((characters, (80 + 5 * 17, 34, 96 + 5 * 17, 50)), False),
+                                    ((characters, (80 + 6 * 17, 34, 96 + 6 * 17, 50)), False)]
+
+        # coin spinning images
+        animations["coin_rotate"] = [((items, (0 + i * 16, 112, 16 + i * 16, 127)), False) for i in range(2)]
+        animations["coin_rotate"].append(((items, (0, 96, 16, 112)), False))
+
+        # mushroom walking images
+        animations["mushroom"] = [((enemies, (0 + i * 16, 16, 16 + i * 16, 32)), False) for i in range(2)]
+
+        # the mushroom squished image
+        animations["dead_mushroom"] = [((enemies, (0 + 2 * 16, 16, 16 + 2 * 16, 32)), False)]
+
+        # bounce block image
+        animations["bounce"] = [((items, (80 + i * 16, 0, 96 + i * 16, 32)), False) for i in range(3)]
+
+        # gang monster images
+        animations["gang"] = [((enemies, (0 + i * 16, 16, 16 + i * 16, 32)), False) for i in range(3, 5)]
+
+        # the squished gang monster image
+        animations["dead_gang"] = [((enemies, (0 + 5 * 16, 16, 16 + 5 * 16, 32)), False)]
+
+        # bullet image
+        animations["bullet"] = [((items, (114, 146, 126, 158)), False)]
+
+        # flower image
+        animations["flower"] = [((items, (0, 32, 16, 48)), False)]
+
+    def get_sources(self, animation: str) -> list:
+        """
+        Return: List[tuple]: the (source, mirrored) of each image of an animation, see AssetManager.get
+        """
+        return self._animations[animation]
+
+    def _get(self, animation: str) -> list:
+        """(list<ImageTk.PhotoImage>) Returns the images of an animation, at the render scale"""
+        return [self._assets.get(source, mirrored) for source, mirrored in self._animations[animation]]
 
     def player_right(self) -> list:
         """
         Return: List[tk.PhotoImage]: player walking right
         """
-        return self._player_right
+        return self._get("player_right")
 
     def player_left(self) -> list:
         """
         Return: List[tk.PhotoImage]: player walking left
         """
-        return self._player_left
+        return self._get("player_left")
 
     def player_air(self):
         """
         Return: List[tk.PhotoImage]: player in the air, the first one is jumping, the second one is falling
         """
-        return self._player_air
+        return self._get("player_air")
 
     def coin_rotate(self):
         """
         Return: List[tk.PhotoImage]: coin spinning
         """
-        return self._coin
+        return self._get("coin_rotate")
 
     def mushroom(self):
         """
         Return: List[tk.PhotoImage]: mushroom walking
         """
-        return self._mushroom
+        return self._get("mushroom")
 
     def dead_mushroom(self):
         """
         Return: List[tk.PhotoImage]: squished mushroom
         """
-        return self._dead_mushroom
+        return self._get("dead_mushroom")
 
     def gang(self):
         """
         Return: List[tk.PhotoImage]: gang walking
         """
-        return self._gang
+        return self._get("gang")
 
     def dead_gang(self):
         """
         Return: List[tk.PhotoImage]: gang squished
         """
-        return self._dead_gang
+        return self._get("dead_gang")
 
     def bounce(self):
         """
         Return: List[tk.PhotoImage]: bounce block bouncing
         """
-        return self._bounce
+        return self._get("bounce")
 
     def bullet(self):
         """
         Return: List[tk.PhotoImage]: bullet image
         """
-        return self._bullet
+        return self._get("bullet")
 
     def flower(self):
         """
         Return: List[tk.PhotoImage]: flower image
         """
-        return self._flower
+        return self._get("flower")
 
 
-def create_block(world: World, block_id: str, x: int, y: int, *args):
-    """Create a new block instance and add it to the world based on the block_id.
+# The constructor of each block, item and mob id, other ids are generic entities
+BLOCK_CONSTRUCTORS = {
+    "mystery_empty": MysteryBlock,
+    "mystery_coin": partial(MysteryBlock, drop="coin", drop_range=(3, 6)),
+    "bounce": Bounce,
+    "switches": Switch,
+}
 
-    Parameters:
-        world (World): The world where the block should be added to.
-        block_id (str): The block identifier of the block to create.
-        x (int): The x coordinate of the block.
-        y (int): The y coordinate of the block.
-    """
-    block_id = BLOCKS[block_id]
-    if block_id == "mystery_empty":
-        block = MysteryBlock()
-    elif block_id == "mystery_coin":
-        block = MysteryBlock(drop="coin", drop_range=(3, 6))
-    elif block_id == "bounce":
-        block = Bounce()
-    elif block_id == 'switches':
-        block = Switch()
-    else:
-        block = Block(block_id)
+ITEM_CONSTRUCTORS = {
+    "coin": Coin,
+    "star": Star,
+    "flower": Flower,
+}
 
-    world.add_block(block, x * BLOCK_SIZE, y * BLOCK_SIZE)
+MOB_CONSTRUCTORS = {
+    "cloud": CloudMob,
+    "fireball": Fireball,
+    "mushroom": Mushroom,
+    "gang": Gang,
+    "bullet_l": BulletLeft,
+    "bullet_r": BulletRight,
+}
 
 
-def create_item(world: World, item_id: str, x: int, y: int, *args):
-    """Create a new item instance and add it to the world based on the item_id.
+def create_entity_factories() -> Dict[str, EntityFactory]:
+    """Create the factory of each level character in BLOCKS, ITEMS and MOBS.
 
-    Parameters:
-        world (World): The world where the item should be added to.
-        item_id (str): The item identifier of the item to create.
-        x (int): The x coordinate of the item.
-        y (int): The y coordinate of the item.
+    Plain blocks are added by id, sharing the world's flyweight of that id,
+    while every other entity is constructed anew.
+
+    Returns:
+        (dict<str: EntityFactory>): The factory of each level character.
     """
-    item_id = ITEMS[item_id]
-    if item_id == "coin":
-        item = Coin()
-    elif item_id == "star":
-        item = Star()
-    elif item_id == 'flower':
-        item = Flower()
-    else:
-        item = DroppedItem(item_id)
+    factories = {}
+    for character, block_id in BLOCKS.items():
+        if block_id in PLAIN_BLOCKS:
+            factories[character] = EntityFactory(block_id, World.add_plain_block, prototype=block_id)
+        else:
+            create = BLOCK_CONSTRUCTORS.get(block_id, partial(Block, block_id))
+            factories[character] = EntityFactory(block_id, World.add_block, create)
 
-    world.add_item(item, x * BLOCK_SIZE, y * BLOCK_SIZE)
+    for character, item_id in ITEMS.items():
+        create = ITEM_CONSTRUCTORS.get(item_id, partial(DroppedItem, item_id))
+        factories[character] = EntityFactory(item_id, World.add_item, create)
 
+    for character, mob_id in MOBS.items():
+        create = MOB_CONSTRUCTORS.get(mob_id, partial(Mob, mob_id, size=(1, 1)))
+        factories[character] = EntityFactory(mob_id, World.add_mob, create)
 
-def create_mob(world: World, mob_id: str, x: int, y: int, *args):
-    """Create a new mob instance and add it to the world based on the mob_id.
+    return factories
 
-    Parameters:
-        world (World): The world where the mob should be added to.
-        mob_id (str): The mob identifier of the mob to create.
-        x (int): The x coordinate of the mob.
-        y (int): The y coordinate of the mob.
-    """
-    mob_id = MOBS[mob_id]
-    if mob_id == "cloud":
-        mob = CloudMob()
-    elif mob_id == "fireball":
-        mob = Fireball()
-    elif mob_id == "mushroom":
-        mob = Mushroom()
-    elif mob_id == 'gang':
-        mob = Gang()
-    elif mob_id == 'bullet_l':
-        mob = BulletLeft()
-    elif mob_id == 'bullet_r':
-        mob = BulletRight()
-    else:
-        mob = Mob(mob_id, size=(1, 1))
-
-    world.add_mob(mob, x * BLOCK_SIZE, y * BLOCK_SIZE)
+
+ENTITY_FACTORIES = create_entity_factories()
 
 
 def create_unknown(world: World, entity_id: str, x: int, y: int, *args):
@@ -549,6 +584,21 @@ def create_unknown(world: World, entity_id: str, x: int, y: int, *args):
                     size=(BLOCK_SIZE, BLOCK_SIZE))
 
 
+def create_world_builder(gravity: Tuple[int, int], **world_options) -> WorldBuilder:
+    """Create a world builder for the entities of a Mario level.
+
+    Parameters:
+        gravity (tuple<int, int>): The gravity of the worlds built.
+        **world_options: Any additional World constructor arguments, overriding the
+                         defaults of the game.
+    """
+    world_options.setdefault("never_collide", NEVER_COLLIDE)
+
+    world_builder = WorldBuilder(BLOCK_SIZE, gravity, fallback=create_unknown, **world_options)
+    world_builder.register_factories(ENTITY_FACTORIES)
+    return world_builder
+
+
 BLOCK_IMAGES = {
     "brick": "brick",
     "brick_base": "brick_base",
@@ -570,12 +620,38 @@ MOB_IMAGES = {
     "mushroom": "mushroom",
 }
 
+# The (images, sprite sheet animations) each entity drawn by MarioViewRenderer
+# may be drawn with; other entities are drawn with their BLOCK_IMAGES,
+# ITEM_IMAGES or MOB_IMAGES image
+ENTITY_SPRITES = {
+    "player": (("mario_right",), ("player_right", "player_left", "player_air")),
+    "mystery_empty": (("coin", "coin_used"), ()),
+    "mystery_coin": (("coin", "coin_used"), ()),
+    "switches": (("switch", "switch_pressed"), ()),
+    "coin": ((), ("coin_rotate",)),
+    "mushroom": ((), ("mushroom", "dead_mushroom")),
+    "bounce": (("bounce_block",), ("bounce",)),
+    "gang": ((), ("gang", "dead_gang")),
+    "bullet_l": ((), ("bullet",)),
+    "bullet_r": ((), ("bullet",)),
+    "flower": ((), ("flower",)),
+}
+
+# The entities each entity may add to the world during a level
+SPAWNS = {
+    "player": ("bullet_l", "bullet_r"),
+    "mystery_coin": ("coin",),
+    "cloud": ("fireball", "coin"),
+}
+
 
 class MarioViewRenderer(ViewRenderer):
     """A customised view renderer for a game of mario."""
-    def __init__(self, block_images, item_images, mob_images):
-        super().__init__(block_images, item_images, mob_images)
-        self.spritesheet = SpriteSheetReader()
+    def __init__(self, block_images, item_images, mob_images, scale: int = 1):
+        super().__init__(block_images, item_images, mob_images, scale)
+        self.spritesheet = SpriteSheetReader(self.get_assets())
+
+        self._entity_images = {**block_images, **item_images, **mob_images}
 
         self.player_right_index = 0
         self.player_left_index = 0
@@ -583,6 +659,28 @@ class MarioViewRenderer(ViewRenderer):
         self._mob_index = 0
         self._bounce_index = 0
 
+    def get_entity_sprites(self, entity_ids: Iterable[str]) -> List[Tuple[Hashable, bool]]:
+        """(list<tuple<Hashable, bool>>) Returns the (source, mirrored) of every sprite
+        the entities of 'entity_ids', and those they spawn, may be drawn with"""
+        pending = list(entity_ids)
+        seen = set(pending)
+        while pending:
+            for spawned in SPAWNS.get(pending.pop(), ()):
+                if spawned not in seen:
+                    seen.add(spawned)
+                    pending.append(spawned)
+
+        sprites = []
+        for entity_id in sorted(seen):
+            if entity_id in ENTITY_SPRITES:
+                images, animations = ENTITY_SPRITES[entity_id]
+                sprites.extend((image, False) for image in images)
+                for animation in animations:
+                    sprites.extend(self.spritesheet.get_sources(animation))
+            elif entity_id in self._entity_images:
+                sprites.append((self._entity_images[entity_id], False))
+        return sprites
+
     @ViewRenderer.draw.register(Player)
     def _draw_player(self, instance: Player, shape: pymunk.Shape,
                      view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
@@ -605,7 +703,7 @@ class MarioViewRenderer(ViewRenderer):
             image = self.spritesheet.player_left()[index]
             self.player_left_index += 1
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="player")]
 
     @ViewRenderer.draw.register(MysteryBlock)
@@ -616,7 +714,7 @@ class MarioViewRenderer(ViewRenderer):
         else:
             image = self.load_image("coin_used")
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="block")]
 
     @ViewRenderer.draw.register(Switch)
@@ -627,7 +725,7 @@ class MarioViewRenderer(ViewRenderer):
         else:
             image = self.load_image('switch_pressed')
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="block")]
 
     @ViewRenderer.draw.register(Coin)
@@ -637,7 +735,7 @@ class MarioViewRenderer(ViewRenderer):
         image = self.spritesheet.coin_rotate()[index]
         self._coin_index += 1
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="coin")]
 
     @ViewRenderer.draw.register(Mushroom)
@@ -650,7 +748,7 @@ class MarioViewRenderer(ViewRenderer):
         else:
             image = self.spritesheet.dead_mushroom()[0]
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="mushroom")]
 
     @ViewRenderer.draw.register(Bounce)
@@ -662,7 +760,7 @@ class MarioViewRenderer(ViewRenderer):
             self._bounce_index += 1
         else:
             image = self.load_image('bounce_block')
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="bounce")]
 
     @ViewRenderer.draw.register(Gang)
@@ -675,7 +773,7 @@ class MarioViewRenderer(ViewRenderer):
         else:
             image = self.spritesheet.dead_gang()[0]
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="gang")]
 
     @ViewRenderer.draw.register(BulletLeft)
@@ -683,7 +781,7 @@ class MarioViewRenderer(ViewRenderer):
                           view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.spritesheet.bullet()[0]
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="bullet_l")]
 
     @ViewRenderer.draw.register(BulletRight)
@@ -691,7 +789,7 @@ class MarioViewRenderer(ViewRenderer):
                            view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.spritesheet.bullet()[0]
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="bullet_r")]
 
     @ViewRenderer.draw.register(Flower)
@@ -699,21 +797,28 @@ class MarioViewRenderer(ViewRenderer):
                      view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.spritesheet.flower()[0]
 
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="flower")]
 
 
-class MarioApp:
-    """High-level app class for Mario, a 2d platformer"""
-    _world: World
+class GameSession:
+    """A game of Mario without any user interface.
 
-    def __init__(self, master: tk.Tk):
-        """Construct a new game of a MarioApp game.
+    Owns the world and the player of a game, resolves their interactions and
+    moves between levels, so games can also be run headless (e.g. by bots or
+    level tests). MarioApp adds the window, dialogs and keyboard input.
+    """
+    _world: World = None
+
+    def __init__(self, config: dict = None, seed: int = None):
+        """Construct a new game session.
 
         Parameters:
-            master (tk.Tk): tkinter root widget
+            config (dict): Configuration as read by read_config, or None to use
+                           the default configuration
+            seed (int): Seed of the worlds' random generators; sessions with the
+                        same configuration, seed and events play out identically
         """
-        self._master = master
         # default configuration setting
         self._level = "level1.txt"
         self._gravity = (0, 300)
@@ -723,39 +828,46 @@ class MarioApp:
         self._y = BLOCK_SIZE
         self._max_velocity = 500
         self._config = {}
-
-        self._master.update_idletasks()
-        self.load_config()
-
-        world_builder = WorldBuilder(BLOCK_SIZE, self._gravity, fallback=create_unknown)
-        world_builder.register_builders(BLOCKS.keys(), create_block)
-        world_builder.register_builders(ITEMS.keys(), create_item)
-        world_builder.register_builders(MOBS.keys(), create_mob)
-        self._builder = world_builder
-
-        self._player = Player(max_health=self._max_health)
-        self._player.set_jumping(True)
-        self._player.set_shoot(False)
-
-        self.reset_world(self._level)
-
-        self._renderer = MarioViewRenderer(BLOCK_IMAGES, ITEM_IMAGES, MOB_IMAGES)
-
-        size = tuple(map(min, zip(MAX_WINDOW_SIZE, self._world.get_pixel_size())))
-        self._view = GameView(master, size, self._renderer)
-        self._view.pack()
-
-        self.bind()
-
-        self.menu_bar()
-
-        # create the character status bar
-        self.status_bar = Status(master)
-        self.status_bar.pack()
-
-        # Wait for window to update before continuing
-        master.update_idletasks()
-        self.step()
+        self._finished = False
+
+        self._seed = seed
+        # number of steps taken since the session started, over all levels
+        self._steps = 0
+        self._recorder = None
+        # the step after which the player's star wears off, counted by the session
+        # rather than the world, so it outlasts the world being rebuilt
+        self._niubi_until = None
+
+        # the input command held by the player, and the one applied at the last step
+        self._input = 0
+        self._last_input = 0
+
+        # whether the player reached the flag, or ducked into a tunnel, during the last step
+        self._completed = False
+        self._tunnelled = False
+        # level strings loaded ahead of time, by level file, see preload_level
+        self._preloaded = {}
+        # the number of reasons the simulation is paused for, see pause
+        self._paused = 0
+        # measures the allocations of each frame, see set_profiler
+        self._profiler = None
+        # schedules garbage collection, see set_gc_controller
+        self._gc = None
+        # the level file the world was built from, and applies its edits, see edit_level
+        self._world_level = None
+        self._reloader = None
+        # the navigation graph of each level file, kept across rebuilds of its world
+        self._nav_graphs = {}
+        # the AI finding the way of the gangs in the current world
+        self._navigate = None
+        # the (max_updates, time_budget) limiting the AI of distant mobs, see set_ai_limits
+        self._ai_limits = (None, None)
+        # the visual effects, which never affect the game, see emit_effect
+        self._max_particles = MAX_PARTICLES
+        self._particles = ParticleSystem(self._max_particles, self._gravity, seed)
+
+        if config is not None:
+            self.apply_config(config)
 
     def read_config(self, filename: str):
         """
@@ -779,231 +891,348 @@ class MarioApp:
         hand.close()
         return config
 
-    def load_config(self):
+    def apply_config(self, config: dict):
+        """Apply configuration data, as read by read_config, to the session settings
+
+        Raises:
+            KeyError: If a required setting is missing from the configuration
         """
-        load the read configuration to the default settings
-        If the configuration file is invalid, exit the game with an error message.
+        self._config = config
+        self._level = config['World']['start']
+        self._gravity = (0, int(config['World']['gravity']))
+        self._x = float(config['Player']['x'])
+        self._y = float(config['Player']['y'])
+        self._mass = int(config['Player']['mass'])
+        self._max_health = int(config['Player']['health'])
+        self._max_velocity = int(config['Player']['max_velocity'])
+        self._max_particles = int(config['World'].get('max_particles', MAX_PARTICLES))
+
+    def start(self, level: str = None, **world_options):
+        """Create the player and build the world of the starting level
+
+        Parameters:
+            level (str): The level to start at, or None for the configured start level
+            **world_options: Any additional World constructor arguments
         """
-        config_file = filedialog.askopenfilename()
-        try:
-            config = self.read_config(config_file)
-            self._config = config
-            self._level = config['World']['start']
-            self._gravity = (0, int(config['World']['gravity']))
-            self._x = float(config['Player']['x'])
-            self._y = float(config['Player']['y'])
-            self._mass = int(config['Player']['mass'])
-            self._max_health = int(config['Player']['health'])
-            self._max_velocity = int(config['Player']['max_velocity'])
-        except UnboundLocalError:
-            tk.messagebox.showerror('Error', 'Bad Input')
-            self._master.destroy()
+        if level is not None:
+            self._level = level
+        self._builder = create_world_builder(self._gravity, seed=self._seed, **world_options)
+        self._particles = ParticleSystem(self._max_particles, self._gravity, self._seed)
+
+        self._player = Player(max_health=self._max_health)
+        self._player.set_jumping(True)
+        self._player.set_shoot(False)
+        self._niubi_until = None
+
+        self.reset_world(self._level)
+
+    def preload_level(self, filename: str, level: str):
+        """Provide the level string of the level file 'filename', so the next time
+        the level is built, it is not read from disk"""
+        self._preloaded[filename] = level
 
     def reset_world(self, new_level):
-        self._world = load_world(self._builder, new_level)
+        if self._gc is not None:
+            self._gc.before_build()
+        level = self._preloaded.pop(new_level, None)
+        if level is None:
+            level = load_level(new_level)
+        self._world = build_world(self._builder, level)
+        self._world_level = new_level
+        self._reloader = LevelReloader(self._builder, self._world, level)
+        self._completed = False
+        self._tunnelled = False
         self._world.add_player(self._player, self._x, self._y, self._mass)
         self._builder.clear()
+        self._particles.clear()
 
+        batch_ais = default_batch_ai()
+        navigate = self._navigate = batch_ais["navigate"]
+        navigate.set_graph(get_nav_graph(self._nav_graphs, new_level, self._world, navigate.get_profile()))
+        for ai_kind, batch_ai in batch_ais.items():
+            self._world.register_batch_ai(ai_kind, batch_ai)
         self._setup_collision_handlers()
-    
-    def menu_bar(self):
-        """
-        Create a menu bar
-        """
-        menubar = tk.Menu(self._master)
-        self._master.config(menu=menubar)
-        # within the menu bar create the file menu
-        filemenu = tk.Menu(menubar)
-        menubar.add_cascade(label="File", menu=filemenu)
-        # within the file menu create the file processing options
-        filemenu.add_command(label="Load Level", command=self.load_level)
-        filemenu.add_command(label="Reset Level", command=self.reset_level)
-        filemenu.add_command(label="High Score", command=self.show_scores)
-        filemenu.add_command(label="Exit", command=self.exit)
+        self._world.set_profiler(self._profiler)
+        self._world.set_ai_scheduler(AIScheduler(max_updates=self._ai_limits[0],
+                                                 time_budget=self._ai_limits[1]))
 
-    def load_level(self):
-        """
-        Input a level file and load that level
-        """
-        filename = filedialog.askopenfilename()
-        if filename:
-            self.reset_world(filename)
-        self._level = filename
+        if self._gc is not None:
+            self._gc.after_build()
 
-    def reset_level(self):
-        """
-        Reset the current level and all player progress
-        """
-        ans = messagebox.askokcancel('Restart Game', 'Restart Game?')
-        if ans:
-            self.reset_world(self._level)
-            self._player.clear_score()
-            self._player.change_health(self._player.get_max_health())
-            self.redraw_status()
-        else:
-            self._master.destroy()
+    def edit_level(self, level: str):
+        """Apply an edit of the level file the world was built from to the world
 
-    def exit(self):
-        """
-        exit the game
-        """
-        ans = messagebox.askokcancel('Exit Game', 'Really exit?')
-        if ans:
-            self._master.destroy()
+        Only the cells which changed are added to and removed from the world,
+        so the game carries on where it was. If the edit cannot be applied in
+        place (see LevelReloader.reload), the world is rebuilt from it instead.
 
-    def game_over(self):
-        """
-        See if the player is dead. If so, ask if want to start a new game or just quit.
+        Parameters:
+            level (str): The edited level string, as returned by load_level
         """
-        if self._player.is_dead():
-            ans = messagebox.askokcancel('Player is dead', 'Start Over?')
-            if ans:
-                self.reset_world('level1.txt')
-                self._level = 'level1.txt'
-                self._player.clear_score()
-                self._player.change_health(self._player.get_max_health())
-                self.redraw_status()
-            else:
-                self._master.destroy()
+        if self._reloader.reload(level) is None:
+            self.preload_level(self._world_level, level)
+            self.reset_world(self._world_level)
 
-    def read_score(self):
-        """
-        read the score records from the text file
-        Return:
-            score (dictionary): looks like this {'level':[('name', int), ('name', int), ('name', int), ], }
-        """
-        score = {}
-        with open("high_score.txt") as hand:
-            for line in hand:
-                line = line.rstrip()
-                if line.startswith("**") and line.endswith("**"):
-                    heading = line[2:-2]
-                    score[heading] = []
-                else:
-                    record = line.split(' : ')
-                    score[heading].append((record[0], int(record[1])))
-        hand.close()
-        return score
+    def restart(self, level: str):
+        """Restart the game from 'level', clearing all player progress"""
+        self.reset_world(level)
+        self._level = level
+        self._finished = False
+        self._player.clear_score()
+        self._player.change_health(self._player.get_max_health())
+        self._player.set_niubi(False)
+        self._niubi_until = None
 
-    def update_score(self):
-        """
-        ask for the name of the current player and get the current score.
-        read the high score records and see if the current player gets into the top 10 high scores for the current level
-        if so, update the high score text file with the lowest one replace
-        """
-        name = tk.simpledialog.askstring("your name", "what's your name", parent=self._master)  # 这人名字
-        score = self._player.get_score()
-        score_records = self.read_score()
-        # rank the record list of the current level from low to high by score in the dictionary
-        score_records[self._level].sort(key=lambda x: x[1])
-        if len(score_records[self._level]) < 10:
-            score_records[self._level].append((name, score))
-        elif score > score_records[self._level][0][1]:
-            score_records[self._level][0] = (name, score)  # replace the one with the lowest score
-
-        with open("high_score.txt", 'w') as handle:  # write back to the text file
-            for k, v in score_records.items():
-                handle.write('**{}**\n'.format(k))
-                for n in v:
-                    name, value = n
-                    handle.write('{} : {}\n'.format(name, value))
-        handle.close()
+    def get_world(self) -> World:
+        """(World) Returns the world of the current level"""
+        return self._world
 
-    def show_scores(self):
+    def get_player(self) -> Player:
+        """(Player) Returns the player of the game"""
+        return self._player
+
+    def get_level(self) -> str:
+        """(str) Returns the file name of the current level"""
+        return self._level
+
+    def get_world_level(self) -> str:
+        """(str) Returns the file name of the level the world was built from, which
+        differs from the current level in bonus levels (reached through a tunnel)"""
+        return self._world_level
+
+    def is_finished(self) -> bool:
+        """(bool) Returns True iff the last level of the game has been completed"""
+        return self._finished
+
+    def get_config(self) -> dict:
+        """(dict) Returns the configuration of the session, as read by read_config"""
+        return self._config
+
+    def get_seed(self) -> int:
+        """(int) Returns the seed of the worlds' random generators"""
+        return self._seed
+
+    def get_steps(self) -> int:
+        """(int) Returns the number of steps taken since the session started"""
+        return self._steps
+
+    def set_profiler(self, profiler):
+        """Measure the allocations of every frame with 'profiler' (see
+        game.profiler.FrameProfiler), or stop measuring if 'profiler' is None
+
+        A frame is a step and the drawing that follows it, so it ends when the
+        next step starts.
         """
-        Display the score records in a window
+        self._profiler = profiler
+        if self._world is not None:
+            self._world.set_profiler(profiler)
+        if self._gc is not None:
+            self._gc.set_profiler(profiler)
+
+    def set_gc_controller(self, controller: GCController):
+        """Schedule garbage collection with 'controller', which freezes the objects of
+        each level once built, or leave it to Python if 'controller' is None
+
+        The controller is started and stopped by the caller, whose game loop
+        should call its idle method in the idle part of every frame.
         """
-        score = self.read_score()
-        score_window = tk.Toplevel(self._master)
-        score_window.geometry('300x200')
-        score_window.title(self._level.rstrip(".txt").capitalize() + ' Top 10 Scores')
+        self._gc = controller
+        if controller is not None:
+            controller.set_profiler(self._profiler)
 
-        tk.Label(score_window, text="Top 10 Scores In This Level").pack(side=tk.TOP)
-        tk.Label(score_window, text="\n".join('name：{}\tscore: {}'.format(k, v)
-                                              for (k, v) in score[self._level])).pack(side=tk.TOP)
+    def get_profiler(self):
+        """(FrameProfiler) Returns the profiler measuring the game, or None"""
+        return self._profiler
+
+    def set_ai_limits(self, max_updates: int = None, time_budget: float = None):
+        """Limit the AI updates of mobs out of view in each step, see AIScheduler
+
+        A time budget depends on the speed of the machine, so recorded games
+        are not replayed exactly while one is set.
+
+        Parameters:
+            max_updates (int): The most out-of-view updates per step, or None
+            time_budget (float): The seconds of out-of-view updates per step, or None
+        """
+        self._ai_limits = (max_updates, time_budget)
+        if self._world is not None:
+            self._world.get_ai_scheduler().set_limits(max_updates, time_budget)
+
+    def get_particles(self) -> ParticleSystem:
+        """(ParticleSystem) Returns the particles of the visual effects"""
+        return self._particles
+
+    def emit_effect(self, effect: str, x: float, y: float):
+        """Emit the particles of a visual effect (see EFFECTS) at (x, y)"""
+        for sprite, count, speed, lifetime in EFFECTS[effect]:
+            self._particles.emit(x, y, count, sprite, speed, lifetime)
+
+    def get_ai_scheduler(self) -> AIScheduler:
+        """(AIScheduler) Returns the scheduler of the mobs' AI in the current world"""
+        return self._world.get_ai_scheduler()
+
+    def _update_ai_view(self):
+        """Centre the view of the AI scheduler on the player, as the game view
+        scrolls, so it does not depend on the size of any window"""
+        width, height = self._world.get_pixel_size()
+        view_width = min(MAX_WINDOW_SIZE[0], width)
+        x = self._player.get_position()[0]
+        left = min(max(x - view_width / 2, 0), width - view_width)
+        self._world.get_ai_scheduler().set_view(left, 0, left + view_width, height)
+
+    def set_recorder(self, recorder):
+        """Record every event handled and step taken by this session with 'recorder'
+        (see recording.Recording), or stop recording if 'recorder' is None"""
+        self._recorder = recorder
+
+    def handle_event(self, kind: str, argument):
+        """Handle an event from the player which affects the game
+
+        Every change to the game from outside the simulation goes through this
+        method, so a session can be recorded and replayed from its events.
+
+        Parameters:
+            kind (str): The kind of event, one of:
+                        - "input": the player's input changed to the command
+                          'argument', see set_input
+                        - "restart": restart the game at the level 'argument'
+                        - "load": load the level file 'argument'
+                        - "edit": apply the edited level string 'argument', see edit_level
+            argument (int | str): The argument of the event
+        """
+        if self._recorder is not None:
+            self._recorder.record(self._steps, kind, argument)
+
+        if kind == "input":
+            self.set_input(argument)
+        elif kind == "restart":
+            self.restart(argument)
+        elif kind == "load":
+            self.reset_world(argument)
+            self._level = argument
+        elif kind == "edit":
+            self.edit_level(argument)
+        else:
+            raise ValueError(f"Unknown event {kind!r}")
+
+    def get_input(self) -> int:
+        """(int) Returns the player's current input command"""
+        return self._input
+
+    def set_input(self, command: int):
+        """Set the player's input command, a bitwise combination of the INPUT_* constants
+
+        The command is held, and applied once at the start of every step until
+        it is changed.
+        """
+        self._input = command
 
     def get_next_level(self):
         """
-        (str) Return the string of next level file name
+        (str) Return the string of next level file name, or 'END' if the
+        configuration has no level after the current one (e.g. without any configuration)
         """
-        return self._config[self._level]['goal']
+        return self._config.get(self._level, {}).get('goal', 'END')
 
     def load_next_level(self):
         """load the next level in world"""
         self.reset_world(self.get_next_level())
 
-    def bind(self):
-        """Bind all the keyboard events to their event handlers."""
-        self._master.bind("<a>", self.key_press)
-        self._master.bind("<Left>", self.key_press)
-        self._master.bind("<d>", self.key_press)
-        self._master.bind("<Right>", self.key_press)
-        self._master.bind("<w>", self.key_press)
-        self._master.bind("<Up>", self.key_press)
-        self._master.bind("<space>", self.key_press)
-        self._master.bind("<s>", self.key_press)
-        self._master.bind("<Down>", self.key_press)
-        self._master.bind("<b>", self.key_press)
+    def pause(self):
+        """Stop stepping the simulation until resume is called as many times as pause"""
+        self._paused += 1
 
-    def key_press(self, e):
-        """
-        What to execute when certain key is pressed
-        """
-        key = e.keysym
-        if key == 'a' or key == 'Left':
-            self._move(-150, 0)
-        elif key == 'd' or key == 'Right':
-            self._move(150, 0)
-        elif key == 'w' or key == 'Up' or key == 'space':
-            self._jump()
-        elif key == 's' or key == 'Down':
-            self._duck()
-        elif key == "b":
-            self.shoot()
+    def resume(self):
+        """Undo one call to pause"""
+        self._paused -= 1
 
-    def redraw_status(self):
-        """
-        Redraw the player status bar with the updated health and score value
-        """
-        self.status_bar.clear()
-        self.status_bar.update_health(self._player.get_health(), self._player.is_niubi(), self._player)
-        self.status_bar.update_score(self._player.get_score())
+    def is_paused(self) -> bool:
+        """(bool) Returns True iff the simulation is paused"""
+        return self._paused > 0
 
-    def redraw(self):
-        """Redraw all the entities in the game canvas."""
-        self._view.delete(tk.ALL)
-        self._view.draw_entities(self._world.get_all_things())
-        self.redraw_status()
+    def complete_level(self):
+        """Mark the level as completed, after the player reached the flag
 
-    def scroll(self):
-        """Scroll the view along with the player in the center unless
-        they are near the left or right boundaries
+        The level is finished at the start of the next step, rather than in the
+        collision callback while the physics step is still running.
         """
-        x_position = self._player.get_position()[0]
-        half_screen = self._master.winfo_width() / 2
-        world_size = self._world.get_pixel_size()[0] - half_screen
+        self._completed = True
 
-        # Left side
-        if x_position <= half_screen:
-            self._view.set_offset((0, 0))
+    def finish_level(self):
+        """Move on to the next level after the player reached the flag"""
+        self._completed = False
+        next_level = self.get_next_level()
+        if next_level == 'END':
+            self._finished = True
+        else:
+            self.reset_world(next_level)
+            self._level = next_level
 
-        # Between left and right sides
-        elif half_screen <= x_position <= world_size:
-            self._view.set_offset((half_screen - x_position, 0))
+    def enter_tunnel(self):
+        """Mark the tunnel as entered, after the player ducked on it
 
-        # Right side
-        elif x_position >= world_size:
-            self._view.set_offset((half_screen - world_size, 0))
+        As with complete_level, the world is rebuilt at the start of the next
+        step, rather than in the collision callback. A tunnel without a level
+        after the current one leads nowhere.
+        """
+        if self.get_next_level() != 'END':
+            self._tunnelled = True
+
+    def go_through_tunnel(self):
+        """Build the world of the level the tunnel leads to, keeping the current level"""
+        self._tunnelled = False
+        self.reset_world(self.get_next_level())
 
     def step(self):
-        """Step the world physics and redraw the canvas."""
+        """Step the world physics, unless paused"""
+        if self._profiler is not None:
+            self._profiler.end_frame()
+        if self._completed:
+            self.finish_level()
+        elif self._tunnelled:
+            self.go_through_tunnel()
+        if self.is_paused():
+            return
+
+        # counted before stepping, so events raised during the step (e.g. by
+        # collisions) are replayed before the following step
+        self._steps += 1
+        self._apply_input(self._input, self._last_input)
+        self._last_input = self._input
+
+        self._update_ai_view()
         data = (self._world, self._player)
         self._world.step(data)
+        self._particles.step(STEP_SIZE)
+        if self._niubi_until is not None and self._steps >= self._niubi_until:
+            self._player.set_niubi(False)
+            self._niubi_until = None
 
-        self.scroll()
-        self.redraw()
-        self.game_over()
-        self._master.after(10, self.step)  # refresh
+        if self._recorder is not None:
+            self._recorder.on_step(self)
+
+    def _apply_input(self, command: int, last_command: int):
+        """Apply the input command held during a step
+
+        Walking pushes the player towards the walking speed, rather than setting
+        its velocity, so a held command neither cancels gravity nor pushes the
+        player through walls. Shooting only happens when its input is first pressed.
+
+        Parameters:
+            command (int): The input command of this step
+            last_command (int): The input command of the previous step
+        """
+        if command & INPUT_LEFT:
+            self._walk(-WALK_SPEED)
+        elif command & INPUT_RIGHT:
+            self._walk(WALK_SPEED)
+        if command & INPUT_JUMP and not self._player.is_jumping():
+            self._move(self._player.get_velocity()[0], -200)
+            self._player.set_jumping(True)
+        if command & INPUT_DUCK:
+            self._duck()
+        if command & INPUT_SHOOT and not last_command & INPUT_SHOOT:
+            self.shoot()
 
     def _move(self, dx: int, dy: int):
         """
@@ -1014,6 +1243,13 @@ class MarioApp:
         """
         self._player.set_velocity((dx, dy))
 
+    def _walk(self, vx: float):
+        """
+        push the player towards walking at vx along the x axis during the next step,
+        see DynamicEntity.push_horizontally
+        """
+        self._player.push_horizontally(vx, STEP_SIZE)
+
     def _jump(self):
         """
         if the player is not jumping, make it jump, and change the jumping status to True.
@@ -1043,60 +1279,79 @@ class MarioApp:
             print('不射')
 
     def _setup_collision_handlers(self):
-        self._world.add_collision_handler("player", "item", on_begin=self._handle_player_collide_item)
-        self._world.add_collision_handler("player", "block", on_begin=self._handle_player_collide_block,
-                                          on_separate=self._handle_player_separate_block)
-        self._world.add_collision_handler("player", "mob", on_begin=self._handle_player_collide_mob)
-        self._world.add_collision_handler("mob", "block", on_begin=self._handle_mob_collide_block)
-        self._world.add_collision_handler("mob", "mob", on_begin=self._handle_mob_collide_mob)
-        self._world.add_collision_handler("mob", "item", on_begin=self._handle_mob_collide_item)
-
-    def _handle_mob_collide_block(self, mob: Mob, block: Block, data,
-                                  arbiter: pymunk.Arbiter) -> bool:
-        if mob.get_id() == "fireball" or mob.get_id() == 'bullet_l' or mob.get_id() == 'bullet_r':
-            if block.get_id() == "brick":
-                self._world.remove_block(block)
-                self._world.remove_mob(mob)
-            else:
-                self._world.remove_mob(mob)
-        elif mob.get_id() == "mushroom":  # mushroom bounces back a little when encountering blocks
-            if get_collision_direction(mob, block) == "R" or get_collision_direction(mob, block) == "L":
-                mob.set_tempo(-mob.get_tempo())
-        elif mob.get_id() == 'gang':  # gang jumps over the blocks when encountering them
-            if get_collision_direction(mob, block) == "R":
-                mob.set_velocity((50, -350))
-            elif get_collision_direction(mob, block) == "L":
-                mob.set_velocity((-50, -350))
+        world = self._world
+        world.add_collision_handler("player", "block", on_begin=self._handle_player_collide_block,
+                                    on_pre_solve=self._handle_player_touch_block,
+                                    on_separate=self._handle_player_separate_block)
+        world.add_collision_handler("player", "mob", on_begin=self._handle_player_collide_mob)
+
+        for item_id in ITEMS.values():
+            world.register_collision("player", "item", "player", item_id, self._handle_player_collect_item)
+        world.register_collision("player", "item", ANY_ID, ANY_ID, self._ignore_collision)
+
+        for projectile_id in PROJECTILES:
+            world.register_collision("mob", "block", projectile_id, "brick", self._handle_projectile_destroy_block)
+            world.register_collision("mob", "block", projectile_id, ANY_ID, self._handle_projectile_hit_block)
+        world.register_collision("mob", "block", "mushroom", ANY_ID, self._handle_mushroom_collide_block)
+        world.register_collision("mob", "block", "gang", ANY_ID, self._handle_gang_collide_block)
+
+        for projectile_id in PROJECTILES:
+            world.register_collision("mob", "mob", projectile_id, ANY_ID, self._handle_mobs_destroy,
+                                     symmetric=True)
+        world.register_collision("mob", "mob", "mushroom", "mushroom", self._handle_mushrooms_collide)
+        world.register_collision("mob", "mob", ANY_ID, ANY_ID, self._handle_mobs_destroy)
+
+    def _ignore_collision(self, thing_a: Entity, thing_b: Entity, data,
+                          arbiter: pymunk.Arbiter) -> bool:
+        return False
 
+    def _handle_projectile_destroy_block(self, mob: Mob, block: Block, data,
+                                         arbiter: pymunk.Arbiter) -> bool:
+        self.emit_effect("debris", *block.get_position())
+        self._world.remove_block(block)
+        self._world.remove_mob(mob)
         return True
 
-    def _handle_mob_collide_item(self, mob: Mob, block: Block, data,
-                                 arbiter: pymunk.Arbiter) -> bool:
-        return False
+    def _handle_projectile_hit_block(self, mob: Mob, block: Block, data,
+                                     arbiter: pymunk.Arbiter) -> bool:
+        self.emit_effect("explosion", *mob.get_position())
+        self._world.remove_mob(mob)
+        return True
 
-    def _handle_mob_collide_mob(self, mob1: Mob, mob2: Mob, data,
-                                arbiter: pymunk.Arbiter) -> bool:
-        if mob1.get_id() == "fireball" or mob2.get_id() == "fireball":
-            self._world.remove_mob(mob1)
-            self._world.remove_mob(mob2)
-        elif mob1.get_id() == 'bullet_l' or mob1.get_id == 'bullet_r' or mob2.get_id() == 'bullet_l' or mob2.get_id == 'bullet_r':
-            self._world.remove_mob(mob1)
-            self._world.remove_mob(mob2)
-        elif mob1.get_id() == "gang" and mob2.get_id() == "mushroom":
-            return False
-        elif mob1.get_id() == "mushroom" and mob2.get_id() == "gang":
-            return False
-        elif mob1.get_id() == "gang" and mob2.get_id() == "gang":
-            return False
-        elif mob1.get_id() == "mushroom" and mob2.get_id() == "mushroom":
-            mob1.set_tempo(-mob1.get_tempo())
-            mob2.set_tempo(-mob2.get_tempo())
-        else:
-            self._world.remove_mob(mob1)
-            self._world.remove_mob(mob2)
+    def _handle_mushroom_collide_block(self, mob: Mob, block: Block, data,
+                                       arbiter: pymunk.Arbiter) -> bool:
+        # mushroom bounces back a little when encountering blocks
+        if get_collision_direction(mob, block) in ("R", "L"):
+            mob.set_tempo(-mob.get_tempo())
+        return True
+
+    def _handle_gang_collide_block(self, mob: Mob, block: Block, data,
+                                   arbiter: pymunk.Arbiter) -> bool:
+        # gang jumps over the blocks when encountering them, unless it is finding
+        # its way along a path, whose jumps NavigateAI plans itself
+        if self._navigate is not None and self._navigate.has_path(mob):
+            return True
+        direction = get_collision_direction(mob, block)
+        if direction == "R":
+            mob.set_velocity((50, -350))
+        elif direction == "L":
+            mob.set_velocity((-50, -350))
+        return True
+
+    def _handle_mobs_destroy(self, mob1: Mob, mob2: Mob, data,
+                             arbiter: pymunk.Arbiter) -> bool:
+        self.emit_effect("explosion", *mob1.get_position())
+        self._world.remove_mob(mob1)
+        self._world.remove_mob(mob2)
+        return False
 
+    def _handle_mushrooms_collide(self, mob1: Mob, mob2: Mob, data,
+                                  arbiter: pymunk.Arbiter) -> bool:
+        mob1.set_tempo(-mob1.get_tempo())
+        mob2.set_tempo(-mob2.get_tempo())
         return False
-    def _handle_player_collide_item(self, player: Player, dropped_item: DroppedItem,
+
+    def _handle_player_collect_item(self, player: Player, dropped_item: DroppedItem,
                                     data, arbiter: pymunk.Arbiter) -> bool:
         """Callback to handle collision between the player and a (dropped) item. If the player has sufficient space in
         their to pick up the item, the item will be removed from the game world.
@@ -1114,16 +1369,13 @@ class MarioApp:
                    (more generally, collision callbacks return True iff the collision should be considered valid; i.e.
                    returning False makes the world ignore the collision)
         """
-
-        if dropped_item.get_id() == 'coin':
-            dropped_item.collect(self._player)
-            self._world.remove_item(dropped_item)
-        elif dropped_item.get_id() == 'star':
-            dropped_item.collect(self._player)
-            self._world.remove_item(dropped_item)
-        elif dropped_item.get_id() == 'flower':
-            dropped_item.collect(self._player)
-            self._world.remove_item(dropped_item)
+        dropped_item.collect(self._player)
+        if isinstance(dropped_item, Coin):
+            self.emit_effect("sparkle", *dropped_item.get_position())
+        if dropped_item.get_id() == "star":
+            # the star's invincibility wears off, items have no access to the session
+            self._niubi_until = self._steps + round(STAR_DURATION / STEP_SIZE)
+        self._world.remove_item(dropped_item)
         return False
 
     def _handle_player_collide_block(self, player: Player, block: Block, data,
@@ -1136,25 +1388,11 @@ class MarioApp:
             if get_collision_direction(player, block) == "A":
                 block.on_hit(arbiter, data)
             else:
-                # tell the player to input their name and see if the score records need to be updated
-                self.update_score()
-                if self.get_next_level() == 'END':  # if there's no further level, ask if start over
-                    ans = messagebox.askokcancel('Good job, you finish the game', 'Start Over?')
-                    if ans:
-                        self.reset_world('level1.txt')
-                        self._level = 'level1.txt'
-                        self._player.clear_score()
-                        self._player.change_health(self._player.get_max_health())
-                        self.redraw_status()
-                    else:
-                        self._master.destroy()
-                else:
-                    self.reset_world(self.get_next_level())
-                    self._level = self.get_next_level()
+                self.complete_level()
         elif block.get_id() == "tunnel":
             if get_collision_direction(player, block) == "A" and self._player.is_duck() is True:
                 self._player.set_duck(False)
-                self.reset_world(self.get_next_level())
+                self.enter_tunnel()
         elif block.get_id() == 'switches':
             if block.is_active():
                 block.on_hit(arbiter, (self._world, player))
@@ -1162,13 +1400,33 @@ class MarioApp:
         block.on_hit(arbiter, (self._world, player))
         return True
 
+    def _handle_player_touch_block(self, player: Player, block: Block, data,
+                                   arbiter: pymunk.Arbiter) -> bool:
+        # a contact is at the side if the boxes overlap less across than down
+        own, other = player.get_shape().bb, block.get_shape().bb
+        overlap_x = min(own.right, other.right) - max(own.left, other.left)
+        overlap_y = min(own.top, other.top) - max(own.bottom, other.bottom)
+        if overlap_x < overlap_y:
+            # walking pushes the player into walls, which must not hold them up
+            arbiter.friction = 0
+        elif player.is_jumping() and own.top + own.bottom < other.top + other.bottom \
+                and player.get_velocity()[1] >= 0:
+            # a contact begun at the player's side or corner (e.g. walking onto a
+            # block next to a wall) only becomes a landing while already touching
+            player.set_jumping(False)
+        return True
+
     def _handle_player_collide_mob(self, player: Player, mob: Mob, data,
                                    arbiter: pymunk.Arbiter) -> bool:
         if player.is_niubi():
+            self.emit_effect("explosion", *mob.get_position())
             self._world.remove_mob(mob)
         elif player.is_shoot():
             player.set_shoot(False)
         else:
+            if isinstance(mob, Fireball):
+                # the fireball explodes on the player
+                self.emit_effect("explosion", *mob.get_position())
             mob.on_hit(arbiter, (self._world, player))
         return True
 
@@ -1177,6 +1435,383 @@ class MarioApp:
         return True
 
 
+class MarioApp(GameSession):
+    """High-level app class for Mario, a 2d platformer"""
+
+    def __init__(self, master: tk.Tk):
+        """Construct a new game of a MarioApp game.
+
+        Parameters:
+            master (tk.Tk): tkinter root widget
+        """
+        super().__init__(seed=random.randrange(2 ** 32))
+        self._master = master
+
+        # file and database I/O runs on a worker thread, see _poll_tasks
+        self._tasks = TaskRunner()
+        self._scores = ScoreStore()
+        self._watcher = LevelWatcher()
+        self._particle_layer = ParticleLayer()
+        # draws the world, once the game is set up, see _setup
+        self._renderer = None
+
+        # bitwise INPUT_* of the keys held down, and of the keys pressed since the last step
+        self._held = 0
+        self._pressed = 0
+
+        # garbage is collected between frames rather than during them
+        controller = GCController()
+        controller.start()
+        self.set_gc_controller(controller)
+        master.protocol("WM_DELETE_WINDOW", self.destroy)
+
+        self._master.update_idletasks()
+        self._poll_tasks()
+        self.load_config()
+
+    def reset_world(self, new_level):
+        super().reset_world(new_level)
+        self._preload_sprites()
+
+    def _preload_sprites(self):
+        """Load every sprite the level of the world may draw before its first frame,
+        and evict those unused for a few levels, see AssetManager.begin_level"""
+        if self._renderer is None:
+            return
+        entity_types = level_entity_types(self._builder, self._reloader.get_level()) | {"player"}
+        self._renderer.get_assets().begin_level(self._renderer.get_entity_sprites(entity_types))
+
+    def _poll_tasks(self):
+        """Run the callbacks of finished I/O tasks, on the Tk loop"""
+        self._tasks.poll()
+        self._master.after(TASK_POLL_INTERVAL, self._poll_tasks)
+
+    def _load_in_background(self, level: str, callback, *args):
+        """Read the level file 'level' on the I/O thread, then call 'callback' with 'args'
+
+        The game is paused until the level is read, so the simulation does not
+        depend on how long reading takes.
+        """
+        self.pause()
+
+        def loaded(data):
+            self.preload_level(level, data)
+            self.resume()
+            callback(*args)
+
+        def failed(error):
+            self.resume()
+            messagebox.showerror('Error', 'Could not load {}'.format(level))
+
+        self._tasks.submit(load_level, level, on_done=loaded, on_error=failed)
+
+    def _watch_level(self):
+        """Check the level file of the world for edits on the I/O thread, and apply
+        those saved since the last check to the world, see GameSession.edit_level"""
+        filename = self.get_world_level()
+
+        def checked(level):
+            # the world may have moved on to another level while the file was read
+            if (level is not None and filename == self.get_world_level()
+                    and level != self._reloader.get_level()):
+                self.handle_event("edit", level)
+                self.redraw()
+            self._master.after(LEVEL_WATCH_INTERVAL, self._watch_level)
+
+        def failed(error):
+            # e.g. the file is being replaced by the editor; try again at the next check
+            self._master.after(LEVEL_WATCH_INTERVAL, self._watch_level)
+
+        self._tasks.submit(self._watcher.check, filename, on_done=checked, on_error=failed)
+
+    def _setup(self, game):
+        """Start the game once its configuration and first level have been read
+
+        Parameters:
+            game (tuple<dict, str>): The configuration and the level string of the start level
+        """
+        config, level = game
+        self.apply_config(config)
+        self.preload_level(self._level, level)
+
+        # record the game, so it can be saved and replayed headless
+        self._recording = Recording(self._seed, self._config, self._level)
+        self.set_recorder(self._recording)
+
+        self.start()
+
+        master = self._master
+        scale = int(self._config['World'].get('scale', 1))
+        self._renderer = MarioViewRenderer(BLOCK_IMAGES, ITEM_IMAGES, MOB_IMAGES, scale)
+
+        self._preload_sprites()
+
+        size = tuple(map(min, zip(MAX_WINDOW_SIZE, self._world.get_pixel_size())))
+        self._view = GameView(master, size, self._renderer)
+        self._view.pack()
+
+        self.bind()
+
+        self.menu_bar()
+
+        # create the character status bar
+        self.status_bar = Status(master)
+        self.status_bar.pack()
+
+        # Wait for window to update before continuing
+        master.update_idletasks()
+        self.step()
+        self._watch_level()
+
+    def load_config(self):
+        """
+        load the read configuration to the default settings
+        If the configuration file is invalid, exit the game with an error message.
+        """
+        config_file = filedialog.askopenfilename()
+
+        def read_game():
+            config = self.read_config(config_file)
+            return config, load_level(config['World']['start'])
+
+        def failed(error):
+            tk.messagebox.showerror('Error', 'Bad Input')
+            self.destroy()
+
+        self._tasks.submit(read_game, on_done=self._setup, on_error=failed)
+
+    def menu_bar(self):
+        """
+        Create a menu bar
+        """
+        menubar = tk.Menu(self._master)
+        self._master.config(menu=menubar)
+        # within the menu bar create the file menu
+        filemenu = tk.Menu(menubar)
+        menubar.add_cascade(label="File", menu=filemenu)
+        # within the file menu create the file processing options
+        filemenu.add_command(label="Load Level", command=self.load_level)
+        filemenu.add_command(label="Reset Level", command=self.reset_level)
+        filemenu.add_command(label="High Score", command=self.show_scores)
+        filemenu.add_command(label="Save Replay", command=self.save_replay)
+        filemenu.add_command(label="Exit", command=self.exit)
+
+        # within the menu bar create the view menu, to enlarge the game
+        viewmenu = tk.Menu(menubar)
+        menubar.add_cascade(label="View", menu=viewmenu)
+        self._scale_choice = tk.IntVar(self._master, self._view.get_scale())
+        for scale in RENDER_SCALES:
+            viewmenu.add_radiobutton(label=f"{scale}x", variable=self._scale_choice, value=scale,
+                                     command=lambda scale=scale: self.set_scale(scale))
+        viewmenu.add_separator()
+        viewmenu.add_command(label="Asset Statistics", command=self.show_asset_stats)
+
+    def set_scale(self, scale: int):
+        """Enlarge the game on screen by the integer factor 'scale'
+
+        Only the sprites in use are made again at the new scale, see SpriteCache.
+        """
+        self._view.set_scale(scale)
+        self._master.update_idletasks()
+        self.scroll()
+        self.redraw()
+
+    def load_level(self):
+        """
+        Input a level file and load that level
+        """
+        filename = filedialog.askopenfilename()
+        if filename:
+            self._load_in_background(filename, self.handle_event, "load", filename)
+
+    def save_replay(self):
+        """
+        Save the recording of this game to a file, to be replayed with replay.py
+        """
+        filename = filedialog.asksaveasfilename(defaultextension=".json")
+        if filename:
+            self._recording.save(filename)
+
+    def reset_level(self):
+        """
+        Reset the current level and all player progress
+        """
+        ans = messagebox.askokcancel('Restart Game', 'Restart Game?')
+        if ans:
+            self._load_in_background(self._level, self._start_over, self._level)
+        else:
+            self.destroy()
+
+    def destroy(self):
+        """Close the window, giving garbage collection back to Python"""
+        self._gc.stop()
+        self._master.destroy()
+
+    def exit(self):
+        """
+        exit the game
+        """
+        ans = messagebox.askokcancel('Exit Game', 'Really exit?')
+        if ans:
+            self.destroy()
+
+    def _start_over(self, level: str):
+        """Restart the game from 'level', clearing all player progress"""
+        self.handle_event("restart", level)
+        self.redraw_status()
+
+    def game_over(self):
+        """
+        See if the player is dead. If so, ask if want to start a new game or just quit.
+        """
+        if self._player.is_dead() and not self.is_paused():
+            ans = messagebox.askokcancel('Player is dead', 'Start Over?')
+            if ans:
+                self._load_in_background('level1.txt', self._start_over, 'level1.txt')
+            else:
+                self.destroy()
+
+    def update_score(self):
+        """
+        ask for the name of the current player and get the current score.
+        if the player gets into the top scores for the current level, record it
+        """
+        name = tk.simpledialog.askstring("your name", "what's your name", parent=self._master)  # 这人名字
+        if name is not None:
+            self._tasks.submit(self._scores.add, self._level, name, self._player.get_score())
+
+    def show_scores(self):
+        """
+        Display the score records in a window
+        """
+        score_window = tk.Toplevel(self._master)
+        score_window.geometry('300x200')
+        score_window.title(self._level.rstrip(".txt").capitalize() + f' Top {TOP_SCORES} Scores')
+
+        tk.Label(score_window, text=f"Top {TOP_SCORES} Scores In This Level").pack(side=tk.TOP)
+        tk.Label(score_window, text="\n".join('name：{}\tscore: {}'.format(k, v)
+                                              for (k, v) in self._scores.get_top(self._level))).pack(side=tk.TOP)
+
+    def show_asset_stats(self):
+        """
+        Display how the images drawn were loaded, see AssetManager.get_stats
+        """
+        stats = self._renderer.get_assets().get_stats()
+        drawn = stats["hits"] + stats["misses"]
+        messagebox.showinfo('Asset Statistics', "\n".join([
+            f"Sprites drawn: {drawn}, of which loaded mid-frame: {stats['misses']}",
+            f"Hit rate: {stats['hits'] / drawn:.2%}" if drawn else "Hit rate: -",
+            f"Preloaded: {stats['preloads']}, evicted: {stats['evicted']}",
+            f"Load time: {stats['load_time'] * 1000:.1f} ms",
+            f"Kept: {stats['images']} images, {stats['bytes'] / 2 ** 20:.1f} MiB",
+        ]))
+
+    def finish_level(self):
+        """Record the player's score, then move on to the next level, or offer
+        to start over if this was the last level. The game is paused while the
+        next level is read"""
+        self._completed = False
+        # tell the player to input their name and see if the score records need to be updated
+        self.update_score()
+        next_level = self.get_next_level()
+        if next_level == 'END':  # if there's no further level, ask if start over
+            ans = messagebox.askokcancel('Good job, you finish the game', 'Start Over?')
+            if ans:
+                self._load_in_background('level1.txt', self._start_over, 'level1.txt')
+            else:
+                self.destroy()
+        else:
+            self._load_in_background(next_level, super().finish_level)
+
+    def go_through_tunnel(self):
+        """Move on to the level the tunnel leads to, pausing the game while it is read"""
+        self._tunnelled = False
+        self._load_in_background(self.get_next_level(), super().go_through_tunnel)
+
+    def bind(self):
+        """Bind all the keyboard events to their event handlers."""
+        self._master.bind("<KeyPress>", self.key_press)
+        self._master.bind("<KeyRelease>", self.key_release)
+
+    def key_press(self, e):
+        """
+        Track a key being held down; the input is only applied at the next step
+        """
+        bit = KEY_INPUTS.get(e.keysym, 0)
+        self._held |= bit
+        self._pressed |= bit
+
+    def key_release(self, e):
+        """
+        Track a key being released
+        """
+        self._held &= ~KEY_INPUTS.get(e.keysym, 0)
+
+    def poll_input(self):
+        """
+        Sample the keys held (or pressed at all) since the last step into the
+        player's input command
+        """
+        # a key pressed and released (or auto-repeated) between two steps still counts
+        command = self._held | self._pressed
+        self._pressed = 0
+        if command != self.get_input():
+            self.handle_event("input", command)
+
+    def redraw_status(self):
+        """
+        Redraw the player status bar with the updated health and score value
+        """
+        self.status_bar.clear()
+        self.status_bar.update_health(self._player.get_health(), self._player.is_niubi(), self._player)
+        self.status_bar.update_score(self._player.get_score())
+
+    def redraw(self):
+        """Redraw all the entities in the game canvas."""
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.enter("render")
+        self._view.delete(tk.ALL)
+        self._view.draw_shapes(self._world.get_all_shapes())
+        self._particle_layer.draw(self._particles, self._view, self._view.get_offset())
+        self.redraw_status()
+        if profiler is not None:
+            profiler.leave()
+
+    def scroll(self):
+        """Scroll the view along with the player in the center unless
+        they are near the left or right boundaries
+        """
+        x_position = self._player.get_position()[0]
+        half_screen = self._view.get_size()[0] / 2
+        world_size = self._world.get_pixel_size()[0] - half_screen
+
+        # Left side
+        if x_position <= half_screen:
+            self._view.set_offset((0, 0))
+
+        # Between left and right sides
+        elif half_screen <= x_position <= world_size:
+            self._view.set_offset((half_screen - x_position, 0))
+
+        # Right side
+        elif x_position >= world_size:
+            self._view.set_offset((half_screen - world_size, 0))
+
+    def step(self):
+        """Step the world physics and redraw the canvas."""
+        self.poll_input()
+        super().step()
+
+        self.scroll()
+        self.redraw()
+        self.game_over()
+
+        # collections take their time out of the delay before the next frame
+        pause = self._gc.idle(FRAME_DELAY / 1000)
+        self._master.after(max(0, FRAME_DELAY - int(pause * 1000)), self.step)  # refresh
+
+
 class Status(tk.Frame):
     """
     The status bar widget for the player.
@@ -0,0 +1,251 @@
+"""Runs many independent, headless games side by side across worker processes.
+
+Every world is a GameSession built from a level file inside a worker process
+(pymunk spaces cannot be pickled). All worlds are stepped in lockstep: each
+call to BatchRunner.step sends one input command per world, a bitwise
+combination of the app.INPUT_* constants, and returns one WorldSummary per world.
+
+Example:
+    with BatchRunner(["level1.txt"] * 8) as runner:
+        for _ in range(1000):
+            summaries = runner.step([INPUT_RIGHT | INPUT_JUMP] * len(runner))
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+from typing import List, NamedTuple, Sequence, Tuple
+
+from app import GameSession, INPUT_RIGHT, INPUT_JUMP
+
+
+class WorldSummary(NamedTuple):
+    """Compact state of one world after a step"""
+    level: str
+    x: float
+    y: float
+    vx: float
+    vy: float
+    health: float
+    score: int
+    dead: bool
+    finished: bool
+    things: int
+
+
+class WorkerError(RuntimeError):
+    """Raised in the parent process when a worker process failed, with the
+    worker's traceback as its message"""
+
+
+def split_batch(count: int, workers: int = None) -> List[Tuple[int, int]]:
+    """Splits a batch of 'count' worlds into contiguous chunks, one per worker
+
+    Parameters:
+        count (int): The number of worlds in the batch
+        workers (int): The number of workers, defaults to the number of CPUs
+
+    Returns:
+        (list<tuple<int, int>>): The (start, end) indices of each worker's worlds
+    """
+    workers = min(workers or os.cpu_count() or 1, count)
+    chunk, remainder = divmod(count, workers)
+
+    bounds = []
+    start = 0
+    for index in range(workers):
+        end = start + chunk + (index < remainder)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def summarise(session: GameSession) -> WorldSummary:
+    """(WorldSummary) Returns the compact state of the world of 'session'"""
+    player = session.get_player()
+    x, y = player.get_position()
+    vx, vy = player.get_velocity()
+    return WorldSummary(session.get_level(), x, y, vx, vy, player.get_health(),
+                        player.get_score(), player.is_dead(), session.is_finished(),
+                        sum(1 for _ in session.get_world().get_all_shapes()))
+
+
+def run_worker(connection, serve, *args):
+    """Runs 'serve(connection, *args)' in a worker process. An exception it raises
+    is sent to the parent as a WorkerError, rather than leaving the pipe to close
+    unanswered, see receive"""
+    try:
+        serve(connection, *args)
+    except Exception:
+        connection.send(WorkerError(traceback.format_exc()))
+        connection.close()
+
+
+def receive(connections) -> list:
+    """Returns the next reply of each worker in 'connections'
+
+    Every reply is received, even after a failure, so the workers which did
+    not fail stay in step with the parent.
+
+    Raises:
+        WorkerError: If a worker failed, see run_worker
+    """
+    replies = [connection.recv() for connection in connections]
+    for reply in replies:
+        if isinstance(reply, WorkerError):
+            raise reply
+    return replies
+
+
+def _serve(connection, levels: List[str], config: dict, auto_reset: bool,
+           world_options: dict):
+    """Serve step, reset & close commands for the sessions of 'levels' until closed"""
+    sessions = []
+    for level in levels:
+        session = GameSession(config)
+        session.start(level, **world_options)
+        sessions.append(session)
+
+    while True:
+        command, argument = connection.recv()
+        if command == "step":
+            for session, level, inputs in zip(sessions, levels, argument):
+                if auto_reset and (session.get_player().is_dead() or session.is_finished()):
+                    session.restart(level)
+                session.set_input(inputs)
+                session.step()
+        elif command == "reset":
+            for session, level in zip(sessions, levels):
+                session.restart(level)
+        elif command == "close":
+            connection.close()
+            return
+        connection.send([summarise(session) for session in sessions])
+
+
+class BatchRunner:
+    """Steps a batch of independent worlds in lockstep across a pool of worker processes.
+
+    The worlds are split into contiguous chunks, one per worker, so the inputs
+    and summaries of each step are sent in a single message per worker.
+    """
+
+    def __init__(self, levels: Sequence[str], workers: int = None, config: dict = None,
+                 auto_reset: bool = True, **world_options):
+        """Constructor
+
+        Parameters:
+            levels (list<str>): The level file each world is built from
+            workers (int): The number of worker processes, defaults to the number of CPUs
+            config (dict): Game configuration, as read by GameSession.read_config
+            auto_reset (bool): Whether worlds whose player died, or which were
+                               finished, restart their level on the following step
+            **world_options: Any additional World constructor arguments
+        """
+        self._levels = list(levels)
+        if not self._levels:
+            raise ValueError("A batch needs at least one world")
+
+        self._bounds = split_batch(len(self._levels), workers)
+        self._connections = []
+        self._processes = []
+        for start, end in self._bounds:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_worker, daemon=True,
+                args=(child, _serve, self._levels[start:end], config, auto_reset, world_options))
+            process.start()
+            child.close()
+
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_levels(self) -> List[str]:
+        """(list<str>) Returns the level file of each world in the batch"""
+        return list(self._levels)
+
+    def _gather(self) -> List[WorldSummary]:
+        """(list<WorldSummary>) Returns the replies of all workers, in world order
+
+        Raises:
+            WorkerError: If a worker failed
+        """
+        summaries = []
+        for reply in receive(self._connections):
+            summaries.extend(reply)
+        return summaries
+
+    def step(self, inputs: Sequence[int]) -> List[WorldSummary]:
+        """Step every world once
+
+        Parameters:
+            inputs (list<int>): The input command of each world, see GameSession.set_input
+
+        Returns:
+            (list<WorldSummary>): The state of each world after the step
+        """
+        if len(inputs) != len(self._levels):
+            raise ValueError(f"Expected {len(self._levels)} inputs, got {len(inputs)}")
+
+        # send to every worker before waiting on any, so the workers step concurrently
+        for connection, (start, end) in zip(self._connections, self._bounds):
+            connection.send(("step", list(inputs[start:end])))
+        return self._gather()
+
+    def reset(self) -> List[WorldSummary]:
+        """(list<WorldSummary>) Restarts every world at its level and returns their states"""
+        for connection in self._connections:
+            connection.send(("reset", None))
+        return self._gather()
+
+    def close(self):
+        """Stops all worker processes"""
+        for connection in self._connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step many headless worlds in parallel")
+    parser.add_argument("levels", nargs='+', help="level files to build the worlds from")
+    parser.add_argument("--copies", type=int, default=1, help="worlds per level file")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--steps", type=int, default=300)
+    args = parser.parse_args()
+
+    with BatchRunner(args.levels * args.copies, workers=args.workers) as runner:
+        inputs = [INPUT_RIGHT] * len(runner)
+        start = time.perf_counter()
+        for step in range(args.steps):
+            summaries = runner.step([command | INPUT_JUMP if step % 40 == 0 else command
+                                     for command in inputs])
+        elapsed = time.perf_counter() - start
+
+    print(f"{len(runner)} worlds x {args.steps} steps: "
+          f"{len(runner) * args.steps / elapsed:.0f} world steps/s")
+    for summary in summaries:
+        print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""Headless benchmarks of the game engine on the shipped and synthetic levels.
+
+Worlds are built exactly as the game builds them, but without a window; the
+player runs to the right, jumping now and then, while the world is stepped.
+
+Example:
+    python benchmark.py broadphase --steps 500 --scales 10 100
+    python benchmark.py physics
+    python benchmark.py build --repeats 5
+    python benchmark.py allocations --scales --budget world=4096 ai=2048
+    python benchmark.py gc
+    python benchmark.py reload --edits 20
+    python benchmark.py ai --max-updates 4 --time-budget 0.001
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from app import INPUT_JUMP, INPUT_RIGHT, GameSession, create_world_builder
+from game.ai import AIScheduler, default_batch_ai
+from game.gc_control import GCController
+from game.profiler import FrameProfiler
+from game.world import World, BROADPHASES, PHYSICS_BACKENDS
+from level import (build_world as build_level, load_world, load_level, LevelReloader,
+                   SPACE_INSERTION)
+from level_generator import scale_level, write_level
+from player import Player
+
+SHIPPED_LEVELS = ("level1.txt", "level2.txt", "level3.txt")
+
+GRAVITY = (0, 400)
+PLAYER_START = (30, 30)
+PLAYER_MASS = 100
+# The width of the view around the player, as the game's widest window
+VIEW_WIDTH = 1080
+# The limits of the AI updates of mobs out of view per step in the "limited" mode
+# of the ai benchmark: the most updates, and the seconds they may take
+AI_MAX_UPDATES = 2
+AI_TIME_BUDGET = 0.0005
+# The steps of each level taken before its allocations are measured
+ALLOCATION_WARMUP = 10
+
+
+def build_world(level: str, **world_options) -> Tuple[World, Player]:
+    """Build the world of a level file, with a player at the start position.
+
+    Parameters:
+        level (str): The level file to build.
+        **world_options: Any additional World constructor arguments.
+
+    Returns:
+        (tuple<World, Player>): The built world and its player.
+    """
+    builder = create_world_builder(GRAVITY, **world_options)
+    world = load_world(builder, level)
+
+    player = Player(max_health=10)
+    player.set_jumping(True)
+    world.add_player(player, *PLAYER_START, PLAYER_MASS)
+
+    for ai_kind, batch_ai in default_batch_ai().items():
+        world.register_batch_ai(ai_kind, batch_ai)
+
+    return world, player
+
+
+def run_steps(world: World, player: Player, steps: int) -> float:
+    """Step the world with the player running to the right.
+
+    Returns:
+        (float): The average time taken per step, in seconds.
+    """
+    data = (world, player)
+    start = time.perf_counter()
+    for step in range(steps):
+        _, vy = player.get_velocity()
+        player.set_velocity((150, vy))
+        if step % 40 == 0 and not player.is_jumping():
+            player.set_velocity((150, -200))
+            player.set_jumping(True)
+        world.step(data)
+    return (time.perf_counter() - start) / steps
+
+
+def synthetic_levels(directory: str, scales: Iterable[int],
+                     base: str = SHIPPED_LEVELS[0]) -> List[str]:
+    """Write scaled copies of a level into 'directory'.
+
+    Returns:
+        (list<str>): The file names of the written levels.
+    """
+    level = load_level(base)
+    levels = []
+    for scale in scales:
+        filename = os.path.join(directory, f"{os.path.splitext(os.path.basename(base))[0]}_x{scale}.txt")
+        write_level(filename, scale_level(level, scale))
+        levels.append(filename)
+    return levels
+
+
+def bench_broadphase(levels: Iterable[str], steps: int) -> Dict[str, Dict[str, float]]:
+    """Time each broadphase mode on each level.
+
+    Returns:
+        (dict<str: dict<str: float>>): The time per step of each mode, by level.
+    """
+    results = {}
+    for level in levels:
+        results[level] = {}
+        for broadphase in BROADPHASES:
+            world, player = build_world(level, broadphase=broadphase)
+            results[level][broadphase] = run_steps(world, player, steps)
+    return results
+
+
+def bench_physics(levels: Iterable[str], steps: int) -> Dict[str, Dict[str, float]]:
+    """Time each physics engine on each level.
+
+    Returns:
+        (dict<str: dict<str: float>>): The time per step of each engine, by level.
+    """
+    results = {}
+    for level in levels:
+        results[level] = {}
+        for physics in PHYSICS_BACKENDS:
+            world, player = build_world(level, physics=physics)
+            results[level][physics] = run_steps(world, player, steps)
+    return results
+
+
+def bench_build(levels: Iterable[str], repeats: int) -> Dict[str, Dict[str, float]]:
+    """Time building the world of each level, by type of entity.
+
+    Returns:
+        (dict<str: dict<str: float>>): The average time per build of each entity
+                                       type (and of SPACE_INSERTION), by level.
+    """
+    results = {}
+    for level in levels:
+        level_string = load_level(level)
+        totals = {}
+        for _ in range(repeats):
+            builder = create_world_builder(GRAVITY)
+            build_level(builder, level_string)
+            for entity_type, seconds in builder.get_build_times().items():
+                totals[entity_type] = totals.get(entity_type, 0.) + seconds
+        results[level] = {entity_type: seconds / repeats for entity_type, seconds in totals.items()}
+    return results
+
+
+class PauseTimer:
+    """Times the garbage collections made while it is timing (see gc.callbacks)"""
+
+    def __init__(self):
+        self.timing = False
+        # the pause (in seconds) of each collection timed
+        self.pauses = []
+        self._start = None
+
+    def __call__(self, phase: str, info: dict):
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            if self.timing:
+                self.pauses.append(time.perf_counter() - self._start)
+            self._start = None
+
+
+def bench_gc(levels: Iterable[str], steps: int, idle: float = 0.01) -> Dict[str, Dict[str, float]]:
+    """Time the longest garbage collection pause within a step on each level, with
+    garbage collected automatically and by a GCController between steps.
+
+    Only the collections made while the world is stepping hold up a frame; those
+    the controller makes in the idle time after a step are not counted.
+
+    Parameters:
+        idle (float): The idle seconds the controller is given after each step
+
+    Returns:
+        (dict<str: dict<str: float>>): The longest pause within a step with "automatic"
+                                       and "controlled" collection, by level.
+    """
+    results = {}
+    for level in levels:
+        results[level] = {}
+        for mode in ("automatic", "controlled"):
+            controller = GCController()
+            timer = PauseTimer()
+            if mode == "controlled":
+                controller.start()
+            gc.callbacks.append(timer)
+            try:
+                controller.before_build()
+                world, player = build_world(level)
+                controller.after_build()
+                for _ in range(steps):
+                    timer.timing = True
+                    run_steps(world, player, 1)
+                    timer.timing = False
+                    controller.idle(idle)
+            finally:
+                gc.callbacks.remove(timer)
+                controller.stop()
+            results[level][mode] = max(timer.pauses, default=0.)
+    return results
+
+
+def follow_player(scheduler: AIScheduler, world: World, player: Player, width: float = VIEW_WIDTH):
+    """Centre the view of 'scheduler' on the player, as the game does each step"""
+    world_width, world_height = world.get_pixel_size()
+    width = min(width, world_width)
+    left = min(max(player.get_position()[0] - width / 2, 0), world_width - width)
+    scheduler.set_view(left, 0, left + width, world_height)
+
+
+def bench_ai(levels: Iterable[str], steps: int, max_updates: int = AI_MAX_UPDATES,
+             time_budget: float = AI_TIME_BUDGET) -> Dict[str, Dict[str, float]]:
+    """Time stepping each level with the AI of every mob run at every step, with
+    the AI of distant mobs run less often ("lod"), and with that limited too.
+
+    Parameters:
+        max_updates (int): The most AI updates of mobs out of view per step when limited
+        time_budget (float): The seconds of AI updates of mobs out of view per step when limited
+
+    Returns:
+        (dict<str: dict<str: float>>): The time per step of each mode, by level.
+    """
+    results = {}
+    for level in levels:
+        results[level] = {}
+        for mode in ("every", "lod", "limited"):
+            world, player = build_world(level)
+            scheduler = None
+            if mode != "every":
+                scheduler = AIScheduler()
+                if mode == "limited":
+                    scheduler.set_limits(max_updates, time_budget)
+                world.set_ai_scheduler(scheduler)
+
+            total = 0.
+            for _ in range(steps):
+                if scheduler is not None:
+                    follow_player(scheduler, world, player)
+                total += run_steps(world, player, 1)
+            results[level][mode] = total / steps
+
+            if scheduler is not None:
+                stats = scheduler.get_stats()
+                print(f"{os.path.basename(level)} {mode}: {stats['updates']} updates, "
+                      f"{stats['skipped']} skipped, {stats['deferred']} deferred", file=sys.stderr)
+    return results
+
+
+def edit_level(level: str, edits: int, columns: int, rows: int, seed: int = 0) -> str:
+    """(str) Returns 'level' with 'edits' random cells within the first 'columns'
+    and 'rows' replaced by a brick, coin, mushroom or nothing"""
+    rng = random.Random(seed)
+    lines = [list(line) for line in level.split('\n')]
+    editable = [y for y, line in enumerate(lines[:rows]) if line]
+    for _ in range(edits):
+        y = rng.choice(editable)
+        x = rng.randrange(min(columns, len(lines[y])))
+        lines[y][x] = rng.choice("#C@ ")
+    return '\n'.join(''.join(line) for line in lines)
+
+
+def bench_reload(levels: Iterable[str], edits: int, repeats: int) -> Dict[str, Dict[str, float]]:
+    """Time applying an edit of each level to its world, against rebuilding the world.
+
+    Parameters:
+        edits (int): The number of cells changed by each edit
+
+    Returns:
+        (dict<str: dict<str: float>>): The average time to "rebuild" the world of
+                                       the edited level, and to "reload" the edit
+                                       with a LevelReloader, by level.
+    """
+    results = {}
+    for level in levels:
+        level_string = load_level(level)
+        rebuild = reload = 0.
+        for repeat in range(repeats):
+            builder = create_world_builder(GRAVITY)
+            world = build_level(builder, level_string)
+            reloader = LevelReloader(builder, world, level_string)
+            edited = edit_level(level_string, edits, *world.get_grid_size(), seed=repeat)
+
+            start = time.perf_counter()
+            reloader.reload(edited)
+            reload += time.perf_counter() - start
+
+            start = time.perf_counter()
+            build_level(create_world_builder(GRAVITY), edited)
+            rebuild += time.perf_counter() - start
+        results[level] = {"rebuild": rebuild / repeats, "reload": reload / repeats}
+    return results
+
+
+def bench_allocations(levels: Iterable[str], steps: int, budgets: Dict[str, int] = None,
+                      warmup: int = ALLOCATION_WARMUP) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Measure the memory allocated by each subsystem per step, on each level.
+
+    Levels are played by a game session, so the game's collision callbacks run
+    as they do in the game. The first steps are not measured, as they build the
+    caches (of the AI, physics, ...) kept for the rest of the level.
+
+    Parameters:
+        budgets (dict<str: int>): The most bytes each subsystem may hold at its
+                                  peak in a step, see FrameProfiler.check_budget
+        warmup (int): The number of steps taken before measuring
+
+    Returns:
+        (dict<str: dict<str: dict<str: float>>>): The FrameProfiler summary of each level.
+
+    Raises:
+        AssertionError: If a subsystem went over its budget on any level
+    """
+    results = {}
+    for level in levels:
+        session = GameSession()
+        session.start(level)
+        profiler = FrameProfiler(frames=steps)
+        session.set_profiler(profiler)
+        profiler.start()
+        try:
+            for step in range(warmup + steps):
+                if step == warmup:
+                    profiler.clear()
+                command = INPUT_RIGHT | (INPUT_JUMP if step % 40 == 0 else 0)
+                if command != session.get_input():
+                    session.handle_event("input", command)
+                session.step()
+            profiler.end_frame()
+        finally:
+            profiler.stop()
+
+        results[level] = profiler.get_summary()
+        if budgets:
+            profiler.check_budget(budgets)
+    return results
+
+
+def print_allocations(results: Dict[str, Dict[str, Dict[str, float]]]):
+    """Print a table of the mean and highest peak bytes per step of each subsystem,
+    and the mean bytes each keeps, by level."""
+    width = max(len(os.path.basename(level)) for level in results)
+    print("level".ljust(width), "subsystem".rjust(10), "peak".rjust(10), "max peak".rjust(10),
+          "allocated".rjust(10))
+    for level, summary in results.items():
+        for subsystem, measures in summary.items():
+            print(os.path.basename(level).ljust(width), subsystem.rjust(10),
+                  f"{measures['peak']:10.0f}", f"{measures['max_peak']:10d}",
+                  f"{measures['allocated']:10.0f}")
+
+
+def parse_budget(budget: str) -> Tuple[str, int]:
+    """(tuple<str, int>) Returns the (subsystem, bytes) of a "subsystem=bytes" argument"""
+    subsystem, _, size = budget.partition("=")
+    try:
+        return subsystem, int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected subsystem=bytes, not {budget!r}")
+
+
+def print_build_times(results: Dict[str, Dict[str, float]]):
+    """Print a table of the build time (in ms) of each entity type, by level."""
+    entity_types = sorted({entity_type for timings in results.values() for entity_type in timings},
+                          key=lambda entity_type: entity_type == SPACE_INSERTION)
+    width = max(len(entity_type) for entity_type in entity_types + ["total"])
+    print("entity".ljust(width), *(os.path.basename(level).rjust(14) for level in results))
+    for entity_type in entity_types + ["total"]:
+        if entity_type == "total":
+            row = (sum(timings.values()) for timings in results.values())
+        else:
+            row = (timings.get(entity_type, 0.) for timings in results.values())
+        print(entity_type.ljust(width), *(f"{seconds * 1000:14.3f}" for seconds in row))
+
+
+def print_results(results: Dict[str, Dict[str, float]]):
+    """Print a table of the time per step (in ms) of each option, by level,
+    marking the fastest option of each level."""
+    options = list(next(iter(results.values())))
+    width = max(len(os.path.basename(level)) for level in results)
+    print("level".ljust(width), *(option.rjust(10) for option in options), "  fastest")
+    for level, timings in results.items():
+        fastest = min(timings, key=timings.get)
+        print(os.path.basename(level).ljust(width),
+              *(f"{timings[option] * 1000:10.3f}" for option in options),
+              f"  {fastest}")
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--steps", type=int, default=300, help="world steps per run")
+    common.add_argument("--scales", type=int, nargs='*', default=[10, 100],
+                        help="also benchmark level1 tiled this many times")
+
+    parser = argparse.ArgumentParser(description="Benchmark the game engine")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    subparsers.add_parser("broadphase", parents=[common], help="compare the pymunk broadphase modes")
+    subparsers.add_parser("physics", parents=[common], help="compare the pymunk and tilemap physics engines")
+    build = subparsers.add_parser("build", parents=[common], help="time building each type of level entity")
+    build.add_argument("--repeats", type=int, default=5, help="builds of each level to average")
+    subparsers.add_parser("gc", parents=[common],
+                          help="compare the longest collection pause within a step with automatic and "
+                               "controlled garbage collection")
+    allocations = subparsers.add_parser("allocations", parents=[common],
+                                        help="measure the allocations of each subsystem per step")
+    allocations.add_argument("--budget", type=parse_budget, nargs='*', default=[],
+                             help="fail if a subsystem peaks above this many bytes in a step, "
+                                  "as subsystem=bytes")
+    reload = subparsers.add_parser("reload", parents=[common],
+                                   help="compare applying a level edit in place with rebuilding the level")
+    reload.add_argument("--edits", type=int, default=20, help="cells changed by each edit")
+    reload.add_argument("--repeats", type=int, default=5, help="edits of each level to average")
+    ai = subparsers.add_parser("ai", parents=[common],
+                               help="compare running the AI of every mob with levels of detail and limits")
+    ai.add_argument("--max-updates", type=int, default=AI_MAX_UPDATES,
+                    help="the most AI updates of mobs out of view per step")
+    ai.add_argument("--time-budget", type=float, default=AI_TIME_BUDGET,
+                    help="the seconds of AI updates of mobs out of view per step")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        levels = list(SHIPPED_LEVELS) + synthetic_levels(directory, args.scales)
+
+        if args.benchmark == "broadphase":
+            print_results(bench_broadphase(levels, args.steps))
+        elif args.benchmark == "physics":
+            print_results(bench_physics(levels, args.steps))
+        elif args.benchmark == "build":
+            print_build_times(bench_build(levels, args.repeats))
+        elif args.benchmark == "gc":
+            print_results(bench_gc(levels, args.steps))
+        elif args.benchmark == "reload":
+            print_results(bench_reload(levels, args.edits, args.repeats))
+        elif args.benchmark == "ai":
+            print_results(bench_ai(levels, args.steps, args.max_updates, args.time_budget))
+        elif args.benchmark == "allocations":
+            try:
+                print_allocations(bench_allocations(levels, args.steps, dict(args.budget)))
+            except AssertionError as error:
+                sys.exit(str(error))
+
+
+if __name__ == "__main__":
+    main()
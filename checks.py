@@ -0,0 +1,350 @@
+"""Headless regression checks of how the game plays, on both physics engines.
+
+Each check plays a session headless and raises AssertionError if the game no
+longer behaves as it should. The exit status is non-zero if any check fails.
+
+Example:
+    python checks.py
+    python checks.py --physics tilemap
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from app import (BLOCK_SIZE, INPUT_DUCK, INPUT_JUMP, INPUT_RIGHT, STAR_DURATION, GameSession,
+                 BulletRight, Mushroom, Star)
+from client import GameClient
+from game.ai import AIScheduler
+from game.entity import Entity
+from game.world import PHYSICS_BACKENDS, STEP_SIZE
+from netstate import KIND_CODES, SNAPSHOT, MessageReader, StateDecoder, StateEncoder
+from recording import Recording
+from replay import find_divergence, replay
+from server import GameServer
+
+
+def wall_level(columns: int = 40, rows: int = 12, wall_column: int = 10) -> str:
+    """(str) Returns a level string with a floor and a brick column as tall as the level"""
+    lines = []
+    for row in range(rows - 1):
+        line = [' '] * columns
+        if row >= 1:
+            line[wall_column] = '#'
+        lines.append("".join(line))
+    lines.append('%' * columns)
+    return "\n".join(lines)
+
+
+def unknown_level() -> str:
+    """(str) Returns the wall level, with an unknown tile on the floor left of the wall"""
+    lines = wall_level().split("\n")
+    lines[-2] = "X" + lines[-2][1:]
+    return "\n".join(lines)
+
+
+def check_wall(physics: str, steps: int = 600):
+    """Checks that a player holding a direction cannot walk through a brick column"""
+    wall_column = 10
+    session = GameSession()
+    session.preload_level("wall.txt", wall_level(wall_column=wall_column))
+    session.start("wall.txt", physics=physics)
+    session.handle_event("input", INPUT_RIGHT)
+
+    wall = wall_column * BLOCK_SIZE
+    for step in range(steps):
+        session.step()
+        x = session.get_player().get_position()[0]
+        assert x < wall, f"the player walked into the wall at x={wall}, reaching x={x:.1f} by step {step}"
+
+
+def jump_height(physics: str, held: int, steps: int = 80) -> float:
+    """(float) Returns how high the player rises on the wall level when jumping
+    with 'held' input, after walking into the wall (if 'held' has INPUT_RIGHT)"""
+    session = GameSession()
+    session.preload_level("wall.txt", wall_level())
+    session.start("wall.txt", physics=physics)
+    session.handle_event("input", held)
+    for _ in range(150):
+        session.step()
+
+    start = session.get_player().get_position()[1]
+    session.handle_event("input", held | INPUT_JUMP)
+    session.step()
+    session.handle_event("input", held)
+    top = start
+    for _ in range(steps):
+        session.step()
+        top = min(top, session.get_player().get_position()[1])
+    return start - top
+
+
+def check_wall_jump(physics: str):
+    """Checks that a player pushing into a wall jumps as high as one standing still"""
+    free = jump_height(physics, 0)
+    pushing = jump_height(physics, INPUT_RIGHT)
+    assert free > BLOCK_SIZE, f"the player only jumped {free:.1f} pixels"
+    assert pushing > .9 * free, f"the player jumped {pushing:.1f} pixels against a wall, {free:.1f} pixels away from it"
+
+
+def check_level1(physics: str, steps: int = 1500, stall: int = 3):
+    """Checks that level1 can be finished by holding right, and jumping whenever
+    the player has not moved forward for 'stall' steps"""
+    session = GameSession(GameSession().read_config("configuration.txt"), seed=1)
+    session.start("level1.txt", physics=physics)
+    player = session.get_player()
+    last_x = player.get_position()[0]
+    stalled = 0
+    for step in range(steps):
+        x = player.get_position()[0]
+        stalled = stalled + 1 if x - last_x < 1 else 0
+        last_x = x
+        command = INPUT_RIGHT | (INPUT_JUMP if stalled >= stall or player.is_jumping() else 0)
+        if command != session.get_input():
+            session.handle_event("input", command)
+        session.step()
+        assert not player.is_dead(), f"the player died at x={player.get_position()[0]:.1f} on step {step}"
+        if session.get_level() != "level1.txt":
+            return
+    raise AssertionError(f"the player was still on level1 after {steps} steps, at x={player.get_position()[0]:.1f}")
+
+
+def check_star(physics: str, steps: int = 60):
+    """Checks that the invincibility of a star wears off even if the world is rebuilt"""
+    session = GameSession()
+    session.preload_level("wall.txt", wall_level())
+    session.start("wall.txt", physics=physics)
+    player = session.get_player()
+    x, y = player.get_position()
+    session.get_world().add_item(Star(), x, y)
+    for _ in range(steps):
+        session.step()
+        if player.is_niubi():
+            break
+    assert player.is_niubi(), f"the player did not collect the star within {steps} steps"
+
+    # the world is rebuilt as it is by a tunnel or an edit of the level
+    session.preload_level("wall.txt", wall_level())
+    session.reset_world("wall.txt")
+    for _ in range(round(STAR_DURATION / STEP_SIZE)):
+        session.step()
+    assert not player.is_niubi(), f"the player was still invincible {STAR_DURATION} seconds after the star"
+
+
+class SteppingSession(GameSession):
+    """A session which fails if its world is rebuilt while the world is stepping,
+    and which records the levels its worlds are built from"""
+
+    def reset_world(self, new_level):
+        assert not getattr(self, "_stepping", False), f"the world was rebuilt for {new_level} during a step"
+        super().reset_world(new_level)
+        self.built = getattr(self, "built", []) + [new_level]
+        world_step = self._world.step
+
+        def step(game_data):
+            self._stepping = True
+            try:
+                world_step(game_data)
+            finally:
+                self._stepping = False
+
+        self._world.step = step
+
+
+def check_tunnel(physics: str, steps: int = 200):
+    """Checks that ducking onto a tunnel leads to the level after it, between steps"""
+    config = GameSession().read_config("configuration.txt")
+    config["tunnel.txt"] = {"goal": "room.txt"}
+    session = SteppingSession(config)
+    empty = ' ' * 10
+    session.preload_level("tunnel.txt", "\n".join([empty] * 6 + [" =" + ' ' * 8, empty, '%' * 10]))
+    session.preload_level("room.txt", "\n".join([empty] * 8 + ['%' * 10]))
+    session.start("tunnel.txt", physics=physics)
+    session.handle_event("input", INPUT_DUCK)
+    for _ in range(steps):
+        session.step()
+        if session.built[-1] == "room.txt":
+            return
+    raise AssertionError(f"the player did not go through the tunnel within {steps} steps")
+
+
+def check_replay_unknown(physics: str, steps: int = 120):
+    """Checks that a session on a level with an unknown tile is recorded, and
+    replays identically"""
+    with tempfile.TemporaryDirectory() as directory:
+        level = os.path.join(directory, "unknown.txt")
+        with open(level, "w") as file:
+            file.write(unknown_level())
+
+        session = GameSession(seed=1)
+        session.start(level, physics=physics)
+        recording = Recording(session.get_seed(), session.get_config(), level)
+        session.set_recorder(recording)
+        session.handle_event("input", INPUT_RIGHT)
+        for _ in range(steps):
+            session.step()
+        _, hashes = replay(recording, physics=physics)
+
+    assert recording.get_checkpoints(), f"no checkpoint was recorded in {steps} steps"
+    divergence = find_divergence(recording, hashes)
+    assert divergence is None, f"the replay diverged from the recording by step {divergence}"
+
+
+def check_netstate(physics: str, steps: int = 60):
+    """Checks that the snapshots of a world with an unknown tile decode from deltas
+    to the same state as from full snapshots"""
+    session = GameSession()
+    session.preload_level("unknown.txt", unknown_level())
+    session.start("unknown.txt", physics=physics)
+    session.handle_event("input", INPUT_RIGHT)
+    encoder = StateEncoder()
+    decoder = StateDecoder()
+    baseline = None
+    for step in range(steps):
+        session.step()
+        tick = encoder.take_snapshot(session.get_world(), session.get_player())
+        (kind, payload), = MessageReader().feed(encoder.encode(tick, baseline))
+        assert kind == SNAPSHOT, f"the snapshot of tick {tick} was sent as a {kind!r} message"
+        decoded = decoder.decode(payload)
+        assert decoded is not None, f"the delta of tick {tick} against tick {baseline} could not be decoded"
+        (_, full), = MessageReader().feed(encoder.encode(tick))
+        assert decoded == StateDecoder().decode(full), f"the delta of tick {tick} decoded to another state"
+        # as a client acknowledging every other snapshot
+        if step % 2:
+            baseline = tick
+
+    _, things, _ = decoded
+    unknown = [thing_id for kind, thing_id, *_ in things.values() if kind == KIND_CODES[Entity]]
+    assert unknown == ["unknown"], f"the unknown tile was sent as {unknown}"
+
+
+def check_server(physics: str, ticks: int = 30, timeout: float = 5.):
+    """Checks that a client on localhost mirrors the world of a server, and moves its player"""
+    session = GameSession()
+    session.preload_level("unknown.txt", unknown_level())
+    session.start("unknown.txt", physics=physics)
+    start = session.get_player().get_position()[0]
+    server = GameServer(session, ("127.0.0.1", 0))
+    try:
+        client = GameClient(server.get_address(), timeout)
+        try:
+            deadline = time.perf_counter() + timeout
+            server.poll(timeout)
+            client.send_input(INPUT_RIGHT)
+            for _ in range(ticks):
+                server.poll(.01)
+                server.tick()
+                client.poll()
+            while client.get_tick() != ticks:
+                assert time.perf_counter() < deadline, f"the client was only sent tick {client.get_tick()} of {ticks}"
+                server.poll(.01)
+                client.poll()
+        finally:
+            client.close()
+    finally:
+        server.close()
+
+    assert client.get_level() == "unknown.txt", f"the client mirrored {client.get_level()}"
+    shapes = len(list(session.get_world().get_all_shapes()))
+    assert len(client.get_shapes()) == shapes, f"the client mirrored {len(client.get_shapes())} of {shapes} things"
+    x = session.get_player().get_position()[0]
+    assert x > start, f"the player did not move right from x={start:.1f} with the client's input"
+    mirrored = client.get_player().get_shape().body.position.x
+    assert abs(mirrored - x) < 1, f"the client mirrored the player at x={mirrored:.1f}, not x={x:.1f}"
+
+
+def check_ai_schedule(physics: str, mobs: int = 8):
+    """Checks that a mob whose AI update was deferred is not updated twice once it
+    comes into view"""
+    session = GameSession()
+    session.preload_level("wall.txt", wall_level())
+    session.start("wall.txt", physics=physics)
+    world = session.get_world()
+    width, height = world.get_pixel_size()
+    crowd = [Mushroom() for _ in range(mobs)]
+    for index, mob in enumerate(crowd):
+        world.add_mob(mob, width - BLOCK_SIZE * (index + 1), BLOCK_SIZE)
+
+    scheduler = AIScheduler(max_updates=1)
+    scheduler.set_view(0, 0, BLOCK_SIZE, height)
+    while not scheduler.get_stats()["waiting"]:
+        scheduler.schedule(crowd)
+    scheduler.set_view(0, 0, width, height)
+    updated = scheduler.schedule(crowd)
+    assert len(updated) == len(set(updated)), \
+        f"{len(updated) - len(set(updated))} mob(s) were updated twice in a tick after coming into view"
+
+
+def check_bullet(physics: str, speed: float = 3000, steps: int = 60, **world_options):
+    """Checks that a bullet moving further than a block and itself in a step hits
+    a wall one block thick, rather than passing through it"""
+    wall_column = 10
+    session = GameSession()
+    session.preload_level("wall.txt", wall_level(wall_column=wall_column))
+    session.start("wall.txt", physics=physics, **world_options)
+    world = session.get_world()
+    bullet = BulletRight()
+    bullet.set_tempo(speed)
+    # half a step short of the wall, so a single step would carry it past, and in
+    # the air, so it hits the wall before it falls to the floor
+    x = wall_column * BLOCK_SIZE - bullet.get_size()[0] / 2 - speed * STEP_SIZE / 2
+    y = 5.5 * BLOCK_SIZE
+    world.add_mob(bullet, x, y)
+
+    wall = (wall_column + 1) * BLOCK_SIZE
+    for step in range(steps):
+        session.step()
+        if not any(thing is bullet for thing, _ in world.get_all_shapes()):
+            break
+        x = bullet.get_position()[0]
+        assert x < wall, \
+            f"a bullet at {speed} pixels per second passed through the wall, reaching x={x:.1f} by step {step}"
+    else:
+        raise AssertionError(f"a bullet at {speed} pixels per second did not hit anything within {steps} steps")
+
+    bricks = [thing for thing in world.get_things((wall_column + .5) * BLOCK_SIZE, y) if thing.get_id() == "brick"]
+    assert not bricks, f"a bullet at {speed} pixels per second did not destroy the brick of the wall in its way"
+
+
+CHECKS: Dict[str, Callable[[str], None]] = {
+    "wall": check_wall,
+    "wall_jump": check_wall_jump,
+    "level1": check_level1,
+    "star": check_star,
+    "tunnel": check_tunnel,
+    "replay_unknown": check_replay_unknown,
+    "netstate": check_netstate,
+    "server": check_server,
+    "ai_schedule": check_ai_schedule,
+    "bullet": check_bullet,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how the game plays, headless")
+    parser.add_argument("--physics", nargs='*', default=list(PHYSICS_BACKENDS),
+                        help="the physics engines to check")
+    parser.add_argument("--checks", nargs='*', default=list(CHECKS), help="the checks to run")
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.checks:
+        for physics in args.physics:
+            try:
+                CHECKS[name](physics)
+            except AssertionError as error:
+                failed += 1
+                print(f"FAIL {name} ({physics}): {error}")
+            else:
+                print(f"ok   {name} ({physics})")
+    if failed:
+        sys.exit(f"{failed} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
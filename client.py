@@ -0,0 +1,348 @@
+"""A thin client of server.py, drawing the world it is sent.
+
+The client owns no world: it mirrors each thing of the server's world with an
+instance of the class it is drawn as and a stand-in shape, so the game's own
+GameView and MarioViewRenderer draw it as the game would. The keys held are
+sent back to the server as input commands.
+
+Example:
+    python client.py --host 127.0.0.1 --port 5000
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import json
+import socket
+import tkinter as tk
+from typing import List, Optional, Tuple
+
+import pymunk
+
+from app import (BLOCK_IMAGES, ITEM_IMAGES, KEY_INPUTS, MAX_WINDOW_SIZE, MOB_IMAGES, FRAME_DELAY,
+                 MarioViewRenderer, Status)
+from game.entity import Entity
+from game.view import GameView
+from netstate import (ACK, ACK_FORMAT, ACTIVE, INPUT, INPUT_FORMAT, KINDS, MOVING_DOWN, MOVING_LEFT,
+                      MOVING_RIGHT, MOVING_UP, QUANTUM, SNAPSHOT, SQUISHED, WELCOME, MessageReader,
+                      StateDecoder, ThingState, pack_message)
+from player import Player
+from server import DEFAULT_ADDRESS
+
+
+class MirrorBody:
+    """Stands in for the body of a mirrored thing, for drawing"""
+
+    def __init__(self):
+        self.position = pymunk.Vec2d(0, 0)
+        self.velocity = pymunk.Vec2d(0, 0)
+
+
+class MirrorShape:
+    """Stands in for the shape of a mirrored thing, for drawing"""
+
+    def __init__(self, thing: Entity):
+        self.object = thing
+        self.body = MirrorBody()
+        self.bb = pymunk.BB(0, 0, 0, 0)
+
+
+def create_mirror(kind: int, thing_id: str) -> Tuple[Entity, MirrorShape]:
+    """(tuple<Entity, MirrorShape>) Returns a thing of the class of 'kind' and its
+    shape, without constructing it, as only what is drawn is mirrored"""
+    cls = KINDS[kind]
+    thing = cls.__new__(cls)
+    thing._id = thing_id
+    shape = MirrorShape(thing)
+    thing._shape = shape
+    return thing, shape
+
+
+def update_mirror(thing: Entity, shape: MirrorShape, state: ThingState):
+    """Update a mirrored thing and its shape to 'state'"""
+    _, _, x, y, width, height, flags = state
+    x /= QUANTUM
+    y /= QUANTUM
+    half_width = width / QUANTUM / 2
+    half_height = height / QUANTUM / 2
+    shape.bb = pymunk.BB(x - half_width, y - half_height, x + half_width, y + half_height)
+    shape.body.position = pymunk.Vec2d(x, y)
+    shape.body.velocity = pymunk.Vec2d(-1 if flags & MOVING_LEFT else 1 if flags & MOVING_RIGHT else 0,
+                                       -1 if flags & MOVING_UP else 1 if flags & MOVING_DOWN else 0)
+    # the sprite states the renderer reads
+    thing._active = bool(flags & ACTIVE)
+    thing._squished = bool(flags & SQUISHED)
+
+
+class GameClient:
+    """Connects to a GameServer and mirrors the world it streams"""
+
+    def __init__(self, address: Tuple[str, int] = DEFAULT_ADDRESS, timeout: float = 5.):
+        """Connect to the server at 'address'
+
+        Parameters:
+            address (tuple<str, int>): The (host, port) of the server
+            timeout (float): Seconds to wait for the connection
+        """
+        self._socket = socket.create_connection(address, timeout)
+        self._socket.setblocking(False)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = MessageReader()
+        self._decoder = StateDecoder()
+        self._connected = True
+
+        # the level being streamed, as sent by its welcome message
+        self._level = None
+        self._world_size = (0, 0)
+        self._tick = None
+        # maps network ids to the (thing, shape, state) mirroring them
+        self._mirrors = {}
+        self._player = None
+        self._status = (0., 1., 0, False)
+        self._input = 0
+        # bytes received, for measuring the bandwidth of the stream
+        self._received = 0
+
+    def is_connected(self) -> bool:
+        """(bool) Returns True iff the client is still connected to the server"""
+        return self._connected
+
+    def poll(self) -> bool:
+        """Handle the messages received from the server since the last poll
+
+        Returns:
+            (bool): True iff the mirrored world changed
+        """
+        changed = False
+        while self._connected:
+            try:
+                data = self._socket.recv(1 << 16)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                break
+
+            self._received += len(data)
+            for kind, payload in self._reader.feed(data):
+                if kind == WELCOME:
+                    self._welcome(json.loads(payload))
+                    changed = True
+                elif kind == SNAPSHOT:
+                    changed |= self._apply_snapshot(payload)
+        return changed
+
+    def send_input(self, command: int):
+        """Send the player's input command to the server, if it changed"""
+        if command != self._input and self._connected:
+            self._input = command
+            self._send(pack_message(INPUT, INPUT_FORMAT.pack(command)))
+
+    def get_shapes(self) -> List[Tuple[Entity, MirrorShape]]:
+        """(list<tuple<Entity, MirrorShape>>) Returns every mirrored thing with its
+        shape, to be drawn by GameView.draw_shapes"""
+        return [(thing, shape) for thing, shape, _ in self._mirrors.values()]
+
+    def get_player(self) -> Optional[Player]:
+        """(Player) Returns the mirror of the player, or None before it is sent"""
+        return self._player
+
+    def get_status(self) -> Tuple[float, float, int, bool]:
+        """(tuple<float, float, int, bool>) Returns the player's health, max health,
+        score and invincibility"""
+        return self._status
+
+    def get_level(self) -> Optional[str]:
+        """(str) Returns the level being streamed"""
+        return self._level
+
+    def get_world_size(self) -> Tuple[float, float]:
+        """(tuple<float, float>) Returns the pixel size of the world being streamed"""
+        return self._world_size
+
+    def get_tick(self) -> Optional[int]:
+        """(int) Returns the tick of the last snapshot received"""
+        return self._tick
+
+    def get_received(self) -> int:
+        """(int) Returns the number of bytes received from the server"""
+        return self._received
+
+    def close(self):
+        """Disconnect from the server"""
+        if self._connected:
+            self._connected = False
+            self._socket.close()
+
+    def _welcome(self, welcome: dict):
+        """Start mirroring a new world"""
+        self._level = welcome["level"]
+        self._world_size = tuple(welcome["size"])
+        self._decoder.reset()
+        self._mirrors = {}
+        self._player = None
+
+    def _apply_snapshot(self, payload: bytes) -> bool:
+        """Mirror the world of a snapshot, and acknowledge it
+
+        Returns:
+            (bool): True iff the snapshot could be decoded
+        """
+        decoded = self._decoder.decode(payload)
+        if decoded is None:
+            # its baseline belongs to a world since replaced
+            return False
+        tick, things, self._status = decoded
+
+        mirrors = self._mirrors
+        for net_id in [net_id for net_id in mirrors if net_id not in things]:
+            del mirrors[net_id]
+        for net_id, state in things.items():
+            mirror = mirrors.get(net_id)
+            if mirror is not None and mirror[2] == state:
+                continue
+            if mirror is None or mirror[2][:2] != state[:2]:
+                thing, shape = create_mirror(*state[:2])
+                if isinstance(thing, Player):
+                    self._player = thing
+            else:
+                thing, shape, _ = mirror
+            update_mirror(thing, shape, state)
+            mirrors[net_id] = thing, shape, state
+
+        if self._player is not None:
+            health, max_health, _, _ = self._status
+            self._player._health = health
+            self._player._max_health = max_health
+
+        self._tick = tick
+        self._send(pack_message(ACK, ACK_FORMAT.pack(tick)))
+        return True
+
+    def _send(self, message: bytes):
+        """Send a message to the server; they are small, so are sent whole"""
+        try:
+            self._socket.setblocking(True)
+            self._socket.sendall(message)
+        except OSError:
+            self.close()
+        finally:
+            if self._connected:
+                self._socket.setblocking(False)
+
+
+class ClientApp:
+    """Draws the world streamed to a GameClient, and sends it the keys held"""
+
+    def __init__(self, master: tk.Tk, client: GameClient, scale: int = 1):
+        """
+        Parameters:
+            master (tk.Tk): tkinter root widget
+            client (GameClient): The client of the server to draw
+            scale (int): The integer factor the world is enlarged by
+        """
+        self._master = master
+        self._client = client
+        self._view = None
+        self._renderer = MarioViewRenderer(BLOCK_IMAGES, ITEM_IMAGES, MOB_IMAGES, scale)
+        self._level = None
+
+        # bitwise INPUT_* of the keys held down, and of the keys pressed since the last frame
+        self._held = 0
+        self._pressed = 0
+        master.bind("<KeyPress>", self.key_press)
+        master.bind("<KeyRelease>", self.key_release)
+
+        self.status_bar = None
+        self.step()
+
+    def key_press(self, e):
+        """Track a key being held down"""
+        bit = KEY_INPUTS.get(e.keysym, 0)
+        self._held |= bit
+        self._pressed |= bit
+
+    def key_release(self, e):
+        """Track a key being released"""
+        self._held &= ~KEY_INPUTS.get(e.keysym, 0)
+
+    def step(self):
+        """Send the keys held, and draw the latest state of the world"""
+        client = self._client
+        client.send_input(self._held | self._pressed)
+        self._pressed = 0
+
+        if client.poll():
+            if client.get_level() != self._level:
+                self._start_level()
+            self.redraw()
+
+        if client.is_connected():
+            self._master.after(FRAME_DELAY, self.step)
+        else:
+            self._master.destroy()
+
+    def _start_level(self):
+        """Size the view to the world of a new level"""
+        self._level = self._client.get_level()
+        self._master.title(f"Mario - {self._level}")
+        size = tuple(map(min, zip(MAX_WINDOW_SIZE, self._client.get_world_size())))
+        if self._view is None:
+            self._view = GameView(self._master, size, self._renderer)
+            self._view.pack()
+            self.status_bar = Status(self._master)
+            self.status_bar.pack()
+        else:
+            self._view.set_size(size)
+
+    def redraw(self):
+        """Redraw the mirrored world, scrolled to the player"""
+        if self._view is None:
+            return
+        player = self._client.get_player()
+        if player is not None:
+            self.scroll(player.get_shape().body.position.x)
+
+        self._view.delete(tk.ALL)
+        self._view.draw_shapes(self._client.get_shapes())
+
+        health, max_health, score, niubi = self._client.get_status()
+        if player is not None:
+            self.status_bar.clear()
+            self.status_bar.update_health(health, niubi, player)
+            self.status_bar.update_score(score)
+
+    def scroll(self, x_position: float):
+        """Scroll the view along with the player, as MarioApp.scroll does"""
+        half_screen = self._view.get_size()[0] / 2
+        world_size = self._client.get_world_size()[0] - half_screen
+
+        if x_position <= half_screen:
+            self._view.set_offset((0, 0))
+        elif x_position <= world_size:
+            self._view.set_offset((half_screen - x_position, 0))
+        else:
+            self._view.set_offset((half_screen - world_size, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch or play a game of a Mario server")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0], help="the address of the server")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1], help="the port of the server")
+    parser.add_argument("--scale", type=int, default=1, help="the integer factor to enlarge the world by")
+    args = parser.parse_args()
+
+    client = GameClient((args.host, args.port))
+    root = tk.Tk()
+    root.title("Mario")
+    ClientApp(root, client, args.scale)
+    try:
+        root.mainloop()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Reset/step environments over the headless game, for automated agents.
+
+MarioEnv runs a single game in-process. VectorEnv runs many games across
+worker processes which write their observations, rewards and done flags
+straight into shared memory, so stepping only sends the actions to the
+workers and the returned arrays are views of the shared buffers.
+
+Actions are player input commands, bitwise combinations of the app.INPUT_*
+constants. Observations are grids around the player, see game.observation.
+
+Example:
+    with VectorEnv(["level1.txt"] * 16) as env:
+        observations = env.reset()
+        for _ in range(1000):
+            observations, rewards, dones = env.step(policy(observations))
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import multiprocessing
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from app import GameSession, ITEMS, MOBS, BLOCK_SIZE, INPUT_RIGHT, INPUT_JUMP
+from batch import receive, run_worker, split_batch
+from game.observation import ObservationEncoder
+
+OBSERVATION_RADIUS = 8
+
+# Vocabularies of the observation channels
+BLOCK_IDS = ['brick', 'brick_base', 'cube', 'mystery', 'bounce', 'switches', 'flag', 'tunnel']
+MOB_IDS = list(MOBS.values()) + ['fireball', 'bullet_l', 'bullet_r']
+ITEM_IDS = list(ITEMS.values())
+
+# Reward per point scored, and per grid cell moved to the right
+SCORE_REWARD = 1.
+PROGRESS_REWARD = .1
+
+
+def create_encoder(radius: int = OBSERVATION_RADIUS) -> ObservationEncoder:
+    """(ObservationEncoder) Returns an encoder of the game's blocks, mobs and items"""
+    return ObservationEncoder(radius, BLOCK_IDS, MOB_IDS, ITEM_IDS)
+
+
+class MarioEnv:
+    """A single game of Mario, played one input command per step"""
+
+    def __init__(self, level: str, config: dict = None, radius: int = OBSERVATION_RADIUS,
+                 **world_options):
+        """Constructor
+
+        Parameters:
+            level (str): The level file played in every episode
+            config (dict): Game configuration, as read by GameSession.read_config
+            radius (int): The number of cells visible on each side of the player
+            **world_options: Any additional World constructor arguments
+        """
+        self._level = level
+        self._encoder = create_encoder(radius)
+        self._session = GameSession(config)
+        self._session.start(level, **world_options)
+
+        player = self._session.get_player()
+        # the furthest x coordinate reached and the score at the last step
+        self._progress = player.get_position()[0]
+        self._score = player.get_score()
+
+    def get_observation_shape(self) -> Tuple[int, int, int]:
+        """(tuple<int, int, int>) Returns the shape of an observation"""
+        return self._encoder.get_shape()
+
+    def get_session(self) -> GameSession:
+        """(GameSession) Returns the game being played"""
+        return self._session
+
+    def _observe(self, out: np.ndarray = None) -> np.ndarray:
+        return self._encoder.encode(self._session.get_world(), self._session.get_player(), out)
+
+    def reset(self, out: np.ndarray = None) -> np.ndarray:
+        """Restarts the level
+
+        Parameters:
+            out (np.ndarray): The array to write the observation into, defaults to a new array
+
+        Returns:
+            (np.ndarray): The first observation of the episode
+        """
+        self._session.restart(self._level)
+        player = self._session.get_player()
+        self._progress = player.get_position()[0]
+        self._score = player.get_score()
+        return self._observe(out)
+
+    def step(self, action: int, out: np.ndarray = None) -> Tuple[np.ndarray, float, bool]:
+        """Applies 'action' and steps the game once
+
+        Parameters:
+            action (int): The input command, see GameSession.set_input
+            out (np.ndarray): The array to write the observation into, defaults to a new array
+
+        Returns:
+            (tuple<np.ndarray, float, bool>): The observation, the reward and whether
+                                              the episode is over (the player died
+                                              or completed the game)
+        """
+        session = self._session
+        session.set_input(action)
+        session.step()
+
+        player = session.get_player()
+        x, _ = player.get_position()
+        score = player.get_score()
+        reward = SCORE_REWARD * (score - self._score)
+        # only progress beyond the furthest point reached so far is rewarded
+        if x > self._progress:
+            reward += PROGRESS_REWARD * (x - self._progress) / BLOCK_SIZE
+            self._progress = x
+        self._score = score
+
+        done = player.is_dead() or session.is_finished()
+        return self._observe(out), reward, done
+
+
+def _serve(connection, memory: SharedMemory, shape: Tuple[int, ...], start: int,
+           levels: Sequence[str], config: dict, radius: int, world_options: dict):
+    """Serve step, reset & close commands for the environments of 'levels' until closed,
+    writing their results into their rows of the shared buffers"""
+    observations, rewards, dones = _views(memory, shape)
+    envs = [MarioEnv(level, config, radius, **world_options) for level in levels]
+    rows = range(start, start + len(envs))
+
+    while True:
+        command, actions = connection.recv()
+        if command == "step":
+            for env, row, action in zip(envs, rows, actions):
+                _, rewards[row], dones[row] = env.step(action, observations[row])
+                # finished episodes restart straight away, observing the new episode
+                if dones[row]:
+                    env.reset(observations[row])
+        elif command == "reset":
+            for env, row in zip(envs, rows):
+                env.reset(observations[row])
+        elif command == "close":
+            del observations, rewards, dones
+            memory.close()
+            connection.close()
+            return
+        connection.send(None)
+
+
+def _views(memory: SharedMemory, shape: Tuple[int, ...]):
+    """(tuple<np.ndarray, np.ndarray, np.ndarray>) Returns the observation, reward
+    & done arrays laid out in 'memory' for observations of 'shape'"""
+    count = shape[0]
+    observations = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+    offset = observations.nbytes
+    rewards = np.ndarray(count, dtype=np.float64, buffer=memory.buf, offset=offset)
+    offset += rewards.nbytes
+    dones = np.ndarray(count, dtype=bool, buffer=memory.buf, offset=offset)
+    return observations, rewards, dones
+
+
+class VectorEnv:
+    """Many games of Mario stepped in lockstep across a pool of worker processes.
+
+    The arrays returned by reset and step are views of shared memory which
+    are overwritten by the next call; copy them to keep them.
+    """
+
+    def __init__(self, levels: Sequence[str], workers: int = None, config: dict = None,
+                 radius: int = OBSERVATION_RADIUS, **world_options):
+        """Constructor
+
+        Parameters:
+            levels (list<str>): The level file of each environment
+            workers (int): The number of worker processes, defaults to the number of CPUs
+            config (dict): Game configuration, as read by GameSession.read_config
+            radius (int): The number of cells visible on each side of the player
+            **world_options: Any additional World constructor arguments
+        """
+        self._levels = list(levels)
+        if not self._levels:
+            raise ValueError("A vector environment needs at least one environment")
+
+        count = len(self._levels)
+        self._shape = (count, *create_encoder(radius).get_shape())
+        size = int(np.prod(self._shape)) + count * (np.dtype(np.float64).itemsize + 1)
+        self._memory = SharedMemory(create=True, size=size)
+        self._observations, self._rewards, self._dones = _views(self._memory, self._shape)
+
+        self._bounds = split_batch(count, workers)
+        self._connections = []
+        self._processes = []
+        for start, end in self._bounds:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_worker, daemon=True,
+                args=(child, _serve, self._memory, self._shape, start, self._levels[start:end],
+                      config, radius, world_options))
+            process.start()
+            child.close()
+
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_observation_shape(self) -> Tuple[int, int, int]:
+        """(tuple<int, int, int>) Returns the shape of the observation of one environment"""
+        return self._shape[1:]
+
+    def _wait(self):
+        """Waits for all workers to finish their command
+
+        Raises:
+            WorkerError: If a worker failed
+        """
+        receive(self._connections)
+
+    def reset(self) -> np.ndarray:
+        """(np.ndarray) Restarts every environment and returns their observations"""
+        for connection in self._connections:
+            connection.send(("reset", None))
+        self._wait()
+        return self._observations
+
+    def step(self, actions: Sequence[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Steps every environment once
+
+        Environments whose episode is over are restarted, and the observation
+        returned for them is the first observation of the new episode.
+
+        Parameters:
+            actions (list<int>): The input command of each environment
+
+        Returns:
+            (tuple<np.ndarray, np.ndarray, np.ndarray>): The observations, rewards
+                                                        and done flags of all environments
+        """
+        if len(actions) != len(self._levels):
+            raise ValueError(f"Expected {len(self._levels)} actions, got {len(actions)}")
+
+        # send to every worker before waiting on any, so the workers step concurrently
+        for connection, (start, end) in zip(self._connections, self._bounds):
+            connection.send(("step", [int(action) for action in actions[start:end]]))
+        self._wait()
+        return self._observations, self._rewards, self._dones
+
+    def close(self):
+        """Stops all worker processes and frees the shared memory"""
+        if self._memory is None:
+            return
+        for connection in self._connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join()
+
+        del self._observations, self._rewards, self._dones
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the step throughput of a VectorEnv")
+    parser.add_argument("levels", nargs='+', help="level files of the environments")
+    parser.add_argument("--copies", type=int, default=1, help="environments per level file")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--steps", type=int, default=300)
+    args = parser.parse_args()
+
+    with VectorEnv(args.levels * args.copies, workers=args.workers) as env:
+        env.reset()
+        actions = np.full(len(env), INPUT_RIGHT)
+        start = time.perf_counter()
+        total = 0.
+        for step in range(args.steps):
+            _, rewards, _ = env.step(actions | INPUT_JUMP if step % 40 == 0 else actions)
+            total += rewards.sum()
+        elapsed = time.perf_counter() - start
+
+    print(f"{len(env)} environments x {args.steps} steps: "
+          f"{len(env) * args.steps / elapsed:.0f} steps/s, mean return {total / len(env):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Batched AI behaviours for mobs that share the same movement logic.
+
+Instead of every mob running its own step method each tick, the world groups
+mobs by their AI kind (see Entity.get_ai_kind) and hands each group to the
+registered BatchAI, which computes all new velocities in one vectorised pass.
+
+An AIScheduler set on the world (see World.set_ai_scheduler) decides which mobs
+have their AI run at each tick, by their distance to the view and a budget.
+"""
+
+import math
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+from game.mob import Mob
+from game.navigation import JUMP, NavGraph, NavProfile
+from game.state import get_slots
+
+# How ground mobs moving along navigation graphs walk and jump; the jump is the
+# one they take when bumping into a block
+DEFAULT_NAV_PROFILE = NavProfile(walk_speed=80, jump_speed=350, jump_drift=50)
+
+# The most cells below the player that its node is looked for, while it is in the air
+GOAL_DEPTH = 12
+
+# Mobs whose vertical speed is below this are taken to be on the ground
+GROUNDED_SPEED = 1.
+
+# The (distance outside the view, in pixels, from which mobs are updated every
+# 'interval' ticks) of each level of detail, nearest first
+LOD_INTERVALS = ((0, 1), (320, 4), (960, 16))
+
+# The weight of the latest tick in the running mean cost of an AI update
+COST_SMOOTHING = .1
+
+# Batches smaller than this are stepped one mob at a time, as the cost of
+# building the arrays outweighs the vectorised update for a handful of mobs
+MIN_BATCH_SIZE = 8
+
+
+def get_positions(mobs: List[Mob]) -> np.ndarray:
+    """(np.ndarray) Returns an (n, 2) array of the (x, y) positions of 'mobs'"""
+    count = len(mobs)
+    return np.fromiter((c for mob in mobs for c in mob.get_position()),
+                       dtype=float, count=2 * count).reshape(count, 2)
+
+
+def get_velocities(mobs: List[Mob]) -> np.ndarray:
+    """(np.ndarray) Returns an (n, 2) array of the (x, y) velocities of 'mobs'"""
+    count = len(mobs)
+    return np.fromiter((c for mob in mobs for c in mob.get_velocity()),
+                       dtype=float, count=2 * count).reshape(count, 2)
+
+
+def get_tempos(mobs: List[Mob]) -> np.ndarray:
+    """(np.ndarray) Returns an array of the movement tempos of 'mobs'
+
+    Reads the tempo column directly when the mobs' state is kept in a store.
+    """
+    store = mobs[0].get_state_store() if mobs else None
+    if store is not None:
+        return store.tempo[get_slots(mobs)]
+    return np.fromiter((mob.get_tempo() for mob in mobs), dtype=float, count=len(mobs))
+
+
+def set_velocities(mobs: List[Mob], vx: np.ndarray, vy: np.ndarray):
+    """Writes the velocity components 'vx' & 'vy' back to each of 'mobs'"""
+    for mob, x, y in zip(mobs, vx.tolist(), vy.tolist()):
+        mob.set_velocity((x, y))
+
+
+class BatchAI:
+    """Updates a group of mobs sharing one AI kind in a single pass.
+
+    Should not be instantiated directly.
+    """
+
+    def __init__(self, min_batch: int = MIN_BATCH_SIZE):
+        """Constructor
+
+        Parameters:
+            min_batch (int): Batches smaller than this are stepped per mob instead
+        """
+        self._min_batch = min_batch
+
+    def step(self, mobs: List[Mob], time_delta: float, game_data):
+        """Advance all 'mobs' by one time step
+
+        Parameters:
+            mobs (list<Mob>): The mobs of this AI kind in the world
+            time_delta (float): The amount of time that has passed since the last step, in seconds
+            game_data (tuple<World, Player>): Arbitrary data supplied by the app class
+        """
+        if len(mobs) < self._min_batch:
+            for mob in mobs:
+                mob.step(time_delta, game_data)
+            return
+
+        store = mobs[0].get_state_store()
+        if store is not None:
+            store.steps[get_slots(mobs)] += 1
+        else:
+            for mob in mobs:
+                mob.increment_steps()
+        self.step_batch(mobs, time_delta, game_data)
+
+    def step_batch(self, mobs: List[Mob], time_delta: float, game_data):
+        """Compute and apply the new velocities of all 'mobs' at once"""
+        raise NotImplementedError("Should be overridden in a subclass")
+
+
+class PatrolAI(BatchAI):
+    """Mobs moving horizontally at their tempo, as in Mob.step"""
+
+    def step_batch(self, mobs, time_delta, game_data):
+        velocities = get_velocities(mobs)
+        set_velocities(mobs, get_tempos(mobs), velocities[:, 1])
+
+
+class ChaseAI(BatchAI):
+    """Ground mobs walking towards the player's x coordinate.
+
+    A mob with a negative tempo walks towards the player, a positive tempo
+    walks away from the player.
+    """
+
+    def step_batch(self, mobs, time_delta, game_data):
+        world, player = game_data
+        player_x, _ = player.get_position()
+
+        positions = get_positions(mobs)
+        velocities = get_velocities(mobs)
+        tempos = get_tempos(mobs)
+
+        mob_x = positions[:, 0]
+        vx = np.where(player_x < mob_x, tempos,
+                      np.where(player_x > mob_x, -tempos, velocities[:, 0]))
+
+        set_velocities(mobs, vx, velocities[:, 1])
+
+
+class NavigateAI(BatchAI):
+    """Ground mobs finding their way to the player along a navigation graph.
+
+    Each mob follows the path from the node it stands on to the node below the
+    player, walking, dropping and jumping as its edges say. Paths are looked up
+    again only when the mob leaves its path, the player's node changes or the
+    blocks change; mobs without a path walk towards the player as in ChaseAI.
+    Mobs with a non-negative tempo only move as in ChaseAI.
+    """
+
+    def __init__(self, profile: NavProfile = DEFAULT_NAV_PROFILE, graph: NavGraph = None,
+                 min_batch: int = 1):
+        """Constructor
+
+        Parameters:
+            profile (NavProfile): How the mobs walk and jump
+            graph (NavGraph): The graph of the world, or None to build it from
+                              the world on the first step, see set_graph
+            min_batch (int): Batches smaller than this are stepped per mob instead
+        """
+        super().__init__(min_batch)
+        self._profile = profile
+        self._graph = graph
+        # maps mobs to the (goal, graph version, start, path) they follow
+        self._paths = {}
+
+    def get_profile(self) -> NavProfile:
+        """(NavProfile) Returns how the mobs walk and jump"""
+        return self._profile
+
+    def get_graph(self) -> NavGraph:
+        """(NavGraph) Returns the navigation graph used, or None before the first step"""
+        return self._graph
+
+    def has_path(self, mob) -> bool:
+        """(bool) Returns True iff 'mob' was following a path to the player at its last update"""
+        followed = self._paths.get(mob)
+        return followed is not None and bool(followed[3])
+
+    def set_graph(self, graph: NavGraph):
+        """Use 'graph' as the navigation graph of the world, e.g. one cached for its level"""
+        self._graph = graph
+        self._paths = {}
+
+    def step_batch(self, mobs, time_delta, game_data):
+        world, player = game_data
+        graph = self._graph
+        if graph is None:
+            graph = self._graph = NavGraph.from_world(world, self._profile)
+        else:
+            graph.sync(world.get_block_grid())
+
+        player_x, player_y = player.get_position()
+        goal = graph.node_at(player_x, player_y, GOAL_DEPTH)
+        version = graph.get_version()
+        half_width = world.get_cell_expanse() / 2 - 1
+
+        paths = self._paths
+        followed = {}
+        for mob, tempo in zip(mobs, get_tempos(mobs).tolist()):
+            vx, vy = mob.get_velocity()
+            mob_x, mob_y = mob.get_position()
+            chase = tempo if player_x < mob_x else -tempo if player_x > mob_x else vx
+            if tempo >= 0 or goal is None:
+                mob.set_velocity((chase, vy))
+                continue
+
+            if abs(vy) >= GROUNDED_SPEED:
+                # in the air (e.g. jumping), the mob keeps to its course
+                if mob in paths:
+                    followed[mob] = paths[mob]
+                continue
+            node = graph.node_under(mob_x, mob_y, half_width)
+            if node is None:
+                # standing on something other than a block, e.g. another mob
+                mob.set_velocity((chase, vy))
+                continue
+
+            # the index in the mob's path of the next move
+            next_index = None
+            cached = paths.get(mob)
+            if cached is not None and cached[0] == goal and cached[1] == version:
+                _, _, start, path = cached
+                if node == start:
+                    next_index = 0
+                else:
+                    # skip the part of the path already travelled
+                    for index, (path_node, _, _) in enumerate(path or ()):
+                        if path_node == node:
+                            next_index = index + 1
+                            break
+            if next_index is None:
+                start, path, next_index = node, graph.find_path(node, goal), 0
+            followed[mob] = goal, version, start, path
+
+            if not path or next_index >= len(path):
+                mob.set_velocity((chase, vy))
+                continue
+
+            next_node, seconds, kind = path[next_index]
+            if kind == JUMP:
+                mob.set_velocity(graph.get_jump_velocity(node, next_node, seconds, mob_x))
+            else:
+                direction = -1 if next_node[0] < node[0] else 1
+                mob.set_velocity((-direction * tempo, vy))
+        self._paths = followed
+
+
+class CloudAI(BatchAI):
+    """Flying mobs which seek out the player and fire when within range"""
+
+    def step_batch(self, mobs, time_delta, game_data):
+        world, player = game_data
+        player_x, _ = player.get_position()
+
+        positions = get_positions(mobs)
+        velocities = get_velocities(mobs)
+        tempos = get_tempos(mobs)
+        fire_ranges = np.fromiter((mob.get_fire_range() for mob in mobs),
+                                  dtype=float, count=len(mobs))
+
+        mob_x = positions[:, 0]
+        in_range = np.abs(player_x - mob_x) < fire_ranges
+        vx = np.where(in_range, 0.,
+                      np.where(player_x < mob_x, -tempos,
+                               np.where(player_x > mob_x, tempos, velocities[:, 0])))
+
+        for index in np.flatnonzero(in_range).tolist():
+            mobs[index].fire(world)
+
+        set_velocities(mobs, vx, np.zeros(len(mobs)))
+
+
+class AIScheduler:
+    """Decides which mobs have their AI run at each tick of a world.
+
+    Mobs in view are updated at every tick; mobs further outside the view are
+    updated every few ticks, as given by the levels of detail (LOD_INTERVALS).
+    Mobs sharing an interval are spread over its ticks, so that the updates of
+    a crowd of distant mobs do not all fall on the same tick. Between updates,
+    a mob keeps moving with the velocity its last update gave it.
+
+    The out-of-view updates of a tick can also be limited, to a number of
+    updates and/or to a time budget. Updates over the limit are deferred to
+    the following ticks, where they go before any other out-of-view update, in
+    the order they were deferred. A time budget is estimated from the measured
+    cost of past updates, so unlike the other limits, it makes the simulation
+    depend on the speed of the machine (and recorded games replay differently).
+    """
+
+    def __init__(self, intervals: Tuple[Tuple[float, int], ...] = LOD_INTERVALS,
+                 max_updates: int = None, time_budget: float = None):
+        """Constructor
+
+        Parameters:
+            intervals (tuple<tuple<float, int>, ...>): The (distance, interval) of each
+                level of detail, nearest first; mobs at least 'distance' pixels
+                outside the view are updated every 'interval' ticks
+            max_updates (int): The most out-of-view updates per tick, or None
+            time_budget (float): The seconds of out-of-view updates per tick, or None
+        """
+        self._intervals = intervals
+        self._max_updates = max_updates
+        self._time_budget = time_budget
+        # the (left, top, right, bottom) of the view, in pixels; everything is in view until set
+        self._view = (-math.inf, -math.inf, math.inf, math.inf)
+        self._tick = 0
+        # out-of-view mobs due at earlier ticks but over the limit, in the order deferred
+        self._deferred = []
+        # the running mean seconds per update, measured by the world, see record_time
+        self._cost = None
+        self._updates = 0
+        self._skipped = 0
+        self._deferrals = 0
+
+    def set_view(self, left: float, top: float, right: float, bottom: float):
+        """Set the part of the world in view, in pixels"""
+        self._view = (left, top, right, bottom)
+
+    def get_view(self) -> Tuple[float, float, float, float]:
+        """(tuple<float, float, float, float>) Returns the (left, top, right, bottom) of the view"""
+        return self._view
+
+    def set_limits(self, max_updates: int = None, time_budget: float = None):
+        """Limit the out-of-view updates of each tick, see the constructor"""
+        self._max_updates = max_updates
+        self._time_budget = time_budget
+
+    def get_interval(self, x: float, y: float) -> int:
+        """(int) Returns the number of ticks between updates of a mob at (x, y)"""
+        left, top, right, bottom = self._view
+        distance = max(left - x, x - right, top - y, y - bottom)
+        interval = 1
+        for lod_distance, lod_interval in self._intervals:
+            if distance < lod_distance:
+                break
+            interval = lod_interval
+        return interval
+
+    def schedule(self, mobs: List[Mob]) -> List[Mob]:
+        """Find the mobs whose AI runs at this tick, and move on to the next tick
+
+        Parameters:
+            mobs (list<Mob>): Every mob in the world, in a stable order
+
+        Returns:
+            (list<Mob>): The mobs to update; in view first, then deferred, then
+                         the rest of those due
+        """
+        tick = self._tick
+        self._tick += 1
+        updated = []
+        due = []
+        for index, mob in enumerate(mobs):
+            interval = self.get_interval(*mob.get_position())
+            if interval == 1:
+                updated.append(mob)
+            elif (tick + index) % interval == 0:
+                due.append(mob)
+            else:
+                self._skipped += 1
+
+        if self._deferred:
+            # mobs deferred earlier go first, unless they have left the world or come
+            # into view since, so are updated already
+            present = set(mobs).difference(updated)
+            deferred = [mob for mob in self._deferred if mob in present]
+            waiting = set(deferred)
+            due = deferred + [mob for mob in due if mob not in waiting]
+
+        limit = len(due)
+        if self._max_updates is not None:
+            limit = min(limit, self._max_updates)
+        if self._time_budget is not None and self._cost:
+            limit = min(limit, max(0, int(self._time_budget / self._cost) - len(updated)))
+
+        self._deferred = due[limit:]
+        self._deferrals += len(self._deferred)
+        updated.extend(due[:limit])
+        self._updates += len(updated)
+        return updated
+
+    def record_time(self, seconds: float, updates: int):
+        """Record that the last 'updates' updates took 'seconds', for the time budget"""
+        if updates:
+            cost = seconds / updates
+            self._cost = cost if self._cost is None else self._cost + COST_SMOOTHING * (cost - self._cost)
+
+    def get_cost(self) -> Optional[float]:
+        """(float) Returns the running mean seconds per update, or None if none were timed"""
+        return self._cost
+
+    def get_stats(self) -> Dict[str, int]:
+        """(dict<str: int>) Returns the number of ticks, AI "updates" run, updates
+        "skipped" by the levels of detail and "deferred" over the limits, and
+        updates currently "waiting" for a later tick"""
+        return {"ticks": self._tick, "updates": self._updates, "skipped": self._skipped,
+                "deferred": self._deferrals, "waiting": len(self._deferred)}
+
+    def clear_stats(self):
+        """Reset the counts of get_stats"""
+        self._updates = self._skipped = self._deferrals = 0
+
+
+def default_batch_ai() -> Dict[str, BatchAI]:
+    """(dict<str: BatchAI>) Returns a new batch AI for each built-in AI kind"""
+    return {
+        "patrol": PatrolAI(),
+        "chase": ChaseAI(),
+        "navigate": NavigateAI(),
+        "cloud": CloudAI(),
+    }
@@ -0,0 +1,255 @@
+"""
+The images drawn by the game, loaded ahead of each level and kept while used.
+"""
+
+import collections
+import time
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from PIL import Image, ImageOps, ImageTk
+
+# The most bytes of scaled sprites a SpriteCache keeps
+SPRITE_CACHE_BYTES = 32 * 2 ** 20
+
+# The most bytes of images (unscaled and scaled) an AssetManager keeps before
+# it evicts those unused for a while
+ASSET_BUDGET_BYTES = 48 * 2 ** 20
+
+# The number of levels an image must have gone unused for before it is evicted
+MAX_IDLE_LEVELS = 2
+
+
+class SpriteCache:
+    """Sprites scaled (and mirrored) once with PIL, and kept while they are used.
+
+    A sprite is named by its source, whose unscaled image is given by the load
+    function (see AssetManager). Each variant of a sprite, at the current scale,
+    is made when first drawn and kept in a least recently used cache bounded by
+    the bytes of its pixels, so sprites are never resized per draw.
+    """
+
+    def __init__(self, load: Callable[[Hashable], Image.Image], scale: int = 1,
+                 max_bytes: int = SPRITE_CACHE_BYTES):
+        """Constructor
+
+        Parameters:
+            load (callable<Hashable, Image>): Returns the unscaled image of a source
+            scale (int): The integer factor sprites are enlarged by
+            max_bytes (int): The most bytes of scaled sprites to keep
+        """
+        self._load = load
+        self._scale = scale
+        self._max_bytes = max_bytes
+        # maps (source, mirrored, scale) to (photo image, bytes), least recently used first
+        self._sprites = collections.OrderedDict()
+        self._bytes = 0
+
+    def get_scale(self) -> int:
+        """(int) Returns the factor sprites are enlarged by"""
+        return self._scale
+
+    def set_scale(self, scale: int):
+        """Enlarge sprites by 'scale' from now on
+
+        Only the sprites cached at the old scale are made at the new scale now;
+        any other sprite is made when it is first drawn.
+        """
+        if scale == self._scale:
+            return
+        in_use = [(source, mirrored) for source, mirrored, _ in self._sprites]
+        self._sprites.clear()
+        self._bytes = 0
+        self._scale = scale
+        for source, mirrored in in_use:
+            self.get(source, mirrored)
+
+    def lookup(self, source: Hashable, mirrored: bool = False) -> Optional[ImageTk.PhotoImage]:
+        """(ImageTk.PhotoImage) Returns the sprite of 'source' at the current scale
+        if it is cached, or None"""
+        key = (source, mirrored, self._scale)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            return None
+        self._sprites.move_to_end(key)
+        return sprite[0]
+
+    def get(self, source: Hashable, mirrored: bool = False) -> ImageTk.PhotoImage:
+        """(ImageTk.PhotoImage) Returns the sprite of 'source' at the current scale,
+        mirrored left to right if 'mirrored'"""
+        photo = self.lookup(source, mirrored)
+        if photo is not None:
+            return photo
+
+        image = self._load(source)
+        if mirrored:
+            image = ImageOps.mirror(image)
+        if self._scale != 1:
+            image = image.resize((image.width * self._scale, image.height * self._scale), Image.NEAREST)
+        photo = ImageTk.PhotoImage(image)
+
+        size = image.width * image.height * 4
+        self._sprites[(source, mirrored, self._scale)] = (photo, size)
+        self._bytes += size
+        # the sprite just made is kept, even over the budget, as it is about to be drawn
+        while self._bytes > self._max_bytes and len(self._sprites) > 1:
+            _, (_, evicted) = self._sprites.popitem(last=False)
+            self._bytes -= evicted
+        return photo
+
+    def discard(self, source: Hashable):
+        """Forget every variant of the sprite of 'source'"""
+        for key in [key for key in self._sprites if key[0] == source]:
+            _, size = self._sprites.pop(key)
+            self._bytes -= size
+
+    def get_bytes(self) -> int:
+        """(int) Returns the bytes of the scaled sprites kept"""
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._sprites)
+
+
+class AssetManager:
+    """Loads every image the game draws, and keeps them across levels while used.
+
+    An image is named by its source: either the name of an image file in the
+    images directory (without its .png or .gif extension), or a (sprite sheet
+    file, crop box) pair; sprite sheets are kept as images named by their file.
+    Images are drawn as sprites at the render scale, see SpriteCache.
+
+    The images a level needs are loaded when it starts (see begin_level), so
+    none are loaded in the middle of its frames. Once the images kept go over
+    the memory budget, those unused for the last few levels are evicted.
+    """
+
+    def __init__(self, scale: int = 1, max_bytes: int = ASSET_BUDGET_BYTES,
+                 max_idle_levels: int = MAX_IDLE_LEVELS, directory: str = "images/"):
+        """Constructor
+
+        Parameters:
+            scale (int): The integer factor sprites are enlarged by
+            max_bytes (int): The most bytes of images to keep before evicting
+            max_idle_levels (int): The levels an image must go unused to be evicted
+            directory (str): The directory of the image files
+        """
+        self._max_bytes = max_bytes
+        self._max_idle_levels = max_idle_levels
+        self._directory = directory
+        # the unscaled image of each source read, and its bytes
+        self._images = {}
+        self._image_bytes = 0
+        # the number of levels begun, and the last level each source was used in
+        self._level = 0
+        self._last_used = {}
+        self._sprites = SpriteCache(self._load, scale)
+
+        self._hits = 0
+        self._misses = 0
+        self._preloads = 0
+        self._evictions = 0
+        self._load_time = 0.
+
+    def get_scale(self) -> int:
+        """(int) Returns the factor sprites are enlarged by"""
+        return self._sprites.get_scale()
+
+    def set_scale(self, scale: int):
+        """Enlarge sprites by 'scale' from now on, see SpriteCache.set_scale"""
+        start = time.perf_counter()
+        self._sprites.set_scale(scale)
+        self._load_time += time.perf_counter() - start
+
+    def get(self, source: Hashable, mirrored: bool = False) -> ImageTk.PhotoImage:
+        """(ImageTk.PhotoImage) Returns the sprite of 'source' at the render scale,
+        mirrored left to right if 'mirrored', loading it if it is not kept"""
+        self._last_used[source] = self._level
+        photo = self._sprites.lookup(source, mirrored)
+        if photo is not None:
+            self._hits += 1
+            return photo
+
+        self._misses += 1
+        start = time.perf_counter()
+        photo = self._sprites.get(source, mirrored)
+        self._load_time += time.perf_counter() - start
+        return photo
+
+    def preload(self, sources: Iterable[Tuple[Hashable, bool]]):
+        """Load the sprites of (source, mirrored) pairs which are not kept yet"""
+        start = time.perf_counter()
+        for source, mirrored in sources:
+            self._last_used[source] = self._level
+            if self._sprites.lookup(source, mirrored) is None:
+                self._sprites.get(source, mirrored)
+                self._preloads += 1
+        self._load_time += time.perf_counter() - start
+
+    def begin_level(self, sources: Iterable[Tuple[Hashable, bool]]):
+        """Start a new level, which draws the sprites of (source, mirrored) pairs
+
+        The sprites are loaded now, then images unused for the last
+        max_idle_levels levels are evicted while over the memory budget.
+        """
+        self._level += 1
+        self.preload(sources)
+        self._evict()
+
+    def _evict(self):
+        """Evict the least recently used idle images, while over the memory budget"""
+        idle_before = self._level - self._max_idle_levels
+        idle = sorted((level, index, source) for index, (source, level) in enumerate(self._last_used.items())
+                      if level <= idle_before)
+        for _, _, source in idle:
+            if self.get_bytes() <= self._max_bytes:
+                break
+            del self._last_used[source]
+            image = self._images.pop(source, None)
+            if image is not None:
+                self._image_bytes -= image.width * image.height * 4
+            self._sprites.discard(source)
+            self._evictions += 1
+
+    def _load(self, source: Hashable) -> Image.Image:
+        """(Image) Returns the unscaled image of 'source', reading it if it is not kept"""
+        image = self._images.get(source)
+        if image is not None:
+            return image
+
+        if isinstance(source, str):
+            try:
+                image = Image.open(self._directory + source + ".png")
+            except FileNotFoundError:
+                image = Image.open(self._directory + source + ".gif")
+        else:
+            sheet_file, box = source
+            self._last_used[sheet_file] = self._level
+            sheet = self._images.get(sheet_file)
+            if sheet is None:
+                sheet = self._keep(sheet_file, Image.open(sheet_file))
+            image = sheet.crop(box)
+        return self._keep(source, image)
+
+    def _keep(self, source: Hashable, image: Image.Image) -> Image.Image:
+        """(Image) Keeps the image of 'source', as RGBA, and returns it"""
+        image = self._images[source] = image.convert("RGBA")
+        self._image_bytes += image.width * image.height * 4
+        return image
+
+    def get_bytes(self) -> int:
+        """(int) Returns the bytes of the images kept, unscaled and scaled"""
+        return self._image_bytes + self._sprites.get_bytes()
+
+    def get_stats(self) -> Dict[str, float]:
+        """(dict<str: float>) Returns the number of sprites drawn that were kept
+        ("hits"), that had to be loaded mid-frame ("misses"), that were loaded
+        ahead of their level ("preloads") and images "evicted"; the "load_time"
+        in seconds spent loading and scaling; and the "bytes" and "images" kept"""
+        return {"hits": self._hits, "misses": self._misses, "preloads": self._preloads,
+                "evicted": self._evictions, "load_time": self._load_time,
+                "bytes": self.get_bytes(), "images": len(self._images)}
+
+    def clear_stats(self):
+        """Reset the counts and load time of get_stats"""
+        self._hits = self._misses = self._preloads = self._evictions = 0
+        self._load_time = 0.
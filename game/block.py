@@ -48,6 +48,18 @@ class Block(Entity):
         return f"{self.__class__.__name__}({self._id})"
 
 
+class BlockFlyweight(Block):
+    """A single instance shared by every plain block of the same id in a world.
+
+    Plain blocks have no state apart from their position, which the world keeps
+    in their shape and block grid, so a flyweight has no shape of its own.
+    The world replaces it with a real Block when one is asked for.
+    """
+
+    def get_position(self):
+        raise TypeError("A block flyweight has no position, ask the world for the block")
+
+
 class MysteryBlock(Block):
     """A mystery block drops items when the player hits its underside.
 
@@ -70,13 +82,16 @@ class MysteryBlock(Block):
         self._drop_range = drop_range
         self._active = True
 
-    def get_drops(self) -> Tuple[str, ...]:
+    def get_drops(self, rng: random.Random = random) -> Tuple[str, ...]:
         """Get the drops of the mystery block
 
+        Parameters:
+            rng (random.Random): The random generator choosing the number of drops.
+
         Returns:
             tuple<str, ...>: The item identifiers of the dropped items.
         """
-        return (self._drop,) * random.randint(*self._drop_range)
+        return (self._drop,) * rng.randint(*self._drop_range)
 
     def _drop_items(self, world, drops: Tuple[str]):
         """Drop each of the dropped items into the world.
@@ -89,7 +104,7 @@ class MysteryBlock(Block):
         for drop in drops:
             if drop is not None:
                 # world.add_item(create_item(drop), TODO: Make this non-hardcoded
-                world.add_item(Coin(), x + random.randint(-10, 10), y - 25)
+                world.add_item(Coin(), x + world.get_random().randint(-10, 10), y - 25)
 
     def on_hit(self, event, data):
         """Callback collision with player event handler."""
@@ -102,8 +117,8 @@ class MysteryBlock(Block):
             self._active = False
 
             # Drop items into the game world
-            drops = self.get_drops()
-            self._drop_items(data[0], drops)
+            drops = self.get_drops(world.get_random())
+            self._drop_items(world, drops)
 
     def is_active(self) -> bool:
         """(bool): Returns true if the block has not yet dropped items."""
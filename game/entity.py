@@ -6,6 +6,8 @@ import pymunk
 
 from typing import Tuple
 
+from game.state import EntityStateStore, JUMPING
+
 
 class Entity:
     """The highest-level abstract representation of an entity in the game world
@@ -14,6 +16,10 @@ class Entity:
     """
 
     _type = 0
+    # The id of the entity, set by each kind of entity; plain entities are unknown tiles
+    _id = "unknown"
+    # The kind of batched AI that steps this entity, see World.register_batch_ai
+    _ai_kind = None
 
     def __init__(self):
         self._shape: pymunk.Shape = None
@@ -27,6 +33,16 @@ class Entity:
         """
         return 2 ** cls._type
 
+    def get_id(self) -> str:
+        """(str) Returns the id of the entity"""
+        return self._id
+
+    @classmethod
+    def get_ai_kind(cls) -> str:
+        """(str) Returns the kind of batched AI that steps this entity, or None
+        if the entity steps itself"""
+        return cls._ai_kind
+
     def resolve_shape(self, shape: pymunk.Shape, friction: float = 1.):
         """Resolve the shape of a method by setting appropriate entity groups
 
@@ -78,35 +94,106 @@ class DynamicEntity(Entity):
 
     This entity will have an associated health.
 
+    The state of a dynamic entity can optionally be kept in an EntityStateStore
+    (see bind_state), in which case the accessor methods read and write the
+    entity's slot in the store instead of its own attributes.
+
     Should not be instantiated directly.
     """
 
+    _store = None
+    _slot = None
+    # Attributes holding the entity's state while it is not bound to a store
+    _state_attributes = ("_health", "_max_health", "_jumping")
+
     def __init__(self, max_health=20):
         super().__init__()
 
+        self._body: pymunk.Body = None
         self._health = self._max_health = max_health
         self._jumping = False
 
+    def set_shape(self, shape: pymunk.Shape):
+        """Set the pymunk physical shape of the entity.
+
+        Parameters:
+            shape (pymunk.Shape): The physical shape of the entity.
+        """
+        super().set_shape(shape)
+        self._body = shape.body
+
+    def _export_state(self) -> dict:
+        """(dict<str: float>) Returns the stored state of this entity, by column"""
+        return {
+            "health": self.get_health(),
+            "max_health": self.get_max_health(),
+            "flags": JUMPING if self.is_jumping() else 0,
+        }
+
+    def _import_state(self, state: dict):
+        """Restores the attributes of this entity from its stored state"""
+        self._health = state["health"]
+        self._max_health = state["max_health"]
+        self._jumping = bool(state["flags"] & JUMPING)
+
+    def bind_state(self, store: EntityStateStore):
+        """Moves the state of this entity into a slot of 'store'
+
+        If the entity is already bound to another store, its slot there is released.
+        """
+        state = self._export_state()
+        if self._store is not None:
+            self._store.release(self._slot)
+
+        self._store = store
+        self._slot = store.allocate()
+        store.write(self._slot, state)
+
+        for attribute in self._state_attributes:
+            self.__dict__.pop(attribute, None)
+
+    def unbind_state(self):
+        """Moves the state of this entity out of its store, back into its attributes"""
+        if self._store is None:
+            return
+
+        state = self._export_state()
+        self._store.release(self._slot)
+        self._store = self._slot = None
+        self._import_state(state)
+
+    def get_state_store(self) -> EntityStateStore:
+        """(EntityStateStore) Returns the store holding this entity's state, or None"""
+        return self._store
+
+    def get_state_slot(self) -> int:
+        """(int) Returns the slot of this entity in its state store, or None"""
+        return self._slot
+
     def change_health(self, change):
         """Increases the dynamic thing's health by 'change (float)'"""
-        self._health += change
+        health = min(max(self.get_health() + change, 0), self.get_max_health())
 
-        if self._health < 0:
-            self._health = 0
-        elif self._health > self._max_health:
-            self._health = self._max_health
+        if self._store is None:
+            self._health = health
+        else:
+            self._store.health[self._slot] = health
 
     def get_max_health(self):
         """(float) Returns the maximum health of the dynamic entity."""
-        return self._max_health
+        if self._store is None:
+            return self._max_health
+        return self._store.max_health[self._slot].item()
 
     def get_health(self):
         """(float) Returns the dynamic thing's health"""
-        return self._health
+        if self._store is None:
+            return self._health
+        return self._store.health[self._slot].item()
 
     def is_dead(self):
         """(bool) Returns True iff this thing is dead"""
-        return self._health <= 0
+        return self.get_health() <= 0
 
     def get_velocity(self):
         """Returns the velocity of this dynamic thing
@@ -114,7 +201,7 @@ class DynamicEntity(Entity):
         Return:
             tuple<float, float>: The (x, y) components of the velocity
         """
-        return self.get_shape().body.velocity
+        return self._body.velocity
 
     def set_velocity(self, velocity: Tuple[float, float]):
         """Sets the velocity of this dynamic thing to 'velocity'
@@ -123,15 +210,30 @@ class DynamicEntity(Entity):
             velocity (tuple<float, float>):
                     The (x, y) components of the new velocity
         """
-        self.get_shape().body.velocity = velocity
+        self._body.velocity = velocity
+
+    def push_horizontally(self, velocity_x: float, time_delta: float):
+        """Push this dynamic thing during the next step of 'time_delta' seconds with
+        the horizontal force which brings it to 'velocity_x'
+
+        Unlike set_velocity, the force is applied within the physics step, before
+        contacts are solved, so they can still stop the thing (e.g. at a wall).
+        """
+        body = self._body
+        body.force = (body.mass * (velocity_x - body.velocity.x) / time_delta, body.force.y)
 
     def is_jumping(self) -> bool:
         """(bool): Return whether or not the player is jumping currently."""
-        return self._jumping
+        if self._store is None:
+            return self._jumping
+        return self._store.get_flag(self._slot, JUMPING)
 
     def set_jumping(self, jumping: bool):
         """Set whether the player is currently jumping."""
-        self._jumping = jumping
+        if self._store is None:
+            self._jumping = jumping
+        else:
+            self._store.set_flag(self._slot, JUMPING, jumping)
 
 
 class BoundaryWall(Entity):
@@ -141,16 +243,18 @@ class BoundaryWall(Entity):
 
     def __init__(self, wall_id: str, body: pymunk.Shape,
                  top_left: Tuple[float, float], bottom_right: Tuple[float, float],
-                 thickness: float):
+                 thickness: float, engine=pymunk):
         """Constructor
 
         Parameters:
             wall_id (str): The unique id of this wall (e.g. 'left', 'top', etc.)
+            engine (module): The physics engine module creating the wall's shape,
+                             i.e. pymunk or game.tilemap
         """
         super().__init__()
 
         self._id = wall_id
-        self._shape = shape = pymunk.Segment(body, top_left, bottom_right, thickness)
+        self._shape = shape = engine.Segment(body, top_left, bottom_right, thickness)
         self.resolve_shape(shape)
 
     def get_id(self) -> str:
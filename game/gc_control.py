@@ -0,0 +1,140 @@
+"""
+Garbage collection scheduled around the frames of the game loop.
+"""
+
+import gc
+import time
+from typing import Dict
+
+# The most frames an older generation's collection may be put off for lack of
+# idle time, before it is collected anyway (so that cyclic garbage is bounded)
+MAX_DEFERRED_FRAMES = 100
+
+
+class GCController:
+    """Runs the garbage collector in the idle part of frames, instead of whenever
+    enough objects have been allocated.
+
+    Entities and their shapes refer to each other (through shape.object), so
+    every thing removed from a world is cyclic garbage, and the collector's
+    automatic collections pause frames at arbitrary points. While started,
+    automatic collection is disabled and each frame calls idle with the time
+    it can spare, which collects the oldest generation that is due, if its last
+    collection took no longer than that time.
+
+    The objects of a level are long-lived, so after each level is built they are
+    moved out of the collector's generations (see after_build), and never
+    traversed by the collections during the level. They are returned to the
+    generations when the level is replaced (see before_build), to be collected.
+    """
+
+    def __init__(self, profiler=None):
+        """Construct a controller, which does not control anything until started.
+
+        Parameters:
+            profiler (FrameProfiler): Where the pause of every collection is
+                                      reported, see game.profiler
+        """
+        self._profiler = profiler
+        self._started = False
+        self._was_enabled = gc.isenabled()
+        # the thresholds of automatic collection decide when each generation is due
+        self._thresholds = gc.get_threshold()
+        # the last pause (in seconds) and number of deferred frames of each generation
+        self._pauses = [0., 0., 0.]
+        self._deferred = [0, 0, 0]
+        # the time the collection in progress started, see _on_collection
+        self._collection_start = None
+
+    def set_profiler(self, profiler):
+        """Report the pause of every collection to 'profiler', or to nothing if None"""
+        self._profiler = profiler
+
+    def start(self):
+        """Disable automatic collection, and report the pause of every collection"""
+        if self._started:
+            return
+        self._started = True
+        self._was_enabled = gc.isenabled()
+        self._thresholds = gc.get_threshold()
+        gc.disable()
+        gc.callbacks.append(self._on_collection)
+
+    def stop(self):
+        """Restore automatic collection, and return the long-lived objects to the
+        collector's generations"""
+        if not self._started:
+            return
+        self._started = False
+        gc.callbacks.remove(self._on_collection)
+        gc.unfreeze()
+        if self._was_enabled:
+            gc.enable()
+
+    def is_started(self) -> bool:
+        """(bool) Returns True iff the controller is controlling collection"""
+        return self._started
+
+    def before_build(self):
+        """Return the objects frozen with the last level to the collector's
+        generations, as the level is being replaced and they may become garbage"""
+        if self._started:
+            gc.unfreeze()
+
+    def after_build(self):
+        """Collect the garbage of the last level, and freeze every object there is
+        now (i.e. the new level), so that later collections never traverse them
+
+        The last level must have been unfrozen by before_build.
+        """
+        if not self._started:
+            return
+        gc.collect()
+        gc.freeze()
+        self._deferred = [0, 0, 0]
+
+    def idle(self, budget: float) -> float:
+        """Collect the oldest generation that is due, if it fits in the idle time
+
+        A generation's collection is estimated to take as long as its last one;
+        those which would not fit are put off to a later frame, but at most for
+        MAX_DEFERRED_FRAMES frames.
+
+        Parameters:
+            budget (float): The idle time of the frame, in seconds
+
+        Returns:
+            (float): The seconds spent collecting
+        """
+        if not self._started:
+            return 0.
+
+        counts = gc.get_count()
+        for generation in (2, 1, 0):
+            if counts[generation] <= self._thresholds[generation]:
+                continue
+            if self._pauses[generation] > budget and self._deferred[generation] < MAX_DEFERRED_FRAMES:
+                self._deferred[generation] += 1
+                continue
+
+            start = time.perf_counter()
+            gc.collect(generation)
+            pause = time.perf_counter() - start
+            self._pauses[generation] = pause
+            self._deferred[generation] = 0
+            return pause
+        return 0.
+
+    def get_pauses(self) -> Dict[int, float]:
+        """(dict<int: float>) Returns the last pause (in seconds) of each generation"""
+        return dict(enumerate(self._pauses))
+
+    def _on_collection(self, phase: str, info: dict):
+        """Times every collection, see gc.callbacks"""
+        if phase == "start":
+            self._collection_start = time.perf_counter()
+        elif self._collection_start is not None:
+            pause = time.perf_counter() - self._collection_start
+            self._collection_start = None
+            if self._profiler is not None:
+                self._profiler.record_collection(info["generation"], pause, info["collected"])
@@ -2,9 +2,7 @@
 Classes to represent non-playable computer-controlled moving entity.
 """
 
-import random
 import pymunk
-import time
 
 from game.entity import DynamicEntity
 from game.util import get_collision_direction
@@ -21,6 +19,8 @@ class Mob(DynamicEntity):
 
     Should not be instantiated directly"""
     _type = 5
+    _ai_kind = "patrol"
+    _state_attributes = DynamicEntity._state_attributes + ("_tempo", "_steps")
 
     def __init__(self, mob_id, size, weight=MOB_DEFAULT_TEMPO,
                  tempo=MOB_DEFAULT_TEMPO, max_health=20):
@@ -62,7 +62,9 @@ class Mob(DynamicEntity):
         - further from zero means faster movement
         - negative is reversed
         """
-        return self._tempo
+        if self._store is None:
+            return self._tempo
+        return self._store.tempo[self._slot].item()
 
     def set_tempo(self, tempo):
         """Set the tempo of this mob.
@@ -71,17 +73,44 @@ class Mob(DynamicEntity):
             tempo (int): Zero for no movement, larger values for faster
                          movement and negative for reversed.
         """
-        self._tempo = tempo
+        if self._store is None:
+            self._tempo = tempo
+        else:
+            self._store.tempo[self._slot] = tempo
 
     def get_weight(self):
         """(int): Return the weight of this mob."""
         return self._weight
 
+    def get_steps(self) -> int:
+        """(int) Returns the number of time steps taken by this mob"""
+        if self._store is None:
+            return self._steps
+        return self._store.steps[self._slot].item()
+
+    def increment_steps(self):
+        """Count one more time step taken by this mob."""
+        if self._store is None:
+            self._steps += 1
+        else:
+            self._store.steps[self._slot] += 1
+
+    def _export_state(self):
+        state = super()._export_state()
+        state["tempo"] = self.get_tempo()
+        state["steps"] = self.get_steps()
+        return state
+
+    def _import_state(self, state):
+        super()._import_state(state)
+        self._tempo = state["tempo"]
+        self._steps = state["steps"]
+
     def step(self, time_delta, game_data):
         """Advance this mob by one time step"""
         # Track time via time_delta would be more precise, but a step counter is simpler
         # and works reasonably well, assuming time steps occur at roughly constant time deltas
-        self._steps += 1
+        self.increment_steps()
         vx = self.get_tempo()
         self.set_velocity((vx, self.get_velocity()[1]))
 
@@ -110,6 +139,7 @@ class CloudMob(Mob):
     will fire a fireball at them.
     """
     _id = "cloud"
+    _ai_kind = "cloud"
     MAX_DISTANCE = 20
 
     def __init__(self, fire_range=10):
@@ -120,9 +150,31 @@ class CloudMob(Mob):
                               the cloud will start firing.
         """
         super().__init__(self._id, size=(16, 24), weight=0, tempo=80)
-        self._last_drop = time.time()
+        # the world time of the last drop; clouds are added when their world is created
+        self._last_drop = 0.
         self._fire_range = fire_range
 
+    def get_fire_range(self) -> int:
+        """(int) Returns the horizontal distance from the player where the cloud fires"""
+        return self._fire_range
+
+    def fire(self, world):
+        """Drop a fireball, or occasionally a coin, below the cloud if it has
+        not fired within the last two seconds."""
+        # only fire after a delay
+        if world.get_time() - self._last_drop >= 2:
+            x, y = self.get_position()
+
+            rand_val = world.get_random().randint(1, 10)
+            # occasionally drop a coin instead
+            if rand_val == 1:
+                drop = Coin()
+                world.add_item(drop, x, y + 22)
+            else:
+                drop = Fireball()
+                world.add_mob(drop, x, y + 22)
+            self._last_drop = world.get_time()
+
     def step(self, time_delta, game_data):
         """Move towards the player and fire when within range."""
         world, player = game_data
@@ -134,19 +186,7 @@ class CloudMob(Mob):
         # only fire within range
         if abs(player_x - mob_x) < self._fire_range:
             vx = 0
-            # only fire after a delay
-            if time.time() - self._last_drop >= 2:
-                x, y = self.get_position()
-
-                rand_val = random.randint(1, 10)
-                # occasionally drop a coin instead
-                if rand_val == 1:
-                    drop = Coin()
-                    world.add_item(drop, x, y + 22)
-                else:
-                    drop = Fireball()
-                    world.add_mob(drop, x, y + 22)
-                self._last_drop = time.time()
+            self.fire(world)
 
         # move towards the player
         elif player_x < mob_x:
@@ -0,0 +1,383 @@
+"""
+Navigation graphs of the block grid, for mobs finding their way around a level.
+
+The nodes of a graph are the cells a ground mob can stand in (empty cells above
+a solid one). Its edges are the moves between them: walking to a neighbouring
+cell, dropping off a ledge, and jumping to a cell within reach of the mob's
+jump. Paths are found with A*, minimising the time the moves take.
+"""
+
+import heapq
+import math
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# The kinds of move along an edge of the graph
+WALK = "walk"
+DROP = "drop"
+JUMP = "jump"
+
+# The most nodes a path search expands before giving up, so that searching for
+# an unreachable goal on a large level does not stall the frame
+MAX_SEARCH_NODES = 1000
+
+# The fractions of a mob's full jump speed tried for each jump, lowest first, so
+# that mobs do not jump higher than they need to
+JUMP_FRACTIONS = (.5, .75, 1.)
+
+# The most paths kept between changes of the grid
+MAX_CACHED_PATHS = 1024
+
+Node = Tuple[int, int]
+Edge = Tuple[Node, float, str]
+
+
+class NavProfile(NamedTuple):
+    """How a mob moves, which decides the edges of its navigation graph"""
+    # The horizontal speed of walking, in pixels per second
+    walk_speed: float
+    # The upward speed of a jump, in pixels per second
+    jump_speed: float
+    # The horizontal speed while jumping, in pixels per second
+    jump_drift: float
+
+
+class NavGraph:
+    """The navigation graph of a world's block grid, for mobs moving as a NavProfile.
+
+    The edges of every node can be computed up front (see precompute), or the
+    first time they are needed. They are kept until the blocks around the node
+    change; see sync, which updates the graph in place as blocks are destroyed,
+    hidden or added, recomputing only the edges near them when next needed. The
+    paths found are kept too, until the grid changes.
+    """
+
+    def __init__(self, profile: NavProfile, grid_size: Tuple[int, int], cell_expanse: int,
+                 gravity: float):
+        """Construct the graph of an empty grid; see sync to give it the blocks.
+
+        Parameters:
+            profile (NavProfile): How the mobs using the graph move
+            grid_size (tuple<int, int>): The (column, row) size of the grid
+            cell_expanse (int): The width and height of each cell, in pixels
+            gravity (float): The downward acceleration of the world, in pixels per second squared
+        """
+        self._profile = profile
+        self._columns, self._rows = grid_size
+        self._cell = cell_expanse
+        self._gravity = gravity
+        self._grid = bytes(self._columns * self._rows)
+        # 1 for each cell a mob can stand in, row by row
+        self._nodes = bytearray(self._columns * self._rows)
+        self._version = 0
+
+        # the highest jump, in whole cells
+        self._max_rise = int(profile.jump_speed ** 2 / (2 * gravity) // cell_expanse)
+        # the farthest jump, in cells either side, which bounds the cells a node's edges depend on
+        self._reach = int(2 * profile.jump_speed / gravity * profile.jump_drift // cell_expanse) + 1
+        # the fastest horizontal speed of any move, for the search heuristic
+        self._top_speed = max(profile.walk_speed, profile.jump_drift)
+
+        # maps columns to rows to the edges of each node in them
+        self._edges = {}
+        # maps (start, goal) to the path found between them
+        self._paths = {}
+
+    @classmethod
+    def from_world(cls, world, profile: NavProfile) -> 'NavGraph':
+        """(NavGraph) Returns the navigation graph of the blocks in 'world'"""
+        space = world.get_space()
+        graph = cls(profile, world.get_grid_size(), world.get_cell_expanse(), space.gravity[1])
+        graph.sync(world.get_block_grid())
+        return graph
+
+    def get_profile(self) -> NavProfile:
+        """(NavProfile) Returns how the mobs using the graph move"""
+        return self._profile
+
+    def get_version(self) -> int:
+        """(int) Returns the number of times the grid of the graph has changed"""
+        return self._version
+
+    def fits(self, world) -> bool:
+        """(bool) Returns True iff the graph can be synced with the grid of 'world'"""
+        return (world.get_grid_size() == (self._columns, self._rows)
+                and world.get_cell_expanse() == self._cell
+                and world.get_space().gravity[1] == self._gravity)
+
+    def sync(self, grid: bytearray) -> bool:
+        """Update the graph to the block grid 'grid', as returned by World.get_block_grid
+
+        Only the edges of nodes near the cells that changed are recomputed.
+
+        Returns:
+            (bool): True iff the grid changed since the last sync
+        """
+        if grid == self._grid:
+            return False
+
+        changed = np.flatnonzero(np.frombuffer(grid, dtype=np.uint8)
+                                 != np.frombuffer(self._grid, dtype=np.uint8))
+        self._grid = bytes(grid)
+        solid = np.frombuffer(self._grid, dtype=np.uint8).reshape(self._rows, self._columns) != 0
+        # the cells below the bottom row are outside the world, so are solid
+        below = np.vstack((solid[1:], np.ones((1, self._columns), dtype=bool)))
+        self._nodes = bytearray((~solid & below).astype(np.uint8).tobytes())
+        self._version += 1
+        self._paths.clear()
+
+        # edges depend on the cells within jumping reach, and on whole columns
+        # below them (for drops), so every column within reach is recomputed
+        for column in np.unique(changed % self._columns).tolist():
+            for near in range(column - self._reach, column + self._reach + 1):
+                self._edges.pop(near, None)
+        return True
+
+    def is_solid(self, column: int, row: int) -> bool:
+        """(bool) Returns True iff the cell is filled by a block or outside the world"""
+        if not (0 <= column < self._columns and 0 <= row < self._rows):
+            return True
+        return self._grid[row * self._columns + column] != 0
+
+    def is_node(self, column: int, row: int) -> bool:
+        """(bool) Returns True iff a mob can stand in the cell"""
+        return (0 <= column < self._columns and 0 <= row < self._rows
+                and self._nodes[row * self._columns + column] == 1)
+
+    def node_at(self, x: float, y: float, depth: int = 0) -> Optional[Node]:
+        """(tuple<int, int>) Returns the node containing the position (x, y), or the
+        first node at most 'depth' cells below it, or None if there is none"""
+        column = int(x // self._cell)
+        row = int(y // self._cell)
+        for below in range(row, row + depth + 1):
+            if self.is_solid(column, below):
+                return None
+            if self.is_node(column, below):
+                return column, below
+        return None
+
+    def node_under(self, x: float, y: float, half_width: float) -> Optional[Node]:
+        """(tuple<int, int>) Returns the node of a mob whose centre is at (x, y),
+        which may stand on the edge of a block with its centre over a gap, or
+        None if it is not standing on a node"""
+        return (self.node_at(x, y) or self.node_at(x - half_width, y)
+                or self.node_at(x + half_width, y))
+
+    def precompute(self):
+        """Compute the edges of every node now, rather than when first needed"""
+        for index in np.flatnonzero(np.frombuffer(self._nodes, dtype=np.uint8)).tolist():
+            row, column = divmod(index, self._columns)
+            self.get_edges((column, row))
+
+    def get_edges(self, node: Node) -> List[Edge]:
+        """(list<tuple<tuple<int, int>, float, str>>) Returns the (node, seconds, kind)
+        of each move from 'node'"""
+        column, row = node
+        rows = self._edges.get(column)
+        if rows is None:
+            rows = self._edges[column] = {}
+        edges = rows.get(row)
+        if edges is None:
+            edges = rows[row] = self._find_edges(column, row)
+        return edges
+
+    def get_centre_x(self, column: int) -> float:
+        """(float) Returns the x position of the centre of the cells of 'column'"""
+        return (column + .5) * self._cell
+
+    def find_path(self, start: Node, goal: Node) -> Optional[List[Edge]]:
+        """Find the quickest path between two nodes.
+
+        Returns:
+            (list<tuple<tuple<int, int>, float, str>>): The (node, seconds, kind) of
+                each move along the path, or None if the goal cannot be reached
+                (within MAX_SEARCH_NODES nodes of the search)
+        """
+        key = start, goal
+        if key in self._paths:
+            return self._paths[key]
+
+        path = self._search(start, goal)
+        if len(self._paths) >= MAX_CACHED_PATHS:
+            self._paths.clear()
+        self._paths[key] = path
+        return path
+
+    def _search(self, start: Node, goal: Node) -> Optional[List[Edge]]:
+        """A* search from 'start' to 'goal', see find_path"""
+        seconds_per_column = self._cell / self._top_speed
+        goal_column = goal[0]
+
+        # entries are (estimate, order, node), where order breaks ties in the order pushed
+        frontier = [(abs(goal_column - start[0]) * seconds_per_column, 0, start)]
+        costs = {start: 0.}
+        came_from = {start: None}
+        pushed = 1
+        expanded = 0
+        while frontier:
+            _, _, node = heapq.heappop(frontier)
+            if node == goal:
+                break
+            expanded += 1
+            if expanded > MAX_SEARCH_NODES:
+                return None
+
+            cost = costs[node]
+            for neighbour, seconds, kind in self.get_edges(node):
+                new_cost = cost + seconds
+                if neighbour not in costs or new_cost < costs[neighbour]:
+                    costs[neighbour] = new_cost
+                    came_from[neighbour] = node, seconds, kind
+                    estimate = new_cost + abs(goal_column - neighbour[0]) * seconds_per_column
+                    heapq.heappush(frontier, (estimate, pushed, neighbour))
+                    pushed += 1
+        else:
+            return None
+
+        path = []
+        node = goal
+        while came_from[node] is not None:
+            previous, seconds, kind = came_from[node]
+            path.append((node, seconds, kind))
+            node = previous
+        path.reverse()
+        return path
+
+    def _find_edges(self, column: int, row: int) -> List[Edge]:
+        """(list<tuple<tuple<int, int>, float, str>>) Returns the moves from the node"""
+        if not self.is_node(column, row):
+            return []
+        cell = self._cell
+        walk_time = cell / self._profile.walk_speed
+        edges = []
+
+        for direction in (-1, 1):
+            side = column + direction
+            if self.is_solid(side, row):
+                continue
+            if self.is_node(side, row):
+                edges.append(((side, row), walk_time, WALK))
+                continue
+            # walk off the ledge, and fall to the first node below
+            for below in range(row + 1, self._rows):
+                if self.is_node(side, below):
+                    fall = math.sqrt(2 * (below - row) * cell / self._gravity)
+                    edges.append(((side, below), walk_time + fall, DROP))
+                    break
+
+        # jumps land in any node within reach, along a clear arc
+        columns = self._columns
+        nodes = self._nodes
+        for rise in range(0, self._max_rise + 1):
+            landing_row = row - rise
+            if landing_row < 0:
+                break
+            first = max(0, column - self._reach)
+            last = min(columns - 1, column + self._reach)
+            offset = landing_row * columns
+            # at the same height, nodes that can be walked to are never worth jumping to
+            walkable = range(column, column + 1)
+            if rise == 0:
+                start = column
+                while start > first and nodes[offset + start - 1]:
+                    start -= 1
+                end = column
+                while end < last and nodes[offset + end + 1]:
+                    end += 1
+                walkable = range(start, end + 1)
+
+            for target in range(first, last + 1):
+                if not nodes[offset + target] or target in walkable:
+                    continue
+                airtime = self._plan_jump(column, row, target, landing_row)
+                if airtime is not None:
+                    edges.append(((target, landing_row), airtime, JUMP))
+        return edges
+
+    def _plan_jump(self, column: int, row: int, target: int, landing_row: int) -> Optional[float]:
+        """Find the lowest clear jump from one node to another
+
+        Jumps of a fraction of the full jump speed are tried (see JUMP_FRACTIONS),
+        drifting at a constant speed to land in the middle of the target cell.
+
+        Returns:
+            (float): The seconds the jump takes, or None if there is no such jump
+        """
+        cell = self._cell
+        gravity = self._gravity
+        rise = (row - landing_row) * cell
+        distance = (target - column) * cell
+        for fraction in JUMP_FRACTIONS:
+            jump_speed = self._profile.jump_speed * fraction
+            if jump_speed ** 2 < 2 * gravity * rise:
+                continue
+            airtime = (jump_speed + math.sqrt(jump_speed ** 2 - 2 * gravity * rise)) / gravity
+            drift = distance / airtime
+            if abs(drift) > self._profile.jump_drift:
+                continue
+            if self._is_arc_clear(column, row, drift, jump_speed, airtime):
+                return airtime
+        return None
+
+    def _is_arc_clear(self, column: int, row: int, drift: float, jump_speed: float,
+                      airtime: float) -> bool:
+        """(bool) Returns True iff a mob the size of a cell jumping from the node
+        with the given speeds meets no blocks before it lands"""
+        cell = self._cell
+        gravity = self._gravity
+        start_x = (column + .5) * cell
+        start_y = (row + .5) * cell
+        # just inside the mob's sides, so that it may brush past blocks
+        half = cell / 2 - 1
+        end_x = start_x + drift * airtime
+        apex = jump_speed / gravity
+
+        # for each column the mob passes through, the cells it passes through
+        # are those between the highest and lowest points of the arc over it
+        for crossed in range(int((min(start_x, end_x) - half) // cell),
+                             int((max(start_x, end_x) + half) // cell) + 1):
+            if drift == 0:
+                enter, leave = 0., airtime
+            else:
+                enter = (crossed * cell - half - start_x) / drift
+                leave = ((crossed + 1) * cell + half - start_x) / drift
+                enter, leave = max(0., min(enter, leave)), min(airtime, max(enter, leave))
+            times = [enter, leave] + ([apex] if enter < apex < leave else [])
+            heights = [start_y - jump_speed * time + gravity * time ** 2 / 2 for time in times]
+            for crossed_row in range(int((min(heights) - half) // cell),
+                                     int((max(heights) + half) // cell) + 1):
+                if self.is_solid(crossed, crossed_row):
+                    return False
+        return True
+
+    def get_jump_velocity(self, start: Node, target: Node, airtime: float, x: float) -> Tuple[float, float]:
+        """(tuple<float, float>) Returns the velocity of a mob at the x position 'x'
+        jumping along the edge from 'start' to 'target', which takes 'airtime' seconds"""
+        rise = (start[1] - target[1]) * self._cell
+        jump_speed = (rise + self._gravity * airtime ** 2 / 2) / airtime
+        return (self.get_centre_x(target[0]) - x) / airtime, -jump_speed
+
+
+def get_nav_graph(graphs: Dict[str, NavGraph], key: str, world, profile: NavProfile) -> NavGraph:
+    """Find the navigation graph of a level among graphs cached by level, synced to
+    the blocks of its (new) world, or build it and cache it if there is none yet
+
+    The edges of a new graph are computed as the mobs first need them, rather
+    than up front, as the world is built between frames.
+
+    Parameters:
+        graphs (dict<str: NavGraph>): The graphs cached by level
+        key (str): The level, e.g. its file name
+        world (World): The world just built from the level
+        profile (NavProfile): How the mobs using the graph move
+
+    Returns:
+        (NavGraph): The graph of the world
+    """
+    graph = graphs.get(key)
+    if graph is None or graph.get_profile() != profile or not graph.fits(world):
+        graph = graphs[key] = NavGraph.from_world(world, profile)
+    else:
+        graph.sync(world.get_block_grid())
+    return graph
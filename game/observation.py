@@ -0,0 +1,114 @@
+"""
+Fixed-size grid observations of a world around the player, for automated agents.
+
+An observation is a (CHANNELS, size, size) uint8 array centred on the grid
+cell of the player. Each channel holds the code of what occupies each cell:
+0 for nothing, 1 + the index of its id in the encoder's vocabulary for a
+known id, or OTHER for any other id. Cells outside the world are WALL in the
+block channel.
+"""
+
+import numpy as np
+
+from typing import Sequence
+
+from game.world import World
+
+# Channels of an observation
+BLOCK_CHANNEL = 0
+MOB_CHANNEL = 1
+ITEM_CHANNEL = 2
+CHANNELS = 3
+
+# Codes for ids missing from the vocabulary, and for cells outside the world
+OTHER = 254
+WALL = 255
+
+
+class ObservationEncoder:
+    """Encodes the surroundings of the player into a grid observation"""
+
+    def __init__(self, radius: int, block_ids: Sequence[str], mob_ids: Sequence[str],
+                 item_ids: Sequence[str]):
+        """Constructor
+
+        Parameters:
+            radius (int): The number of cells visible on each side of the player
+            block_ids (list<str>): The vocabulary of block ids
+            mob_ids (list<str>): The vocabulary of mob ids
+            item_ids (list<str>): The vocabulary of item ids
+        """
+        self._radius = radius
+        self._block_codes = {block_id: code for code, block_id in enumerate(block_ids, 1)}
+        self._mob_codes = {mob_id: code for code, mob_id in enumerate(mob_ids, 1)}
+        self._item_codes = {item_id: code for code, item_id in enumerate(item_ids, 1)}
+
+        # per world, the table translating its block grid codes to vocabulary codes
+        self._world = None
+        self._lookup = None
+
+    def get_shape(self):
+        """(tuple<int, int, int>) Returns the shape of an observation"""
+        size = 2 * self._radius + 1
+        return CHANNELS, size, size
+
+    def _get_lookup(self, world: World) -> np.ndarray:
+        """(np.ndarray) Returns the table of vocabulary codes by block grid code for 'world'
+
+        Block grid codes are assigned by each world as blocks are added, so the
+        table is rebuilt when the world changes or has seen new block ids.
+        """
+        block_ids = world.get_block_ids()
+        if self._world is not world or len(self._lookup) != len(block_ids):
+            self._world = world
+            self._lookup = np.array([0] + [self._block_codes.get(block_id, OTHER)
+                                           for block_id in block_ids[1:]], dtype=np.uint8)
+        return self._lookup
+
+    def encode(self, world: World, player, out: np.ndarray = None) -> np.ndarray:
+        """Encodes the surroundings of 'player' in 'world'
+
+        Parameters:
+            world (World): The world to observe
+            player (Player): The player at the centre of the observation
+            out (np.ndarray): The array to write the observation into, of the
+                              shape returned by get_shape; defaults to a new array
+
+        Returns:
+            (np.ndarray): The observation
+        """
+        if out is None:
+            out = np.empty(self.get_shape(), dtype=np.uint8)
+        radius = self._radius
+        size = 2 * radius + 1
+
+        x, y = player.get_position()
+        centre_column, centre_row = world.xy_to_grid(x, y)
+        left, top = centre_column - radius, centre_row - radius
+
+        # the visible part of the block grid, translated without copying the grid
+        columns, rows = world.get_grid_size()
+        grid = np.frombuffer(world.get_block_grid(), dtype=np.uint8).reshape(rows, columns)
+        first_column, last_column = max(left, 0), min(left + size, columns)
+        first_row, last_row = max(top, 0), min(top + size, rows)
+
+        blocks = out[BLOCK_CHANNEL]
+        blocks.fill(WALL)
+        if first_column < last_column and first_row < last_row:
+            blocks[first_row - top:last_row - top, first_column - left:last_column - left] = \
+                self._get_lookup(world)[grid[first_row:last_row, first_column:last_column]]
+
+        # mobs and items are found with one range query each around the player
+        distance = radius * world.get_cell_expanse() * 1.5
+        for channel, things, codes in ((MOB_CHANNEL, world.get_mobs(x, y, distance), self._mob_codes),
+                                       (ITEM_CHANNEL, world.get_items(x, y, distance), self._item_codes)):
+            cells = out[channel]
+            cells.fill(0)
+            for thing in things:
+                column, row = world.xy_to_grid(*thing.get_position())
+                column -= left
+                row -= top
+                if 0 <= column < size and 0 <= row < size:
+                    cells[row, column] = codes.get(thing.get_id(), OTHER)
+
+        return out
@@ -0,0 +1,235 @@
+"""
+Purely visual particle effects (debris, sparks, ...), kept apart from the world.
+
+Particles are not entities: they have no shape in the physics space and never
+affect the game. They are kept as NumPy arrays and updated in one vectorised
+pass per step, and drawn together as one image rather than a canvas item each.
+"""
+
+import math
+import tkinter as tk
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageTk
+
+from game.view import GameView
+
+# The most particles kept at once; emitting more replaces the oldest
+MAX_PARTICLES = 2000
+
+# The sprites of particles, by index, as the (colour, size in pixels, gravity
+# scale) of a square; dropped debris falls, sparks and shine float
+DEBRIS = 0
+SPARK = 1
+SHINE = 2
+SPRITES = (
+    ((160, 82, 45), 4, 1.),
+    ((255, 140, 0), 3, .2),
+    ((255, 215, 0), 2, -.1),
+)
+
+# The seconds over which particles fade out before they expire
+FADE_TIME = .25
+
+
+def make_sprite(colour: Tuple[int, int, int], size: int) -> np.ndarray:
+    """(np.ndarray) Returns the (size, size, 4) RGBA pixels of an opaque square"""
+    sprite = np.empty((size, size, 4), dtype=np.uint8)
+    sprite[...] = (*colour, 255)
+    return sprite
+
+
+class ParticleSystem:
+    """A pool of particles, each with a position, velocity, remaining lifetime and
+    sprite index, stepped together under gravity"""
+
+    def __init__(self, max_particles: int = MAX_PARTICLES, gravity: Tuple[float, float] = (0, 400),
+                 seed: int = None):
+        """Constructor
+
+        Parameters:
+            max_particles (int): The most particles kept at once
+            gravity (tuple<float, float>): The acceleration of particles, scaled by their sprite
+            seed (int): The seed of the random spread of emitted particles
+        """
+        self._gravity = np.array(gravity, dtype=np.float64)
+        self._gravity_scales = np.array([scale for _, _, scale in SPRITES])
+        self._random = np.random.default_rng(seed)
+        self._count = 0
+        self._allocate(max_particles)
+
+    def _allocate(self, max_particles: int):
+        """Make room for 'max_particles', keeping the newest particles"""
+        kept = min(self._count, max_particles)
+        start = self._count - kept
+        positions = np.zeros((max_particles, 2))
+        velocities = np.zeros((max_particles, 2))
+        lifetimes = np.zeros(max_particles)
+        sprites = np.zeros(max_particles, dtype=np.intp)
+        if kept:
+            positions[:kept] = self._positions[start:self._count]
+            velocities[:kept] = self._velocities[start:self._count]
+            lifetimes[:kept] = self._lifetimes[start:self._count]
+            sprites[:kept] = self._sprites[start:self._count]
+        self._positions = positions
+        self._velocities = velocities
+        self._lifetimes = lifetimes
+        self._sprites = sprites
+        self._count = kept
+
+    def set_max_particles(self, max_particles: int):
+        """Set the most particles kept at once, dropping the oldest over it"""
+        if max_particles != len(self._lifetimes):
+            self._allocate(max_particles)
+
+    def get_max_particles(self) -> int:
+        """(int) Returns the most particles kept at once"""
+        return len(self._lifetimes)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def emit(self, x: float, y: float, count: int, sprite: int, speed: float, lifetime: float,
+             velocity: Tuple[float, float] = (0, 0)):
+        """Emit a burst of particles from (x, y)
+
+        Particles fly out in random directions at up to 'speed', on top of
+        'velocity', and expire after between half of and all of 'lifetime'.
+        The oldest particles are replaced if there are too many.
+
+        Parameters:
+            x, y (float): The pixel position to emit from
+            count (int): The number of particles to emit
+            sprite (int): The index of the particles' sprite, see SPRITES
+            speed (float): The most speed of the particles, in pixels per second
+            lifetime (float): The most seconds the particles last
+            velocity (tuple<float, float>): The velocity of the burst as a whole
+        """
+        capacity = len(self._lifetimes)
+        count = min(count, capacity)
+        if count <= 0:
+            return
+        overflow = self._count + count - capacity
+        if overflow > 0:
+            kept = self._count - overflow
+            for array in (self._positions, self._velocities, self._lifetimes, self._sprites):
+                array[:kept] = array[overflow:self._count]
+            self._count = kept
+
+        start, end = self._count, self._count + count
+        angles = self._random.uniform(0, 2 * math.pi, count)
+        speeds = self._random.uniform(0, speed, count)
+        self._positions[start:end] = x, y
+        self._velocities[start:end, 0] = velocity[0] + np.cos(angles) * speeds
+        self._velocities[start:end, 1] = velocity[1] + np.sin(angles) * speeds
+        self._lifetimes[start:end] = self._random.uniform(lifetime / 2, lifetime, count)
+        self._sprites[start:end] = sprite
+        self._count = end
+
+    def step(self, time_delta: float):
+        """Move every particle on by 'time_delta' seconds, and drop those expired"""
+        count = self._count
+        if not count:
+            return
+        positions = self._positions[:count]
+        velocities = self._velocities[:count]
+        lifetimes = self._lifetimes[:count]
+        sprites = self._sprites[:count]
+
+        velocities += self._gravity_scales[sprites, None] * self._gravity * time_delta
+        positions += velocities * time_delta
+        lifetimes -= time_delta
+
+        alive = lifetimes > 0
+        kept = int(np.count_nonzero(alive))
+        if kept < count:
+            # compacting keeps the particles in the order emitted, so the oldest stay first
+            positions[:kept] = positions[alive]
+            velocities[:kept] = velocities[alive]
+            lifetimes[:kept] = lifetimes[alive]
+            sprites[:kept] = sprites[alive]
+            self._count = kept
+
+    def get_particles(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(tuple<np.ndarray, np.ndarray, np.ndarray>) Returns the positions,
+        remaining lifetimes and sprite indices of the live particles"""
+        count = self._count
+        return self._positions[:count], self._lifetimes[:count], self._sprites[:count]
+
+    def clear(self):
+        """Remove every particle"""
+        self._count = 0
+
+
+class ParticleLayer:
+    """Draws every particle of a ParticleSystem onto a canvas as one image"""
+
+    def __init__(self):
+        self._sprites = [make_sprite(colour, size) for colour, size, _ in SPRITES]
+        # the image drawn last, which the canvas does not keep a reference to
+        self._image = None
+
+    def render(self, particles: ParticleSystem, size: Tuple[int, int],
+               offset: Tuple[int, int]) -> Tuple[Tuple[int, int], Image.Image]:
+        """Composite the particles within a view into one image
+
+        Parameters:
+            particles (ParticleSystem): The particles to draw
+            size (tuple<int, int>): The (width, height) of the view, in pixels
+            offset (tuple<int, int>): The offset of the logical view from the view
+
+        Returns:
+            (tuple<tuple<int, int>, Image>): The (x, y) in the view of the top-left
+                of the image of the particles, and the image; or None if no
+                particles are in view
+        """
+        positions, lifetimes, sprites = particles.get_particles()
+        if not len(positions):
+            return None
+        width, height = size
+        xs = np.floor(positions[:, 0] + offset[0]).astype(np.intp)
+        ys = np.floor(positions[:, 1] + offset[1]).astype(np.intp)
+        in_view = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        if not in_view.any():
+            return None
+        xs, ys, lifetimes, sprites = xs[in_view], ys[in_view], lifetimes[in_view], sprites[in_view]
+        alphas = (np.minimum(lifetimes / FADE_TIME, 1.) * 255).astype(np.uint8)
+
+        # only the bounding box of the particles is composited
+        margin = max(sprite.shape[0] for sprite in self._sprites)
+        left, top = max(xs.min() - margin, 0), max(ys.min() - margin, 0)
+        right, bottom = min(xs.max() + margin, width), min(ys.max() + margin, height)
+        pixels = np.zeros((bottom - top, right - left, 4), dtype=np.uint8)
+
+        for index in np.unique(sprites):
+            sprite = self._sprites[index]
+            mask = sprites == index
+            sprite_height, sprite_width = sprite.shape[:2]
+            # the pixels of every particle of this sprite, as (particle, row, column)
+            rows = (ys[mask] - top - sprite_height // 2)[:, None, None] + np.arange(sprite_height)[None, :, None]
+            columns = (xs[mask] - left - sprite_width // 2)[:, None, None] + np.arange(sprite_width)[None, None, :]
+            rows, columns = np.broadcast_arrays(rows, columns)
+            inside = (rows >= 0) & (rows < pixels.shape[0]) & (columns >= 0) & (columns < pixels.shape[1])
+            colours = np.broadcast_to(sprite, rows.shape + (4,)).copy()
+            colours[..., 3] = (colours[..., 3].astype(np.uint16) * alphas[mask][:, None, None] // 255)
+            pixels[rows[inside], columns[inside]] = colours[inside]
+
+        return (int(left), int(top)), Image.fromarray(pixels, "RGBA")
+
+    def draw(self, particles: ParticleSystem, view: GameView, offset: Tuple[int, int]) -> List[int]:
+        """Draw the particles within 'view' as one canvas image, at its render scale
+
+        Returns:
+            (list<int>): The ids of the canvas items drawn
+        """
+        rendered = self.render(particles, view.get_size(), offset)
+        if rendered is None:
+            self._image = None
+            return []
+        (x, y), image = rendered
+        scale = view.get_scale()
+        if scale != 1:
+            image = image.resize((image.width * scale, image.height * scale), Image.NEAREST)
+        self._image = ImageTk.PhotoImage(image)
+        return [view.create_image(x * scale, y * scale, image=self._image, anchor=tk.NW, tags="particles")]
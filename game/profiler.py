@@ -0,0 +1,195 @@
+"""
+Opt-in instrumentation of each frame of the game, by subsystem.
+"""
+
+import collections
+import tracemalloc
+from typing import Dict, List, Tuple
+
+# The subsystems of a frame: stepping the world (physics and bookkeeping), the
+# things' AI, collision callbacks and drawing the view
+SUBSYSTEMS = ("world", "ai", "collision", "render")
+
+# The number of most recent frames whose measurements are kept
+FRAME_HISTORY = 600
+
+
+class FrameProfiler:
+    """Measures the memory allocated by each subsystem during each frame.
+
+    Allocations are traced with tracemalloc, which slows everything down
+    considerably, so nothing is measured unless a profiler is set on the game
+    (see GameSession.set_profiler) or world (see World.set_profiler).
+
+    Each subsystem of a frame records (allocated, peak) in bytes, where:
+        allocated is the memory it allocated and still held when it finished
+        peak is the most memory it held at once, which counts the temporary
+            objects (tuples, lists, vectors, ...) it allocated and freed again
+    Subsystems may be nested (e.g. collision callbacks run within the world
+    step); what a nested subsystem allocates is only counted towards it.
+
+    The pauses of garbage collections are recorded for each frame too, whether
+    or not allocations are traced, see record_collection.
+    """
+
+    def __init__(self, frames: int = FRAME_HISTORY):
+        """Construct a profiler that is not measuring yet, see start.
+
+        Parameters:
+            frames (int): The number of most recent frames to keep
+        """
+        self._frames = collections.deque(maxlen=frames)
+        # maps subsystems to [allocated, peak] during the current frame
+        self._frame = {}
+        # the (generation, pause, collected) of each garbage collection of each kept frame,
+        # and of the current frame
+        self._frame_collections = collections.deque(maxlen=frames)
+        self._collections = []
+        # the subsystems entered, as [subsystem, memory at start, peak, allocated by nested subsystems]
+        self._stack = []
+        # whether tracemalloc was started by this profiler, so should be stopped by it
+        self._started_tracing = False
+
+    def start(self):
+        """Start tracing allocations, if they are not being traced already"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stop tracing allocations, if they were started by this profiler"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def is_tracing(self) -> bool:
+        """(bool) Returns True iff allocations are being traced"""
+        return tracemalloc.is_tracing()
+
+    def enter(self, subsystem: str):
+        """Start measuring 'subsystem', until the matching call to leave"""
+        if not tracemalloc.is_tracing():
+            self._stack.append(None)
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack and self._stack[-1] is not None:
+            # the peak is reset for the nested subsystem, so keep the outer one's so far,
+            # without what the subsystems nested before still hold
+            outer = self._stack[-1]
+            outer[2] = max(outer[2], peak - outer[1] - outer[3])
+        tracemalloc.reset_peak()
+        self._stack.append([subsystem, current, 0, 0])
+
+    def leave(self):
+        """Stop measuring the subsystem last entered"""
+        section = self._stack.pop()
+        if section is None or not tracemalloc.is_tracing():
+            return
+
+        subsystem, start, peak, nested = section
+        current, traced_peak = tracemalloc.get_traced_memory()
+        # the traced peak counts what the nested subsystems still hold, which is theirs
+        peak = max(peak, traced_peak - start - nested)
+
+        record = self._frame.get(subsystem)
+        if record is None:
+            record = self._frame[subsystem] = [0, 0]
+        record[0] += current - start - nested
+        record[1] = max(record[1], peak)
+
+        if self._stack and self._stack[-1] is not None:
+            self._stack[-1][3] += current - start
+            tracemalloc.reset_peak()
+
+    def end_frame(self):
+        """Finish the measurements of the current frame, and start the next
+
+        Frames in which nothing was measured (e.g. before the first step) are not kept.
+        """
+        if self._frame or self._collections:
+            self._frames.append({subsystem: tuple(record) for subsystem, record in self._frame.items()})
+            self._frame_collections.append(self._collections)
+            self._frame = {}
+            self._collections = []
+
+    def record_collection(self, generation: int, pause: float, collected: int):
+        """Record a garbage collection during the current frame
+
+        Parameters:
+            generation (int): The oldest generation collected
+            pause (float): The seconds the collection took
+            collected (int): The number of unreachable objects collected
+        """
+        self._collections.append((generation, pause, collected))
+
+    def get_frames(self) -> List[Dict[str, Tuple[int, int]]]:
+        """(list<dict<str: tuple<int, int>>>) Returns the (allocated, peak) bytes of
+        each subsystem in each of the kept frames, oldest first"""
+        return list(self._frames)
+
+    def get_collections(self) -> List[List[Tuple[int, float, int]]]:
+        """(list<list<tuple<int, float, int>>>) Returns the (generation, pause, collected)
+        of each garbage collection in each of the kept frames, oldest first"""
+        return [list(frame) for frame in self._frame_collections]
+
+    def get_pause_summary(self) -> Dict[int, Dict[str, float]]:
+        """(dict<int: dict<str: float>>) Returns, for each generation collected in
+        the kept frames, its number of "collections", and their "total" and "max"
+        pause in seconds"""
+        summary = {}
+        for frame in self._frame_collections:
+            for generation, pause, _ in frame:
+                pauses = summary.setdefault(generation, {"collections": 0, "total": 0., "max": 0.})
+                pauses["collections"] += 1
+                pauses["total"] += pause
+                pauses["max"] = max(pauses["max"], pause)
+        return dict(sorted(summary.items()))
+
+    def get_summary(self) -> Dict[str, Dict[str, float]]:
+        """(dict<str: dict<str: float>>) Returns, for each subsystem, the mean and
+        most bytes allocated and held at peak per frame, over the kept frames
+
+        Each subsystem maps "allocated", "max_allocated", "peak" and "max_peak"
+        to its mean allocated, most allocated, mean peak and highest peak.
+        """
+        frames = len(self._frames)
+        measured = {subsystem for frame in self._frames for subsystem in frame}
+        summary = {}
+        for subsystem in list(SUBSYSTEMS) + sorted(measured - set(SUBSYSTEMS)):
+            records = [frame[subsystem] for frame in self._frames if subsystem in frame]
+            if not records:
+                continue
+            summary[subsystem] = {
+                "allocated": sum(allocated for allocated, _ in records) / frames,
+                "max_allocated": max(allocated for allocated, _ in records),
+                "peak": sum(peak for _, peak in records) / frames,
+                "max_peak": max(peak for _, peak in records),
+            }
+        return summary
+
+    def check_budget(self, budgets: Dict[str, int]):
+        """Checks the peak bytes of each subsystem in every kept frame against a budget
+
+        Parameters:
+            budgets (dict<str: int>): The most bytes each subsystem may hold at its
+                                      peak in a frame; subsystems without a budget
+                                      are not checked
+
+        Raises:
+            AssertionError: If a subsystem went over its budget in any frame
+        """
+        summary = self.get_summary()
+        over = [f"{subsystem} peaked at {summary[subsystem]['max_peak']} bytes in a frame, "
+                f"over its budget of {budget}"
+                for subsystem, budget in budgets.items()
+                if subsystem in summary and summary[subsystem]["max_peak"] > budget]
+        if over:
+            raise AssertionError("Allocation budget exceeded: " + "; ".join(over))
+
+    def clear(self):
+        """Forget the measurements of all frames"""
+        self._frames.clear()
+        self._frame = {}
+        self._frame_collections.clear()
+        self._collections = []
@@ -0,0 +1,122 @@
+"""
+Compact, array-backed storage for the state of dynamic entities.
+
+Each dynamic entity bound to a store is given a stable slot, and its state is
+kept in one NumPy column per field rather than in the entity's own attributes.
+The entity's accessor methods read and write its slot, while systems (such as
+batched AI) can read or update a whole column at once.
+"""
+
+import numpy as np
+
+from typing import Dict, Iterable
+
+# Bits of the flags column
+JUMPING = 1 << 0
+INVINCIBLE = 1 << 1
+DUCKING = 1 << 2
+SHOOTING = 1 << 3
+
+# The dtype of each column in the store
+COLUMNS = {
+    "health": np.float64,
+    "max_health": np.float64,
+    "tempo": np.float64,
+    "steps": np.int64,
+    "flags": np.uint32,
+}
+
+
+class EntityStateStore:
+    """Structure-of-arrays store for the state of dynamic entities.
+
+    Columns are available as attributes (e.g. store.health) and are indexed by
+    slot. Columns are reallocated when the store grows, so references to them
+    should not be kept across calls to allocate.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """Constructor
+
+        Parameters:
+            capacity (int): The initial number of slots in the store
+        """
+        self._capacity = capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._in_use = np.zeros(capacity, dtype=bool)
+
+        for column, dtype in COLUMNS.items():
+            setattr(self, column, np.zeros(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self._capacity - len(self._free)
+
+    def get_capacity(self) -> int:
+        """(int) Returns the number of slots currently allocated for"""
+        return self._capacity
+
+    def _grow(self):
+        """Doubles the capacity of the store"""
+        old_capacity = self._capacity
+        self._capacity *= 2
+
+        for column in COLUMNS:
+            old = getattr(self, column)
+            new = np.zeros(self._capacity, dtype=old.dtype)
+            new[:old_capacity] = old
+            setattr(self, column, new)
+
+        in_use = np.zeros(self._capacity, dtype=bool)
+        in_use[:old_capacity] = self._in_use
+        self._in_use = in_use
+
+        self._free.extend(range(self._capacity - 1, old_capacity - 1, -1))
+
+    def allocate(self) -> int:
+        """(int) Reserves and returns a free slot, with all columns zeroed"""
+        if not self._free:
+            self._grow()
+
+        slot = self._free.pop()
+        self._in_use[slot] = True
+        for column in COLUMNS:
+            getattr(self, column)[slot] = 0
+        return slot
+
+    def release(self, slot: int):
+        """Frees 'slot' so it can be reused by another entity"""
+        if not self._in_use[slot]:
+            raise ValueError(f"Slot {slot} is not in use")
+        self._in_use[slot] = False
+        self._free.append(slot)
+
+    def get_slots_in_use(self) -> np.ndarray:
+        """(np.ndarray) Returns the indices of all slots in use"""
+        return np.flatnonzero(self._in_use)
+
+    def read(self, slot: int) -> Dict[str, float]:
+        """(dict<str: float>) Returns the value of every column for 'slot'"""
+        return {column: getattr(self, column)[slot].item() for column in COLUMNS}
+
+    def write(self, slot: int, state: Dict[str, float]):
+        """Writes the column values of 'state' into 'slot'"""
+        for column, value in state.items():
+            getattr(self, column)[slot] = value
+
+    def get_flag(self, slot: int, flag: int) -> bool:
+        """(bool) Returns True iff 'flag' is set for 'slot'"""
+        return bool(self.flags[slot] & flag)
+
+    def set_flag(self, slot: int, flag: int, value: bool):
+        """Sets or clears 'flag' for 'slot'"""
+        if value:
+            self.flags[slot] |= flag
+        else:
+            self.flags[slot] &= ~np.uint32(flag)
+
+
+def get_slots(entities: Iterable) -> np.ndarray:
+    """(np.ndarray) Returns the store slots of 'entities', which must all be bound"""
+    entities = list(entities)
+    return np.fromiter((entity.get_state_slot() for entity in entities),
+                       dtype=np.intp, count=len(entities))
@@ -0,0 +1,589 @@
+"""
+An axis-aligned physics backend for worlds made of blocks on a grid.
+
+A drop-in alternative to the parts of pymunk used by World (see the physics
+option of World). Every shape collides as its axis-aligned bounding box and
+never rotates. Static shapes are indexed by the grid cells they cover, and
+each dynamic body is moved one axis at a time, sweeping its box through the
+cells along the way, so fast bodies cannot pass through blocks. Once moved,
+dynamic shapes are tested against each other for overlap and pushed apart.
+Each dynamic body is expected to have a single shape.
+
+Collision handlers have the same callbacks as pymunk's: begin when two shapes
+start touching (returning False ignores them until they separate), pre_solve
+every step they touch (returning False ignores the contact for that step),
+post_solve once the contact is resolved, and separate when they stop touching
+or either is removed.
+
+Like pymunk's collision slop, shapes in resting contact are left overlapping
+by PENETRATION, so their contact persists between steps and the points on the
+edge of a resting body are inside the shape it rests on.
+"""
+
+import math
+from typing import List, Optional, Tuple
+
+import pymunk
+from pymunk import BB, PointQueryInfo, ShapeFilter, Vec2d
+
+# Overlap left between shapes in resting contact
+PENETRATION = 0.1
+# Shapes overlapping a moving box by less than this across the direction of
+# movement do not block it, so bodies slide along the blocks they rest on
+SKIN = 0.5
+# Static shapes covering more grid cells than this (e.g. the boundary walls)
+# are tested against every body rather than indexed by cell
+MAX_INDEXED_CELLS = 64
+
+
+def _can_collide(shape_a: 'Shape', shape_b: 'Shape') -> bool:
+    """(bool) Returns True iff the filters of two shapes let them collide, as in pymunk"""
+    filter_a = shape_a.filter
+    filter_b = shape_b.filter
+    if filter_a.group and filter_a.group == filter_b.group:
+        return False
+    return bool(filter_a.categories & filter_b.mask and filter_b.categories & filter_a.mask)
+
+
+class Body:
+    """A body which moves without rotating"""
+
+    DYNAMIC = pymunk.Body.DYNAMIC
+    STATIC = pymunk.Body.STATIC
+
+    def __init__(self, mass: float = 0, moment: float = 0, body_type: int = DYNAMIC):
+        """Constructor
+
+        Parameters:
+            mass (float): The mass of the body; a dynamic body without mass is not
+                          affected by gravity and is not pushed by other bodies
+            moment (float): Unused, as bodies never rotate
+            body_type (int): Body.DYNAMIC or Body.STATIC
+        """
+        self.mass = mass
+        self.body_type = body_type
+        self.space = None
+        self._position = [0., 0.]
+        self._velocity = [0., 0.]
+        # the force applied during the next step only, as in pymunk
+        self._force = [0., 0.]
+        # the velocity the force added during the last step, which pushing into a
+        # shape does not turn into friction
+        self._pushed = [0., 0.]
+
+    @property
+    def position(self) -> Vec2d:
+        return Vec2d(*self._position)
+
+    @position.setter
+    def position(self, position: Tuple[float, float]):
+        x, y = position
+        self._position = [float(x), float(y)]
+
+    @property
+    def velocity(self) -> Vec2d:
+        return Vec2d(*self._velocity)
+
+    @velocity.setter
+    def velocity(self, velocity: Tuple[float, float]):
+        x, y = velocity
+        self._velocity = [float(x), float(y)]
+
+    @property
+    def force(self) -> Vec2d:
+        return Vec2d(*self._force)
+
+    @force.setter
+    def force(self, force: Tuple[float, float]):
+        x, y = force
+        self._force = [float(x), float(y)]
+
+
+class Shape:
+    """A box attached to a body
+
+    Should not be instantiated directly.
+    """
+
+    def __init__(self, body: Body, left: float, top: float, right: float, bottom: float):
+        """Constructor
+
+        Parameters:
+            body (Body): The body the shape is attached to
+            left, top, right, bottom (float): The edges of the box, relative to the
+                                              body's position, where top is the least y
+        """
+        self.body = body
+        self._box = (left, top, right, bottom)
+        # the box in world coordinates, fixed while a static shape is in a space
+        self._bounds = None
+
+        self.object = None
+        self.collision_type = 0
+        self.filter = ShapeFilter()
+        self.friction = 0.
+        self.space = None
+
+    def get_box(self) -> Tuple[float, float, float, float]:
+        """(tuple<float, float, float, float>) Returns the (left, top, right, bottom)
+        edges of the shape in world coordinates, where top is the least y"""
+        if self._bounds is not None:
+            return self._bounds
+        x, y = self.body._position
+        left, top, right, bottom = self._box
+        return x + left, y + top, x + right, y + bottom
+
+    @property
+    def bb(self) -> BB:
+        left, top, right, bottom = self.get_box()
+        # pymunk's bottom is the least y
+        return BB(left, top, right, bottom)
+
+    def point_query(self, point: Tuple[float, float]) -> Tuple[float, PointQueryInfo]:
+        """Returns the signed distance from 'point' to the shape, as pymunk's Shape.point_query
+
+        Returns:
+            (tuple<float, PointQueryInfo>): The distance, which is negative inside
+                                            the shape, and the details of the query
+        """
+        x, y = point
+        left, top, right, bottom = self.get_box()
+        dx = max(left - x, x - right)
+        dy = max(top - y, y - bottom)
+        if dx < 0 and dy < 0:
+            distance = max(dx, dy)
+        else:
+            distance = math.hypot(max(dx, 0), max(dy, 0))
+        nearest = Vec2d(min(max(x, left), right), min(max(y, top), bottom))
+        return distance, PointQueryInfo(self, nearest, distance, Vec2d(0, 0))
+
+
+class Poly(Shape):
+    """A polygon, colliding as its bounding box"""
+
+    def __init__(self, body: Body, vertices, transform=None, radius: float = 0):
+        """Constructor
+
+        Parameters:
+            body (Body): The body the shape is attached to
+            vertices (list<tuple<float, float>>): The vertices, relative to the body
+            transform: Unused, for compatibility with pymunk.Poly
+            radius (float): The amount the polygon is rounded (i.e. grown) by
+        """
+        xs = [x for x, _ in vertices]
+        ys = [y for _, y in vertices]
+        super().__init__(body, min(xs) - radius, min(ys) - radius, max(xs) + radius, max(ys) + radius)
+
+
+class Segment(Shape):
+    """A line segment with a thickness, colliding as its bounding box"""
+
+    def __init__(self, body: Body, a: Tuple[float, float], b: Tuple[float, float], radius: float):
+        """Constructor
+
+        Parameters:
+            body (Body): The body the shape is attached to
+            a, b (tuple<float, float>): The end points, relative to the body
+            radius (float): The thickness of the segment on each side
+        """
+        (ax, ay), (bx, by) = a, b
+        super().__init__(body, min(ax, bx) - radius, min(ay, by) - radius,
+                         max(ax, bx) + radius, max(ay, by) + radius)
+
+
+class CollisionHandler:
+    """The callbacks for collisions between two collision types, see Space.add_collision_handler
+
+    Each callback is called as callback(arbiter, space, data).
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.begin = None
+        self.pre_solve = None
+        self.post_solve = None
+        self.separate = None
+
+
+class Arbiter:
+    """The contact between two touching shapes, passed to collision callbacks"""
+
+    def __init__(self, shapes: Tuple[Shape, Shape], handler: CollisionHandler):
+        """Constructor
+
+        Parameters:
+            shapes (tuple<Shape, Shape>): The shapes, in the order of the handler's collision types
+            handler (CollisionHandler): The handler of the contact
+        """
+        self.shapes = shapes
+        self.is_first_contact = True
+        # the friction of the contact, which callbacks may change, as in pymunk
+        self.friction = shapes[0].friction * shapes[1].friction
+        self._handler = handler
+        # whether begin rejected the contact, and whether it is solved this step
+        self._ignored = False
+        self._solved = True
+
+
+class Space:
+    """A space of boxes, stepped with swept collisions against a grid of static shapes"""
+
+    def __init__(self, cell_size: float):
+        """Constructor
+
+        Parameters:
+            cell_size (float): The size of the grid cells static shapes are indexed by
+        """
+        self.gravity = (0, 0)
+        # the number of passes pushing apart overlapping dynamic shapes in each step
+        self.iterations = 1
+        self.static_body = Body(body_type=Body.STATIC)
+        self.static_body.space = self
+
+        self._cell_size = cell_size
+        # dicts are used as ordered sets, so the simulation does not depend on hashing
+        self._bodies = {}
+        self._shapes = {}
+        self._dynamic = {}
+        # maps (column, row) to the static shapes covering that cell
+        self._cells = {}
+        self._large = []
+
+        self._handlers = {}
+        self._default_handler = CollisionHandler()
+        # maps pairs of shapes to the Arbiter of their contact at the last step
+        self._arbiters = {}
+
+    @property
+    def bodies(self) -> List[Body]:
+        return list(self._bodies)
+
+    @property
+    def shapes(self) -> List[Shape]:
+        return list(self._shapes)
+
+    def add_collision_handler(self, collision_type_a: int, collision_type_b: int) -> CollisionHandler:
+        """(CollisionHandler) Returns the handler for collisions between two collision types"""
+        key = collision_type_a, collision_type_b
+        handler = self._handlers.get(key)
+        if handler is None:
+            handler = self._handlers[key] = CollisionHandler()
+        return handler
+
+    def add(self, *objects):
+        """Adds bodies & shapes to the space"""
+        for obj in objects:
+            obj.space = self
+            if isinstance(obj, Body):
+                self._bodies[obj] = None
+                continue
+
+            self._shapes[obj] = None
+            if obj.body.body_type == Body.STATIC:
+                obj._bounds = obj.get_box()
+                self._index(obj)
+            else:
+                self._dynamic[obj] = None
+
+    def remove(self, *objects):
+        """Removes bodies & shapes from the space, separating the contacts of removed shapes"""
+        for obj in objects:
+            obj.space = None
+            if isinstance(obj, Body):
+                del self._bodies[obj]
+                continue
+
+            del self._shapes[obj]
+            if obj._bounds is not None:
+                self._unindex(obj)
+                obj._bounds = None
+            else:
+                del self._dynamic[obj]
+
+            for key in [key for key in self._arbiters if obj in key]:
+                self._separate(self._arbiters.pop(key))
+
+    def _cell_range(self, low: float, high: float) -> range:
+        """(range) Returns the cells covering the span from 'low' to 'high', inclusive"""
+        return range(int(low // self._cell_size), int(high // self._cell_size) + 1)
+
+    def _covered_range(self, low: float, high: float) -> range:
+        """(range) Returns the cells covered by the span from 'low' to 'high'
+
+        Unlike _cell_range, a span ending exactly on the edge of a cell does not cover that cell.
+        """
+        first = int(low // self._cell_size)
+        return range(first, max(first + 1, math.ceil(high / self._cell_size)))
+
+    def _index(self, shape: Shape):
+        """Adds a static shape to the cells it covers"""
+        left, top, right, bottom = shape._bounds
+        columns = self._covered_range(left, right)
+        rows = self._covered_range(top, bottom)
+        if len(columns) * len(rows) > MAX_INDEXED_CELLS:
+            self._large.append(shape)
+            return
+
+        shape._cells = [(column, row) for column in columns for row in rows]
+        for cell in shape._cells:
+            self._cells.setdefault(cell, []).append(shape)
+
+    def _unindex(self, shape: Shape):
+        """Removes a static shape from the cells it covers"""
+        if shape in self._large:
+            self._large.remove(shape)
+            return
+        for cell in shape._cells:
+            self._cells[cell].remove(shape)
+
+    def _static_near(self, left: float, top: float, right: float, bottom: float) -> List[Shape]:
+        """(list<Shape>) Returns the static shapes in the cells covering a box,
+        and all shapes too large to index"""
+        cells = self._cells
+        found = {}
+        for column in self._cell_range(left, right):
+            for row in self._cell_range(top, bottom):
+                for shape in cells.get((column, row), ()):
+                    found[shape] = None
+        found.update(dict.fromkeys(self._large))
+        return list(found)
+
+    def _get_handler(self, shape_a: Shape, shape_b: Shape) -> Tuple[CollisionHandler, Tuple[Shape, Shape]]:
+        """Returns the handler of a contact, and its shapes in the order of the handler's collision types"""
+        handler = self._handlers.get((shape_a.collision_type, shape_b.collision_type))
+        if handler is not None:
+            return handler, (shape_a, shape_b)
+        handler = self._handlers.get((shape_b.collision_type, shape_a.collision_type))
+        if handler is not None:
+            return handler, (shape_b, shape_a)
+        return self._default_handler, (shape_a, shape_b)
+
+    def _touch(self, shape_a: Shape, shape_b: Shape, touching: dict) -> Optional[Arbiter]:
+        """Records that two shapes touch during this step, calling begin or pre_solve
+        the first time they are found to touch
+
+        Returns:
+            (Arbiter): The contact, if it should be solved this step, otherwise None
+        """
+        key = (shape_a, shape_b) if id(shape_a) < id(shape_b) else (shape_b, shape_a)
+        arbiter = touching.get(key)
+        if arbiter is not None:
+            return arbiter if arbiter._solved else None
+
+        arbiter = self._arbiters.get(key)
+        if arbiter is None:
+            handler, shapes = self._get_handler(shape_a, shape_b)
+            arbiter = Arbiter(shapes, handler)
+            if handler.begin is not None:
+                arbiter._ignored = not handler.begin(arbiter, self, handler.data)
+        else:
+            arbiter.is_first_contact = False
+
+        handler = arbiter._handler
+        arbiter._solved = not arbiter._ignored
+        if arbiter._solved and handler.pre_solve is not None:
+            arbiter._solved = bool(handler.pre_solve(arbiter, self, handler.data))
+
+        touching[key] = arbiter
+        return arbiter if arbiter._solved else None
+
+    def _separate(self, arbiter: Arbiter):
+        """Calls the separate callback of a contact which has ended"""
+        handler = arbiter._handler
+        if handler.separate is not None:
+            handler.separate(arbiter, self, handler.data)
+
+    def _move(self, shape: Shape, axis: int, distance: float, touching: dict,
+              nearby: List[Shape] = None) -> float:
+        """Moves the body of a dynamic shape 'distance' along one axis, sweeping its box
+        through the grid and stopping at the first static shape it collides with
+
+        Parameters:
+            nearby (list<Shape>): The static shapes around the whole sweep, if already found
+
+        Returns:
+            (float): The distance actually moved
+        """
+        if distance == 0:
+            return 0.
+
+        body = shape.body
+        across = 1 - axis
+        box = shape.get_box()
+        low, high = box[axis], box[axis + 2]
+        across_low, across_high = box[across] + SKIN, box[across + 2] - SKIN
+        if across_low > across_high:
+            across_low = across_high = (box[across] + box[across + 2]) / 2
+
+        # the swept region, from just behind the leading edge to where it moves to
+        if distance > 0:
+            start, end = high - SKIN, high + distance
+        else:
+            start, end = low + distance, low + SKIN
+        if nearby is None:
+            if axis == 0:
+                nearby = self._static_near(start, across_low, end, across_high)
+            else:
+                nearby = self._static_near(across_low, start, across_high, end)
+
+        travel = abs(distance)
+        box_low, box_high = box[across], box[across + 2]
+        candidates = []
+        for index, other in enumerate(nearby):
+            bounds = other._bounds
+            other_low, other_high = bounds[across], bounds[across + 2]
+            # cheap comparisons rule out most shapes before the overlap is measured
+            if other_high <= box_low or other_low >= box_high \
+                    or min(box_high, other_high) - max(box_low, other_low) <= SKIN:
+                continue
+            gap = bounds[axis] - high if distance > 0 else low - bounds[axis + 2]
+            if -SKIN <= gap <= travel and _can_collide(shape, other):
+                candidates.append((gap, index, other))
+        candidates.sort()
+
+        direction = 1. if distance > 0 else -1.
+        position = body._position
+        moved = 0.
+        for gap, _, other in candidates:
+            # callbacks see the shapes in contact, as they would in pymunk
+            contact = gap + PENETRATION
+            position[axis] += direction * (contact - moved)
+            moved = contact
+            arbiter = self._touch(shape, other, touching)
+            if arbiter is None:
+                continue
+
+            # a begin callback may have sent the body away from the shape already
+            velocity = body._velocity[axis]
+            if velocity * direction > 0:
+                body._velocity[axis] = 0.
+                # friction takes at most friction * the normal speed off the tangential speed,
+                # where the normal speed is that of the impact, not the body's own push
+                normal = max(velocity * direction - max(body._pushed[axis] * direction, 0.), 0.)
+                slide = body._velocity[across]
+                limit = arbiter.friction * normal
+                body._velocity[across] = math.copysign(max(abs(slide) - limit, 0.), slide)
+            return direction * moved
+
+        position[axis] += direction * (travel - moved)
+        return distance
+
+    def _touch_overlapping(self, shape: Shape, touching: dict, nearby: List[Shape]):
+        """Records the contacts of a dynamic shape with the static shapes it overlaps,
+        including those it did not move into during this step, among those 'nearby'"""
+        left, top, right, bottom = shape.get_box()
+        for other in nearby:
+            other_left, other_top, other_right, other_bottom = other._bounds
+            if other_right <= left or other_left >= right or other_bottom <= top or other_top >= bottom:
+                continue
+            overlap_x = min(right, other_right) - max(left, other_left)
+            overlap_y = min(bottom, other_bottom) - max(top, other_top)
+            # shapes only overlapping at a corner, e.g. the block below a wall the
+            # body rests against, are not touching
+            if overlap_x > 0 and overlap_y > 0 and max(overlap_x, overlap_y) > SKIN and _can_collide(shape, other):
+                self._touch(shape, other, touching)
+
+    def _collide_dynamic(self, touching: dict):
+        """Finds overlapping dynamic shapes using a grid hash, and pushes apart those which collide"""
+        cells = {}
+        pairs = {}
+        for shape in self._dynamic:
+            left, top, right, bottom = shape.get_box()
+            for column in self._cell_range(left, right):
+                for row in self._cell_range(top, bottom):
+                    cell = cells.setdefault((column, row), [])
+                    for other in cell:
+                        pairs[other, shape] = None
+                    cell.append(shape)
+
+        for shape_a, shape_b in pairs:
+            if shape_a.body is shape_b.body or not _can_collide(shape_a, shape_b):
+                continue
+            left_a, top_a, right_a, bottom_a = shape_a.get_box()
+            left_b, top_b, right_b, bottom_b = shape_b.get_box()
+            if left_a < right_b and left_b < right_a and top_a < bottom_b and top_b < bottom_a:
+                if self._touch(shape_a, shape_b, touching) is not None:
+                    self._push_apart(shape_a, shape_b, touching)
+
+    def _push_apart(self, shape_a: Shape, shape_b: Shape, touching: dict):
+        """Separates two overlapping dynamic shapes along the axis they overlap least on,
+        in proportion to their inverse masses, and stops them moving towards each other"""
+        box_a = shape_a.get_box()
+        box_b = shape_b.get_box()
+        overlaps = [min(box_a[axis + 2], box_b[axis + 2]) - max(box_a[axis], box_b[axis]) for axis in (0, 1)]
+        axis = 0 if overlaps[0] < overlaps[1] else 1
+
+        body_a, body_b = shape_a.body, shape_b.body
+        inverse_a = 1 / body_a.mass if body_a.mass > 0 else 0.
+        inverse_b = 1 / body_b.mass if body_b.mass > 0 else 0.
+        total = inverse_a + inverse_b
+        if total == 0:
+            return
+
+        # the direction from a to b along the axis
+        normal = 1. if box_a[axis] + box_a[axis + 2] < box_b[axis] + box_b[axis + 2] else -1.
+        correction = max(overlaps[axis] - PENETRATION, 0.)
+        # neither body is pushed into a static shape; what one cannot move, the other does
+        moved = -self._move(shape_a, axis, -normal * correction * inverse_a / total, touching) * normal
+        if inverse_b:
+            self._move(shape_b, axis, normal * (correction - moved), touching)
+
+        closing = (body_a._velocity[axis] - body_b._velocity[axis]) * normal
+        if closing > 0:
+            impulse = closing / total
+            body_a._velocity[axis] -= normal * impulse * inverse_a
+            body_b._velocity[axis] += normal * impulse * inverse_b
+
+    def step(self, time_delta: float):
+        """Advances the space by 'time_delta' seconds"""
+        gravity_x, gravity_y = self.gravity
+        for body in self._bodies:
+            if body.mass > 0:
+                force_x, force_y = body._force
+                body._pushed = [force_x / body.mass * time_delta, force_y / body.mass * time_delta]
+                body._velocity[0] += gravity_x * time_delta + body._pushed[0]
+                body._velocity[1] += gravity_y * time_delta + body._pushed[1]
+                body._force = [0., 0.]
+
+        # maps pairs of shapes to the Arbiter of their contact during this step
+        touching = {}
+        for shape in self._dynamic:
+            velocity_x, velocity_y = shape.body._velocity
+            distance_x, distance_y = velocity_x * time_delta, velocity_y * time_delta
+            # the grid is searched once for the box the shape can sweep through this step
+            left, top, right, bottom = shape.get_box()
+            nearby = self._static_near(left + min(distance_x, 0.) - SKIN, top + min(distance_y, 0.) - SKIN,
+                                       right + max(distance_x, 0.) + SKIN, bottom + max(distance_y, 0.) + SKIN)
+            self._move(shape, 0, distance_x, touching, nearby)
+            self._move(shape, 1, distance_y, touching, nearby)
+            self._touch_overlapping(shape, touching, nearby)
+        for _ in range(self.iterations):
+            self._collide_dynamic(touching)
+
+        for arbiter in touching.values():
+            handler = arbiter._handler
+            if arbiter._solved and handler.post_solve is not None:
+                handler.post_solve(arbiter, self, handler.data)
+
+        for key, arbiter in self._arbiters.items():
+            if key not in touching:
+                self._separate(arbiter)
+        self._arbiters = touching
+
+    def point_query(self, point: Tuple[float, float], max_distance: float,
+                    shape_filter: ShapeFilter) -> List[PointQueryInfo]:
+        """(list<PointQueryInfo>) Returns the shapes within 'max_distance' of 'point'
+        which match 'shape_filter', as pymunk's Space.point_query"""
+        x, y = point
+        nearby = self._static_near(x - max_distance, y - max_distance, x + max_distance, y + max_distance)
+        found = []
+        for shape in nearby + list(self._dynamic):
+            own_filter = shape.filter
+            if (shape_filter.group and shape_filter.group == own_filter.group
+                    or not own_filter.categories & shape_filter.mask
+                    or not shape_filter.categories & own_filter.mask):
+                continue
+            distance, info = shape.point_query(point)
+            if distance <= max_distance:
+                found.append(info)
+        return found
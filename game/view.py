@@ -7,7 +7,9 @@ from typing import Iterable, Tuple, List
 from functools import singledispatch, update_wrapper
 
 import pymunk
+from PIL import ImageTk
 
+from game.assets import AssetManager
 from game.entity import Entity
 from game.block import Block
 from game.item import DroppedItem
@@ -50,9 +52,14 @@ class ViewRenderer:
     To implement a new view method, add a decorator to the draw method of the form:
         @ViewRenderer.draw.register(Type)
     Where Type would be the class of the entity you wish to render.
+
+    Everything is drawn enlarged by the integer render scale: entities are
+    positioned on the canvas with get_position, and images are loaded and
+    scaled by the asset manager (see load_image).
     """
 
-    def __init__(self, block_images, item_images, mob_images):
+    def __init__(self, block_images, item_images, mob_images, scale: int = 1,
+                 assets: AssetManager = None):
         """
         Construct a new ViewRouter with appropriate entity id to image file mappings.
 
@@ -60,30 +67,44 @@ class ViewRenderer:
              block_images (dict<str: str>): A mapping of block ids to their respective images
              item_images (dict<str: str>): A mapping of item ids to their respective images
              mob_images (dict<str: str>): A mapping of mob ids to their respective images
+             scale (int): The integer factor everything is enlarged by
+             assets (AssetManager): The manager of the images drawn, which may be
+                                    shared; a new one at 'scale' if None
         """
         super().__init__()
 
-        self._images = {}
+        self._assets = AssetManager(scale) if assets is None else assets
 
         self._block_images = block_images
         self._item_images = item_images
         self._mob_images = mob_images
 
-    def load_image(self, file: str) -> tk.PhotoImage:
-        """Load an image in the file location of images/{file}.png or images/{file}.gif
+    def load_image(self, file: str, mirrored: bool = False) -> ImageTk.PhotoImage:
+        """Load an image in the file location of images/{file}.png or images/{file}.gif,
+        at the render scale
 
-        Caches the image within the class so it can be drawn within the canvas.
+        The image is kept by the asset manager so it can be drawn within the canvas.
         """
-        if file in self._images:
-            return self._images[file]
+        return self._assets.get(file, mirrored)
+
+    def get_assets(self) -> AssetManager:
+        """(AssetManager) Returns the manager of the images drawn"""
+        return self._assets
 
-        try:
-            image = tk.PhotoImage(file="images/" + file + ".png")
-        except tk.TclError:
-            image = tk.PhotoImage(file="images/" + file + ".gif")
-        self._images[file] = image
+    def get_scale(self) -> int:
+        """(int) Returns the factor everything is enlarged by"""
+        return self._assets.get_scale()
 
-        return image
+    def set_scale(self, scale: int):
+        """Enlarge everything drawn by the integer factor 'scale'"""
+        self._assets.set_scale(scale)
+
+    def get_position(self, shape: pymunk.Shape, offset: Tuple[int, int]) -> Tuple[float, float]:
+        """(tuple<float, float>) Returns the position on the canvas of the centre of
+        'shape', given the offset of the logical view from the canvas"""
+        scale = self._assets.get_scale()
+        centre = shape.bb.center()
+        return (centre.x + offset[0]) * scale, centre.y * scale
 
     @singledispatchmethod
     def draw(self, instance: Entity, shape: pymunk.Shape,
@@ -101,29 +122,30 @@ class ViewRenderer:
             view (tk.Canvas): The canvas on which to draw the entity
             offset (tuple<int, int>): The offset of the logical view from the canvas.
         """
-        return [view.create_rectangle(shape.bb.left + offset[0], shape.bb.top,
-                                      shape.bb.right + offset[0], shape.bb.bottom,
+        scale = self.get_scale()
+        return [view.create_rectangle((shape.bb.left + offset[0]) * scale, shape.bb.top * scale,
+                                      (shape.bb.right + offset[0]) * scale, shape.bb.bottom * scale,
                                       fill='black', tag='undefined')]
 
     @draw.register(Block)
     def _draw_block(self, instance: Block, shape: pymunk.Shape,
                     view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.load_image(self._block_images[instance.get_id()])
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="block")]
 
     @draw.register(DroppedItem)
     def _draw_physical_item(self, instance: DroppedItem, shape: pymunk.Shape,
                             view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.load_image(self._item_images[instance.get_id()])
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="item")]
 
     @draw.register(Mob)
     def _draw_mob(self, instance: Mob, shape: pymunk.Shape,
                         view: tk.Canvas, offset: Tuple[int, int]) -> List[int]:
         image = self.load_image(self._mob_images[instance.get_id()])
-        return [view.create_image(shape.bb.center().x + offset[0], shape.bb.center().y,
+        return [view.create_image(*self.get_position(shape, offset),
                                   image=image, tags="mob")]
 
 
@@ -136,17 +158,41 @@ class GameView(tk.Canvas):
         Parameters:
             master (tk.Tk | tk.Toplevel | tk.Frame): The tkinter master widget
             size (tuple<int, int>): The (width, height) size of the view, in pixels
+                                    of the world; the canvas is enlarged by the
+                                    render scale of the view router
             physical_view_router (ViewRenderer):
                     View router that facilitates drawing of physical items through
                     calling draw method with:
                         (entity, entities shape, self (canvas), offset)
         """
+        scale = physical_view_router.get_scale()
         width, height = size
-        super().__init__(master, width=width, height=height, bg="#6080ff")
+        super().__init__(master, width=width * scale, height=height * scale, bg="#6080ff")
 
         self._world_view_router = physical_view_router
+        self._size = size
         self._offset = (0, 0)
 
+    def set_size(self, size: Tuple[int, int]):
+        """Resize the view to show (width, height) pixels of the world"""
+        self._size = size
+        scale = self.get_scale()
+        self.config(width=size[0] * scale, height=size[1] * scale)
+
+    def get_size(self) -> Tuple[int, int]:
+        """(tuple<int, int>) Returns the (width, height) of the world shown, in pixels"""
+        return self._size
+
+    def get_scale(self) -> int:
+        """(int) Returns the factor the world is enlarged by on the canvas"""
+        return self._world_view_router.get_scale()
+
+    def set_scale(self, scale: int):
+        """Enlarge the world by the integer factor 'scale', resizing the canvas to
+        show the same part of it"""
+        self._world_view_router.set_scale(scale)
+        self.set_size(self._size)
+
     def shift(self, offset: Tuple[int, int]):
         """Shift the view offset by the given offset.
 
@@ -174,3 +220,16 @@ class GameView(tk.Canvas):
             shape = thing.get_shape()
 
             self._world_view_router.draw(thing, shape, self, self._offset)
+
+    def draw_shapes(self, things: Iterable[Tuple[Entity, pymunk.Shape]]):
+        """Draws all entities with the given shapes, according to their draw method
+        (on the view renderer)
+
+        Unlike draw_entities, the entities need not own the shapes, so shared
+        flyweights can be drawn at each of their shapes (see World.get_all_shapes).
+
+        Parameters:
+            things (iterable<tuple<Entity, pymunk.Shape>>): The entities & shapes to draw.
+        """
+        for thing, shape in things:
+            self._world_view_router.draw(thing, shape, self, self._offset)
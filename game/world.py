@@ -2,14 +2,22 @@
 A class to represent a world made up of physical things
 """
 
-import pymunk
+import collections
+import contextlib
+import heapq
+import itertools
+import math
+import random
 import time
-from typing import Tuple, Iterable
+import pymunk
+from typing import Tuple, Iterable, List
 
-from game.entity import BoundaryWall, Entity
+from game import tilemap
+from game.entity import BoundaryWall, Entity, DynamicEntity
+from game.state import EntityStateStore
 from player import Player
 from game.item import DroppedItem
-from game.block import Block
+from game.block import Block, BlockFlyweight
 from game.mob import Mob
 
 # The intention with the following constants is to express a finite range of values that
@@ -19,6 +27,9 @@ from game.mob import Mob
 # been avoided to make the code more easily understood by the student.
 # See: https://docs.python.org/3/library/enum.html
 
+# The number of consecutive static shapes inserted together by World._add_balanced
+BALANCED_RUN = 128
+
 # Unique ids for each collision type
 COLLISION_TYPES = {
     "wall": 1,
@@ -39,12 +50,106 @@ PHYSICAL_THING_CATEGORIES = {
     "mob": 2 ** 5
 }
 
+# Pairs of things which never collide, so their contacts are never generated by pymunk
+#   - Each side is either a category of thing, or a (category, thing id) pair to only
+#     match things of that id
+#   - Implemented with the category & mask bits of each thing's pymunk.ShapeFilter
+NEVER_COLLIDE = {
+    ("mob", "item"),
+}
+
 # Names for each collision event recognised by pymunk (can have a callback attached)
 COLLISION_HANDLER_CALLBACKS = {'begin', 'separate', 'pre_solve', 'post_solve'}
 
 # The size of a time delta between steps
 STEP_SIZE = 0.02
 
+# Broadphase indexes supported by the world
+#   - tree: pymunk's default bounding box tree
+#   - hash: a spatial hash with cells the size of a grid cell
+#   - auto: starts with the tree, then switches to the spatial hash once there are
+#           many dynamic bodies, and re-sizes it as the number of shapes changes
+BROADPHASES = ("tree", "hash", "auto")
+
+# Number of spatial hash cells per shape, as recommended by chipmunk; the static
+# shapes (blocks) are indexed by a hash of the same size, so they are counted too
+HASH_CELLS_PER_SHAPE = 10
+MIN_HASH_COUNT = 1000
+# Steps between each re-evaluation of the broadphase in auto mode
+AUTO_TUNE_INTERVAL = 50
+# Dynamic body count from which auto mode uses a spatial hash
+AUTO_HASH_MIN_BODIES = 64
+
+# Physics engines which can simulate a world, by name
+#   - pymunk: the general rigid body engine
+#   - tilemap: an engine of axis-aligned boxes swept against the block grid, see game.tilemap
+PHYSICS_BACKENDS = {
+    "pymunk": pymunk,
+    "tilemap": tilemap,
+}
+
+# Dynamic bodies moving further than this fraction of their size in a step are moved
+# in substeps (see World.enable_substeps), so they cannot pass through thin geometry
+SUBSTEP_FRACTION = 0.25
+# The margin by which a substepped shape's box is shrunk when testing it for contact,
+# so the blocks it rests on or slides along do not stop it
+SUBSTEP_MARGIN = 1.
+
+# Matches any entity id in a collision dispatch table
+ANY_ID = "*"
+
+
+def _accept_collision(thing_a, thing_b, data, arbiter) -> bool:
+    """Default collision handler, which lets the collision happen"""
+    return True
+
+
+class CollisionDispatcher:
+    """Collision callback which resolves the pair of entity ids involved in a
+    collision to a registered handler.
+
+    Handlers are registered for an (id, id) pair, where either id can be ANY_ID.
+    A pair is resolved by trying, in order, (id_a, id_b), (id_a, ANY_ID),
+    (ANY_ID, id_b) and (ANY_ID, ANY_ID); the result is cached, so every later
+    collision between the same ids takes a single lookup.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._resolved = {}
+
+    def register(self, id_a: str, id_b: str, handler, symmetric: bool = False):
+        """Registers 'handler' for collisions between things with ids 'id_a' & 'id_b'
+
+        Parameters:
+            id_a (str): The id of the first thing, or ANY_ID
+            id_b (str): The id of the second thing, or ANY_ID
+            handler (callable): Called as handler(thing_a, thing_b, data, arbiter), returns
+                                True iff the collision should be considered valid
+            symmetric (bool): If True, also handle (id_b, id_a) collisions, with the
+                              things passed to the handler in the same order
+        """
+        self._handlers[id_a, id_b] = handler
+        if symmetric and id_a != id_b:
+            self._handlers[id_b, id_a] = lambda thing_b, thing_a, data, arbiter: \
+                handler(thing_a, thing_b, data, arbiter)
+        self._resolved.clear()
+
+    def resolve(self, id_a: str, id_b: str):
+        """(callable) Returns the handler for a collision between 'id_a' & 'id_b'"""
+        key = id_a, id_b
+        handler = self._resolved.get(key)
+        if handler is None:
+            handlers = self._handlers
+            handler = (handlers.get(key) or handlers.get((id_a, ANY_ID))
+                       or handlers.get((ANY_ID, id_b)) or handlers.get((ANY_ID, ANY_ID))
+                       or _accept_collision)
+            self._resolved[key] = handler
+        return handler
+
+    def __call__(self, thing_a, thing_b, data, arbiter) -> bool:
+        return self.resolve(thing_a.get_id(), thing_b.get_id())(thing_a, thing_b, data, arbiter)
+
 
 class World:
     """Game world that contains things in physical space.
@@ -64,7 +169,9 @@ class World:
     """
 
     def __init__(self, grid_size, cell_expanse, gravity=(0, 300), boundary_thickness=50,
-                 collision_types=None, thing_categories=None):
+                 collision_types=None, thing_categories=None, compact_state=False,
+                 never_collide=None, broadphase="tree", hash_count=None, seed=None, physics="pymunk",
+                 substep_fraction=SUBSTEP_FRACTION, iterations=None):
         """Creates a new world with four boundary walls
 
         Parameters:
@@ -78,6 +185,22 @@ class World:
             thing_categories (dict<str: int>):
                     Mapping of thing categories to unique powers of 2
                     Defaults to PHYSZICAL_THING_CATEGORIES constant
+            compact_state (bool): If True, the state of dynamic things added to the world
+                                  is kept in an array-backed EntityStateStore
+            never_collide (set<tuple<str | tuple<str, str>, ...>>):
+                    Pairs of things which never collide
+                    Defaults to NEVER_COLLIDE constant
+            broadphase (str): The broadphase index of the space, one of BROADPHASES
+            hash_count (int): The number of cells in the spatial hash
+                              Defaults to a count proportional to the number of shapes
+            seed (int): Seed of the world's random generator, see get_random
+            physics (str): The physics engine simulating the world, one of PHYSICS_BACKENDS
+                           The broadphase options only apply to the pymunk engine
+            substep_fraction (float): Bodies expected to move further than this fraction of
+                                      their size in a step are moved in substeps, see
+                                      enable_substeps; None never substeps
+            iterations (int): The number of iterations of the physics solver in each step
+                              Defaults to the default of the physics engine
 
         """
         if collision_types is None:
@@ -88,23 +211,202 @@ class World:
             thing_categories = PHYSICAL_THING_CATEGORIES
         self._thing_categories = thing_categories
 
-        self._space = pymunk.Space()
+        if never_collide is None:
+            never_collide = NEVER_COLLIDE
+        self._build_shape_filters(never_collide)
+
+        if physics not in PHYSICS_BACKENDS:
+            raise ValueError(f"Unknown physics {physics!r}, expected one of {tuple(PHYSICS_BACKENDS)}")
+        if broadphase not in BROADPHASES:
+            raise ValueError(f"Unknown broadphase {broadphase!r}, expected one of {BROADPHASES}")
+        if physics == "tilemap" and broadphase != "tree":
+            raise ValueError("The tilemap physics engine has no broadphase options")
+
+        self._physics = physics
+        # the module providing the engine's Space, Body & shape classes
+        self._engine = PHYSICS_BACKENDS[physics]
+        if physics == "tilemap":
+            self._space = tilemap.Space(cell_expanse)
+        else:
+            self._space = pymunk.Space()
 
         self._space.gravity = gravity
+        if iterations is not None:
+            self._space.iterations = iterations
+        self._substep_fraction = substep_fraction
+
+        self._broadphase = broadphase
+        self._hash_count = hash_count
+        # the number of dynamic bodies, and of shapes, when the hash was last sized
+        self._tuned_bodies = 0
+        self._tuned_shapes = 0
+        self._steps = 0
 
         self._grid_size = grid_size
         self._cell_expanse = cell_expanse
 
         self._pixel_size = tuple(grid * cell_expanse for grid in grid_size)
 
+        # The block grid holds a small code for the block id in each cell (0 is empty)
+        columns, rows = grid_size
+        self._block_grid = bytearray(columns * rows)
+        self._block_codes = {}
+        self._block_ids = [None]
+        # maps block ids to the flyweight shared by all plain blocks of that id
+        self._flyweights = {}
+
         self._create_boundaries(boundary_thickness)
 
-        self._last_time = time.time()
+        if broadphase == "hash":
+            self.use_spatial_hash(hash_count)
+
+        # maps AI kinds to the BatchAI stepping all things of that kind at once
+        self._batch_ai = {}
+
+        # maps (collision type, collision type, event) to its CollisionDispatcher
+        self._dispatchers = {}
+
+        self._state_store = EntityStateStore() if compact_state else None
+
+        # objects added to or removed from the space while it is being stepped
+        # (e.g. by collision callbacks), as (add, objects) in the order requested
+        self._stepping = False
+        self._deferred = []
+        self._removing = set()
+        # whether additions are held back to be added together, see bulk_add
+        self._bulk = False
+
+        # the world keeps its own clock and random generator, so that runs with
+        # the same seed and inputs are reproducible
+        self._random = random.Random(seed)
+        self._time = 0.
+        # heap of (time, sequence, callback, args) for callbacks due at a time
+        self._scheduled = []
+        self._sequence = itertools.count()
+
+        # measures the allocations of each step, see set_profiler
+        self._profiler = None
+        # decides which mobs have their AI run at each step, see set_ai_scheduler
+        self._ai_scheduler = None
+
+    def _build_shape_filters(self, never_collide):
+        """Derives the shape filter of each kind of thing from the pairs of things
+        which never collide
+
+        Things of an id named in 'never_collide' get a category bit of their own,
+        which is included in the query mask of their category.
+        """
+        categories = dict(self._thing_categories)
+
+        subtypes = sorted({side for pair in never_collide for side in pair if isinstance(side, tuple)})
+        bit = max(categories.values()) << 1
+        for subtype in subtypes:
+            if bit > 2 ** 31:
+                raise ValueError("Too many thing categories to fit in a shape filter")
+            categories[subtype] = bit
+            bit <<= 1
+
+        # the mask used to query for all things of a category
+        self._query_masks = dict(self._thing_categories)
+        for category, thing_id in subtypes:
+            self._query_masks[category] |= categories[category, thing_id]
+
+        def bits(side):
+            return self._query_masks[side] if isinstance(side, str) else categories[side]
+
+        def matches(kind, side):
+            return kind == side or (isinstance(kind, tuple) and kind[0] == side)
+
+        self._shape_filters = {}
+        for kind, category in categories.items():
+            excluded = 0
+            for side_a, side_b in never_collide:
+                if matches(kind, side_a):
+                    excluded |= bits(side_b)
+                if matches(kind, side_b):
+                    excluded |= bits(side_a)
+
+            self._shape_filters[kind] = pymunk.ShapeFilter(categories=category,
+                                                           mask=pymunk.ShapeFilter.ALL_MASKS ^ excluded)
+
+    def get_shape_filter(self, category: str, thing_id: str = None) -> pymunk.ShapeFilter:
+        """(pymunk.ShapeFilter) Returns the shape filter for things of a category
+        and, optionally, a specific id"""
+        shape_filter = self._shape_filters.get((category, thing_id))
+        if shape_filter is None:
+            shape_filter = self._shape_filters[category]
+        return shape_filter
+
+    def get_query_mask(self, category: str) -> int:
+        """(int) Returns the mask matching all things of a category in queries"""
+        return self._query_masks[category]
 
     def get_space(self) -> pymunk.Space:
         """(pymunk.Space): Return the space used by the world."""
         return self._space
 
+    def get_physics(self) -> str:
+        """(str) Returns the physics engine simulating the world, one of PHYSICS_BACKENDS"""
+        return self._physics
+
+    def get_iterations(self) -> int:
+        """(int) Returns the number of iterations of the physics solver in each step"""
+        return self._space.iterations
+
+    def get_broadphase(self) -> str:
+        """(str) Returns the broadphase setting of the world, one of BROADPHASES"""
+        return self._broadphase
+
+    def is_using_spatial_hash(self) -> bool:
+        """(bool) Returns True iff the space currently indexes shapes with a spatial hash"""
+        return self._tuned_bodies > 0
+
+    def use_spatial_hash(self, count: int = None):
+        """Switches the space to a spatial hash with cells the size of a grid cell
+
+        Note: pymunk cannot switch a space back to the bounding box tree.
+
+        Parameters:
+            count (int): The number of cells in the hash
+                         Defaults to a count proportional to the number of shapes, static
+                         and dynamic, as pymunk indexes both with a hash of this size
+        """
+        bodies = max(len(self._space.bodies), 1)
+        shapes = max(len(self._space.shapes), 1)
+        if count is None:
+            count = max(MIN_HASH_COUNT, HASH_CELLS_PER_SHAPE * shapes)
+
+        self._space.use_spatial_hash(self._cell_expanse, count)
+        self._tuned_bodies = bodies
+        self._tuned_shapes = shapes
+
+    def _tune_broadphase(self):
+        """Switches to the spatial hash when there are enough dynamic bodies to
+        warrant it, then re-sizes it when the number of shapes has changed enough"""
+        if self._tuned_bodies == 0:
+            if len(self._space.bodies) >= AUTO_HASH_MIN_BODIES:
+                self.use_spatial_hash(self._hash_count)
+        elif self._hash_count is None:
+            shapes = len(self._space.shapes)
+            if not self._tuned_shapes // 2 <= shapes <= self._tuned_shapes * 2:
+                self.use_spatial_hash()
+
+    def get_state_store(self) -> EntityStateStore:
+        """(EntityStateStore) Returns the store of dynamic thing state, or None if
+        the world does not use compact state"""
+        return self._state_store
+
+    def _bind_state(self, thing: Entity):
+        """Moves the state of 'thing' into the world's state store, if it has one"""
+        if self._state_store is not None and isinstance(thing, DynamicEntity):
+            thing.bind_state(self._state_store)
+
+    def _unbind_state(self, thing: Entity):
+        """Moves the state of 'thing' out of the world's state store"""
+        if (self._state_store is not None and isinstance(thing, DynamicEntity)
+                and thing.get_state_store() is self._state_store):
+            thing.unbind_state()
+
     def _create_boundaries(self, thickness):
         """Create boundary walls of given 'thickness'"""
         width, height = self._pixel_size
@@ -118,10 +420,139 @@ class World:
 
         for wall_id, top_left, bottom_right in walls:
             wall = BoundaryWall(wall_id, self._space.static_body,
-                                top_left, bottom_right, thickness)
+                                top_left, bottom_right, thickness, engine=self._engine)
 
             self._space.add(wall.get_shape())
 
+    def _add(self, *objects):
+        """Adds pymunk bodies & shapes to the space, after the current step if stepping"""
+        if self._stepping or self._bulk:
+            self._deferred.append((True, objects))
+        else:
+            self._space.add(*objects)
+
+    def _remove(self, *objects):
+        """Removes pymunk bodies & shapes from the space, after the current step if stepping"""
+        if self._stepping or self._bulk:
+            # things can be removed by more than one collision in the same step
+            objects = [obj for obj in objects if obj not in self._removing]
+            self._removing.update(objects)
+            self._deferred.append((False, objects))
+        else:
+            self._space.remove(*objects)
+
+    def _add_balanced(self, objects: List):
+        """Adds many pymunk bodies & shapes to the space, with the static shapes
+        in an order that keeps the space's static index balanced
+
+        The static shapes of pymunk are indexed by a bounding box tree, which is
+        not rebalanced as shapes are inserted; inserting neighbouring blocks one
+        after another (as a level is read, row by row) makes it degenerate, and
+        each insertion slower than the last. Inserting the middle run of
+        BALANCED_RUN shapes first, then the middle runs of either half, and so
+        on, keeps it balanced.
+        """
+        if self._physics != "pymunk":
+            self._space.add(*objects)
+            return
+
+        static_body = self._space.static_body
+        static = []
+        others = []
+        for obj in objects:
+            if isinstance(obj, pymunk.Shape) and obj.body is static_body:
+                static.append(obj)
+            else:
+                others.append(obj)
+
+        # runs of consecutive shapes stay together, so that the shapes are still
+        # mostly kept (and so iterated) in the order they were created
+        runs = [static[start:start + BALANCED_RUN] for start in range(0, len(static), BALANCED_RUN)]
+        ordered = []
+        halves = collections.deque([(0, len(runs))])
+        while halves:
+            start, end = halves.popleft()
+            if start < end:
+                middle = (start + end) // 2
+                ordered.extend(runs[middle])
+                halves.append((start, middle))
+                halves.append((middle + 1, end))
+
+        self._space.add(*ordered, *others)
+
+    def _apply_deferred(self, balance: bool = False):
+        """Applies the additions & removals requested during the last step, in order
+
+        pymunk defers these itself, but applies them in an arbitrary order, which
+        would make the order of things (and so the simulation) differ between runs.
+
+        Parameters:
+            balance (bool): If True, consecutive additions are made by _add_balanced
+        """
+        add_all = self._add_balanced if balance else lambda objects: self._space.add(*objects)
+        deferred = self._deferred
+        self._deferred = []
+        self._removing.clear()
+        # consecutive additions are added to the space in one call
+        adding = []
+        for add, objects in deferred:
+            if add:
+                adding.extend(objects)
+                continue
+            if adding:
+                add_all(adding)
+                adding = []
+            self._space.remove(*objects)
+        if adding:
+            add_all(adding)
+
+    @contextlib.contextmanager
+    def bulk_add(self):
+        """Holds back the bodies & shapes of things added to the world within the
+        context, and adds them all to the space at once when it exits
+
+        Things added within the context are already in the world's block grid and
+        state store, but cannot be found by space queries until it exits. Adding
+        them together lets the static blocks be indexed in a balanced order, see
+        _add_balanced.
+
+        Example:
+            with world.bulk_add():
+                for x, y in positions:
+                    world.add_plain_block("brick", x, y)
+        """
+        self._bulk = True
+        try:
+            yield self
+        finally:
+            self._bulk = False
+            # the step applies them itself when it ends
+            if not self._stepping:
+                self._apply_deferred(balance=True)
+
+    def get_random(self) -> random.Random:
+        """(random.Random) Returns the random generator things in this world should use"""
+        return self._random
+
+    def get_time(self) -> float:
+        """(float) Returns the simulated time of the world, in seconds since it was created"""
+        return self._time
+
+    def schedule(self, delay: float, callback, *args):
+        """Calls 'callback' with 'args' once 'delay' seconds of simulated time have passed
+
+        Callbacks are called at the end of a step, after physics is resolved,
+        in the order they are due (or were scheduled, for equal times).
+        """
+        heapq.heappush(self._scheduled, (self._time + delay, next(self._sequence), callback, args))
+
+    def _run_scheduled(self):
+        """Calls all scheduled callbacks which are due"""
+        scheduled = self._scheduled
+        while scheduled and scheduled[0][0] <= self._time:
+            _, _, callback, args = heapq.heappop(scheduled)
+            callback(*args)
+
     def set_gravity(self, gravity_x, gravity_y):
         """Sets the gravity of the world
 
@@ -143,28 +574,111 @@ class World:
         """Returns the expanse (width/height) of each grid cell"""
         return self._cell_expanse
 
+    def register_batch_ai(self, ai_kind: str, batch_ai):
+        """Registers a batched AI to step all things of the given AI kind
+
+        Things whose get_ai_kind is 'ai_kind' are no longer stepped one at a time,
+        instead they are collected each step and passed to batch_ai.step together.
+
+        Parameters:
+            ai_kind (str): The AI kind of the things to step in a batch
+            batch_ai (BatchAI): The batched AI, see game.ai
+        """
+        self._batch_ai[ai_kind] = batch_ai
+
+    def set_profiler(self, profiler):
+        """Measure each step of the world with 'profiler' (see game.profiler.FrameProfiler),
+        or stop measuring if 'profiler' is None
+
+        Steps are measured as the "world" subsystem, with the things' AI and
+        collision callbacks as the nested "ai" and "collision" subsystems.
+        """
+        self._profiler = profiler
+
+    def get_profiler(self):
+        """(FrameProfiler) Returns the profiler measuring the world, or None"""
+        return self._profiler
+
+    def set_ai_scheduler(self, scheduler):
+        """Decide which mobs have their AI run at each step with 'scheduler' (see
+        game.ai.AIScheduler), or run the AI of every mob at every step if None"""
+        self._ai_scheduler = scheduler
+
+    def get_ai_scheduler(self):
+        """(AIScheduler) Returns the scheduler of the mobs' AI, or None"""
+        return self._ai_scheduler
+
     def step(self, game_data):
         """Steps the game world forward by one time step
 
         1. Advances all things in the game world forward by one time step
             step method is called on each thing, with:
-                - time_delta: the time (in seconds) since the last step
+                - time_delta: the simulated time (in seconds) since the last step, i.e. STEP_SIZE
                 - game_data: the game_data parameter supplied to this method
+            things with a registered batch AI are stepped together by that AI
+            if an AI scheduler is set, only the mobs it schedules are stepped
         2. Applies/resolves physics
+        3. Calls scheduled callbacks which are due
 
         Parameters:
             game_data (tuple<World, Player>): Arbitrary data to be passed on to all things
         """
-        now = time.time()
-        time_delta = now - self._last_time
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.enter("world")
+            profiler.enter("ai")
+
+        time_delta = STEP_SIZE
+        batch_ai = self._batch_ai
+        scheduler = self._ai_scheduler
+        batches = {}
+        mobs = []
         for shape in self._space.shapes:
             thing = shape.object
 
-            if thing:
-                thing.step(time_delta, game_data)
-
+            if thing and thing.__class__ is not BlockFlyweight:
+                if scheduler is not None and isinstance(thing, Mob):
+                    mobs.append(thing)
+                    continue
+                ai_kind = thing.get_ai_kind()
+                if ai_kind in batch_ai:
+                    batches.setdefault(ai_kind, []).append(thing)
+                else:
+                    thing.step(time_delta, game_data)
+
+        for ai_kind, things in batches.items():
+            batch_ai[ai_kind].step(things, time_delta, game_data)
+
+        if scheduler is not None:
+            start = time.perf_counter()
+            scheduled = scheduler.schedule(mobs)
+            batches = {}
+            for mob in scheduled:
+                ai_kind = mob.get_ai_kind()
+                if ai_kind in batch_ai:
+                    batches.setdefault(ai_kind, []).append(mob)
+                else:
+                    mob.step(time_delta, game_data)
+            for ai_kind, things in batches.items():
+                batch_ai[ai_kind].step(things, time_delta, game_data)
+            scheduler.record_time(time.perf_counter() - start, len(scheduled))
+
+        if profiler is not None:
+            profiler.leave()
+
+        self._stepping = True
         self._space.step(STEP_SIZE)
-        self._last_time = now
+        self._stepping = False
+        self._apply_deferred()
+        self._time += STEP_SIZE
+        self._run_scheduled()
+
+        self._steps += 1
+        if self._broadphase != "tree" and (self._steps == 1 or self._steps % AUTO_TUNE_INTERVAL == 0):
+            self._tune_broadphase()
+
+        if profiler is not None:
+            profiler.leave()
 
     def xy_to_grid(self, x: float, y: float) -> Tuple[int, int]:
         """Converts pixel position (xy) to grid position"""
@@ -178,12 +692,26 @@ class World:
         """Converts grid position to pixel position of its centre"""
         return int((x + .5) * self._cell_expanse), int((y + .5) * self._cell_expanse)
 
-    def _wrap_callback(self, callback):
+    def _wrap_callback(self, callback, data):
         """Wraps a pymunk collision callback into a more OOP form"""
-
-        def wrapped_callback(arbiter, space, data):
-            thing_a, thing_b = [s.object for s in arbiter.shapes]
-            return callback(thing_a, thing_b, data['data'], arbiter)
+        resolve = self._resolve
+
+        def wrapped_callback(arbiter, space, _):
+            profiler = self._profiler
+            if profiler is not None:
+                profiler.enter("collision")
+            shape_a, shape_b = arbiter.shapes
+            thing_a = shape_a.object
+            if thing_a.__class__ is BlockFlyweight:
+                thing_a = resolve(shape_a)
+            thing_b = shape_b.object
+            if thing_b.__class__ is BlockFlyweight:
+                thing_b = resolve(shape_b)
+            try:
+                return callback(thing_a, thing_b, data, arbiter)
+            finally:
+                if profiler is not None:
+                    profiler.leave()
 
         return wrapped_callback
 
@@ -204,7 +732,45 @@ class World:
         for key in COLLISION_HANDLER_CALLBACKS:
             callback = local_variables[f"on_{key}"]
             if callback:
-                setattr(handler, key, self._wrap_callback(callback))
+                setattr(handler, key, self._wrap_callback(callback, data))
+
+    def register_collision(self, collision_type_a, collision_type_b, id_a: str, id_b: str,
+                           handler, event: str = "begin", symmetric: bool = False):
+        """Registers a handler for collisions between things with specific ids
+
+        The first registration for a pair of collision types and an event installs
+        a CollisionDispatcher as the collision handler of those types; it replaces
+        any callback for that event added with add_collision_handler.
+
+        Parameters:
+            collision_type_a (str): The collision type of the first thing
+            collision_type_b (str): The collision type of the second thing
+            id_a (str): The id of the first thing, or ANY_ID
+            id_b (str): The id of the second thing, or ANY_ID
+            handler (callable): Called as handler(thing_a, thing_b, data, arbiter), returns
+                                True iff the collision should be considered valid
+            event (str): The collision event to handle, one of COLLISION_HANDLER_CALLBACKS
+            symmetric (bool): If True, also handle collisions between ('id_b', 'id_a'),
+                              see CollisionDispatcher.register
+        """
+        key = collision_type_a, collision_type_b, event
+        dispatcher = self._dispatchers.get(key)
+        if dispatcher is None:
+            dispatcher = self._dispatchers[key] = CollisionDispatcher()
+            handler_object = self._space.add_collision_handler(self._collision_types[collision_type_a],
+                                                               self._collision_types[collision_type_b])
+            setattr(handler_object, event, self._wrap_callback(dispatcher, None))
+
+        dispatcher.register(id_a, id_b, handler, symmetric=symmetric)
+
+    def _resolve(self, shape: pymunk.Shape) -> Entity:
+        """(Entity) Returns the thing of 'shape', replacing a block flyweight with a real block"""
+        thing = shape.object
+        if thing.__class__ is BlockFlyweight:
+            thing = Block(thing.get_id())
+            thing.set_shape(shape)
+            shape.object = thing
+        return thing
 
     def get_all_things(self) -> Iterable[Entity]:
         """Yields all physical things in this world, including boundary walls
@@ -212,14 +778,26 @@ class World:
         Yield:
             Entity
         """
+        for shape in self._space.shapes:
+            if shape.object:
+                yield self._resolve(shape)
+
+    def get_all_shapes(self) -> Iterable[Tuple[Entity, pymunk.Shape]]:
+        """Yields all physical things in this world with their shapes, including boundary walls
+
+        Unlike get_all_things, plain blocks are yielded as their shared flyweight.
+
+        Yield:
+            tuple<Entity, pymunk.Shape>
+        """
         for shape in self._space.shapes:
             thing = shape.object
 
             if thing:
-                yield thing
+                yield thing, shape
 
     def add_thing(self, thing: Entity, x: float, y: float, size: Tuple[float, float], collision_type=None,
-                  categories=None, mass: float = 1, friction: float = 1):
+                  categories=None, mass: float = 1, friction: float = 1, shape_filter=None):
         """Adds a thing to the game world centred at the position ('x', 'y')
 
         Parameters:
@@ -232,6 +810,8 @@ class World:
                               value of self._physical_thing_categories
             mass (float): The mass of the thing
             friction (float): The friction of the thing
+            shape_filter (pymunk.ShapeFilter): The shape filter of the thing; takes precedence
+                                               over categories, see get_shape_filter
         """
         width, height = size
 
@@ -240,46 +820,157 @@ class World:
         top = -height // 2
         bottom = top + height
 
-        body = pymunk.Body(mass, pymunk.inf)
+        body = self._engine.Body(mass, pymunk.inf)
         body.position = x, y
-        shape = pymunk.Poly(body, [(left, top), (left, bottom), (right, bottom), (right, top)])
+        shape = self._engine.Poly(body, [(left, top), (left, bottom), (right, bottom), (right, top)])
 
         shape.object = thing
         if collision_type is not None:
             shape.collision_type = collision_type
 
-        if categories is not None:
+        if shape_filter is not None:
+            shape.filter = shape_filter
+        elif categories is not None:
             shape.filter = pymunk.ShapeFilter(categories=categories)
 
         shape.friction = friction
 
         thing.set_shape(shape)
-        self._space.add(body, shape)
+        self._bind_state(thing)
+        self._add(body, shape)
 
     def remove_thing(self, thing: Entity):
         """Removes a thing from the world"""
-        self._space.remove(thing.get_shape())
+        shape = thing.get_shape()
+        if shape.body is self._space.static_body:
+            self._remove(shape)
+        else:
+            self._remove(shape.body, shape)
+        self._unbind_state(thing)
+
+    def enable_substeps(self, thing: Entity):
+        """Moves the dynamic 'thing' in substeps whenever it would move further than
+        the substep fraction of its size in one step
+
+        Each substep moves the thing a part of the way, and the thing stops at the
+        first substep at which it touches a static shape it did not already touch,
+        where the step's collision detection then finds the contact. Other things
+        are moved in a single step as usual.
+
+        The tilemap engine sweeps every body continuously, so has no need of substeps.
+        """
+        if self._substep_fraction is None or self._physics != "pymunk":
+            return
+
+        shape = thing.get_shape()
+        bb = shape.bb
+        half_width = (bb.right - bb.left) / 2 - SUBSTEP_MARGIN
+        half_height = (bb.top - bb.bottom) / 2 - SUBSTEP_MARGIN
+        limit = self._substep_fraction * min(bb.right - bb.left, bb.top - bb.bottom)
+        space = self._space
+        update_position = pymunk.Body.update_position
+        static = pymunk.Body.STATIC
+
+        def touching(body):
+            x, y = body.position
+            return {hit for hit in space.bb_query(pymunk.BB(x - half_width, y - half_height,
+                                                            x + half_width, y + half_height), shape.filter)
+                    if hit.body.body_type == static}
+
+        def substep_position(body, time_delta):
+            substeps = math.ceil(body.velocity.length * time_delta / limit)
+            if substeps <= 1:
+                update_position(body, time_delta)
+                return
+
+            touched = touching(body)
+            for _ in range(substeps):
+                update_position(body, time_delta / substeps)
+                if not touching(body) <= touched:
+                    return
+
+        shape.body.position_func = substep_position
+
+    def has_thing(self, thing: Entity) -> bool:
+        """(bool) Returns True iff the dynamic 'thing' (i.e. a player, mob or item) is in this world"""
+        shape = thing.get_shape()
+        return shape is not None and shape.body.space is self._space
 
     def add_player(self, player: Player, x: float, y: float, mass: float = 100, friction: float = .5):
         """Adds a player to game world at the position ('x', 'y')"""
         dx = dy = int(self._cell_expanse * .4 - 2)
 
-        body = pymunk.Body(mass, pymunk.inf)
+        body = self._engine.Body(mass, pymunk.inf)
         body.position = x, y
 
-        shape = pymunk.Poly(body, [(-dx, -dy), (dx, -dy), (dx, dy), (-dx, dy)], radius=3)
+        shape = self._engine.Poly(body, [(-dx, -dy), (dx, -dy), (dx, dy), (-dx, dy)], radius=3)
         shape.friction = friction
         shape.collision_type = self._collision_types['player']
         shape.object = player
-        shape.filter = pymunk.ShapeFilter(categories=self._thing_categories["player"])
+        shape.filter = self.get_shape_filter("player")
 
         player.set_shape(shape)
+        self._bind_state(player)
 
-        self._space.add(body, shape)
+        self._add(body, shape)
 
     def remove_player(self, player: Player):
         """Removes the player from the game world"""
-        self._space.remove(player.get_shape())
+        shape = player.get_shape()
+        self._remove(shape.body, shape)
+        self._unbind_state(player)
+
+    def _create_block_shape(self, column: int, row: int, width: int, height: int,
+                            friction: float) -> pymunk.Poly:
+        """(pymunk.Poly) Returns a static block shape covering the given grid cells"""
+        left = column * self._cell_expanse
+        right = (column + width) * self._cell_expanse
+        top = row * self._cell_expanse
+        bottom = (row + height) * self._cell_expanse
+
+        shape = self._engine.Poly(self._space.static_body, [(left, top), (left, bottom), (right, bottom), (right, top)])
+        shape.group = 2
+
+        shape.friction = friction
+        shape.collision_type = self._collision_types["block"]
+        shape.filter = self.get_shape_filter("block")
+        return shape
+
+    def _mark_block(self, block_id: str, column: int, row: int, width: float, height: float):
+        """Sets the cells covered by a block in the block grid to the code of 'block_id',
+        or to empty if 'block_id' is None"""
+        if block_id is None:
+            code = 0
+        elif block_id in self._block_codes:
+            code = self._block_codes[block_id]
+        else:
+            code = self._block_codes[block_id] = len(self._block_ids)
+            self._block_ids.append(block_id)
+
+        columns, rows = self._grid_size
+        for y in range(max(row, 0), min(row + max(1, math.ceil(height)), rows)):
+            for x in range(max(column, 0), min(column + max(1, math.ceil(width)), columns)):
+                self._block_grid[y * columns + x] = code
+
+    def get_block_grid(self) -> bytearray:
+        """(bytearray) Returns the block code of every grid cell, row by row
+
+        A code of 0 is an empty cell, see get_block_ids for the ids of other codes.
+        The grid is updated in place as blocks are added and removed.
+        """
+        return self._block_grid
+
+    def get_block_ids(self) -> List[str]:
+        """(list<str>) Returns the block id of each code in the block grid"""
+        return self._block_ids
+
+    def get_block_id(self, column: int, row: int) -> str:
+        """(str) Returns the id of the block in the grid cell at ('column', 'row'),
+        or None if the cell is empty"""
+        columns, rows = self._grid_size
+        if not (0 <= column < columns and 0 <= row < rows):
+            return None
+        return self._block_ids[self._block_grid[row * columns + column]]
 
     def add_block_to_grid(self, entity, column: int, row: int,
                          width: int, height: int, friction: float = 1.):
@@ -293,22 +984,12 @@ class World:
             height (int): The height in cells of this entity
             friction (float): The friction on the surface of the block
         """
-
-        left = column * self._cell_expanse
-        right = (column + width) * self._cell_expanse
-        top = row * self._cell_expanse
-        bottom = (row + height) * self._cell_expanse
-
-        shape = pymunk.Poly(self._space.static_body, [(left, top), (left, bottom), (right, bottom), (right, top)])
+        shape = self._create_block_shape(column, row, width, height, friction)
         shape.object = entity
-        shape.group = 2
-
-        shape.friction = friction
-        shape.collision_type = self._collision_types["block"]
-        shape.filter = pymunk.ShapeFilter(categories=self._thing_categories["block"])
 
         entity.set_shape(shape)
-        self._space.add(shape)
+        self._mark_block(entity.get_id(), column, row, width, height)
+        self._add(shape)
 
     def add_block(self, block: Block, x: float, y: float, *args, **kwargs):
         """Adds a block to the game world at the grid cell that contains ('x', 'y')
@@ -325,20 +1006,47 @@ class World:
         return self.add_block_to_grid(block, col, row,
                                       *block.get_cell_size(), *args, **kwargs)
 
+    def add_plain_block(self, block_id: str, x: float, y: float, friction: float = 1.):
+        """Adds a plain (1x1, stateless) block to the grid cell that contains ('x', 'y')
+
+        The block is represented by a flyweight shared by all plain blocks with
+        the same id; a real Block is only created when one is asked for, e.g. by
+        get_block or a collision callback.
+
+        Parameters:
+            block_id (str): The id of the block
+            x (float): The x-coordinate of the position contained by the cell
+            y (float): The y-coordinate of the position contained by the cell
+            friction (float): The friction on the surface of the block
+        """
+        flyweight = self._flyweights.get(block_id)
+        if flyweight is None:
+            flyweight = self._flyweights[block_id] = BlockFlyweight(block_id)
+
+        col, row = self.xy_to_grid(x, y)
+        shape = self._create_block_shape(col, row, 1, 1, friction)
+        shape.object = flyweight
+
+        self._mark_block(block_id, col, row, 1, 1)
+        self._add(shape)
+
     def get_block(self, x, y):
         """(Block) Returns a block on the point ('x', 'y'), or None if there is no block there
 
         Note: It is technically possible for multiple blocks to overlap, in which case
               this method will return one of those. This should never happen, though.
         """
-        blocks = self._space.point_query((x, y), 0, pymunk.ShapeFilter(mask=self._thing_categories["block"]))
+        blocks = self._space.point_query((x, y), 0, pymunk.ShapeFilter(mask=self._query_masks["block"]))
 
         if blocks:
-            return blocks[0].shape.object
+            return self._resolve(blocks[0].shape)
 
     def remove_block(self, block: Block):
         """Removes a block from the game world"""
+        bb = block.get_shape().bb
+        col, row = self.xy_to_grid(bb.left, bb.bottom)
         self.remove_thing(block)
+        self._mark_block(None, col, row, *block.get_cell_size())
 
     def add_item(self, item: DroppedItem, x: float, y: float, size: Tuple[float, float] = (8, 8),
                  mass: float = 2, friction: float = 1.):
@@ -352,7 +1060,8 @@ class World:
         """
 
         self.add_thing(item, x, y, size, collision_type=self._collision_types['item'],
-                       categories=self._thing_categories["item"], mass=mass, friction=friction)
+                       categories=self._thing_categories["item"], mass=mass, friction=friction,
+                       shape_filter=self.get_shape_filter("item", item.get_id()))
 
     def remove_item(self, item: DroppedItem):
         """Removes an item from the world"""
@@ -368,7 +1077,13 @@ class World:
         """
 
         self.add_thing(mob, x, y, mob.get_size(), collision_type=self._collision_types['mob'],
-                       categories=self._thing_categories["mob"], mass=mob.get_weight(), friction=friction)
+                       categories=self._thing_categories["mob"], mass=mob.get_weight(), friction=friction,
+                       shape_filter=self.get_shape_filter("mob", mob.get_id()))
+
+        # mobs fast enough to pass through thin blocks, e.g. bullets
+        if self._substep_fraction is not None and \
+                abs(mob.get_tempo()) * STEP_SIZE > self._substep_fraction * min(mob.get_size()):
+            self.enable_substeps(mob)
 
     def remove_mob(self, mob: Mob):
         """Removes a mob from the world"""
@@ -379,7 +1094,7 @@ class World:
         queries = self._space.point_query((x, y), distance, pymunk.ShapeFilter(
             mask=pymunk.ShapeFilter.ALL_MASKS ^ self._thing_categories["wall"]))
 
-        return [q.shape.object for q in queries]
+        return [self._resolve(q.shape) for q in queries]
 
     def get_things(self, x: float, y: float) -> [Entity]:
         """(list<Entity>) Returns all things on the point ('x', 'y')"""
@@ -397,13 +1112,13 @@ class World:
     def get_items(self, x: float, y: float, max_distance: float) -> [DroppedItem]:
         """(list<DroppedItem>) Returns all items within 'max_distance' from the point ('x', 'y')"""
         queries = self._space.point_query((x, y), max_distance,
-                                          pymunk.ShapeFilter(mask=self._thing_categories["item"]))
+                                          pymunk.ShapeFilter(mask=self._query_masks["item"]))
 
         return [q.shape.object for q in queries]
 
     def get_mobs(self, x: float, y: float, max_distance: float) -> [Mob]:
         """(list<Mob>) Returns all mobs within 'max_distance' from the point ('x', 'y')"""
         queries = self._space.point_query((x, y), max_distance,
-                                          pymunk.ShapeFilter(mask=self._thing_categories["mob"]))
+                                          pymunk.ShapeFilter(mask=self._query_masks["mob"]))
 
         return [q.shape.object for q in queries]
@@ -4,17 +4,42 @@ tokens of entities.
 
 __version__ = "1.1.0"
 
-from typing import Tuple, Callable, Iterable
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 
+from game.block import Block
 from game.world import World
 
+# The key of the build times under which adding everything to the space is timed
+SPACE_INSERTION = "(space)"
+
+# The number of characters of a level line compared at once, see diff_levels
+DIFF_CHUNK = 64
+
+
+class EntityFactory(NamedTuple):
+    """How to add the entity of a level character to a world.
+
+    Stateful entities are constructed anew for each character, whereas a
+    factory without a constructor adds the same prototype every time.
+    """
+    # The type of entity, under which its build time is measured
+    entity_type: str
+    # Adds an entity to a world: add(world, entity, x, y), with x & y in pixels
+    add: Callable
+    # Returns a new entity, or None to add the prototype
+    create: Optional[Callable] = None
+    # The entity added by every build without a constructor
+    prototype: Any = None
+
 
 class WorldBuilder:
     """World builder class that can be used to construct a world from
     entity ids by dynamically assigning processors to ids.
     """
     def __init__(self, block_size: int, gravity: Tuple[int, int] = (0, 300),
-                 fallback: Callable = None):
+                 fallback: Callable = None, **world_options):
         """Construct a new world builder with a specific block size.
 
         The args passed to the fallback callback is determined by what is given
@@ -26,16 +51,24 @@ class WorldBuilder:
             gravity (tuple<int, int>): The gravity of the world.
             fallback (Callable<World, str, int, int, *> -> None): The builder
                 callback to add an entity to the world for an unknown id.
+            **world_options: Any additional keyword arguments, passed to the World
+                             constructor (e.g. compact_state).
         """
         # the builders dictionary contains mappings on how to
         # process ids of entities
         self._builders = {}
+        # maps entity ids to the EntityFactory that adds them
+        self._factories = {}
         self._entities = []
         self._fallback = fallback
         self._block_size = block_size
         self._gravity = gravity
+        self._world_options = world_options
         self._width = 0
         self._height = 0
+        self._build_times = {}
+        # maps the (x, y) grid position of each entity the last build constructed to that entity
+        self._built = {}
 
     def register_builder(self, entity_id: str, builder: Callable):
         """Register a new builder process for an entity id.
@@ -72,6 +105,29 @@ class WorldBuilder:
         for entity_id in entity_ids:
             self._builders[entity_id] = builder
 
+    def register_factory(self, entity_id: str, factory: EntityFactory):
+        """Register the factory which adds the entities of an entity id.
+
+        Factories take precedence over builders, and are given the pixel
+        position of the entity, i.e. its grid position times the block size.
+
+        Parameters:
+            entity_id (str): String identifier for an entity.
+            factory (EntityFactory): The factory of the entities with this id.
+        """
+        self._factories[entity_id] = factory
+
+    def register_factories(self, factories: Dict[str, EntityFactory]):
+        """Register the factory of each entity id in a mapping of ids to factories.
+
+        See register_factory.
+        """
+        self._factories.update(factories)
+
+    def get_factory(self, entity_id: str) -> Optional[EntityFactory]:
+        """(EntityFactory) Returns the factory of an entity id, or None if it has none"""
+        return self._factories.get(entity_id)
+
     def add_entity(self, entity_id: str, x: int, y: int, *args):
         """Add an entity to the world based on the entity id.
 
@@ -99,28 +155,84 @@ class WorldBuilder:
 
         The size of the world is determined by the maximum entity space occupied.
 
-        Each entity builder is called during this construction.
+        Each entity factory or builder is called during this construction. The
+        bodies and shapes of all entities are created first, and then added to
+        the world's space at once; see get_build_times for how long each took.
 
         Raises:
             KeyError: If there is no associated builder for an entity id and no
                       fallback builder has been set.
         """
-        world = World((self._width, self._height), self._block_size, gravity=self._gravity)
-        for entity in self._entities:
-            entity_id, x, y, args = entity
-
-            if entity_id not in self._builders:
-                if self._fallback is None:
-                    raise KeyError(f"Unable to build world,"
-                                   f"no matching processor for entity id of {entity_id}")
-                self._fallback(world, *entity)
-                continue
-
-            processor = self._builders[entity_id]
-            processor(world, entity_id, x, y, *args)
+        world = World((self._width, self._height), self._block_size, gravity=self._gravity,
+                      **self._world_options)
+        clock = time.perf_counter
+        build_times = self._build_times = {}
+        built = self._built = {}
+
+        with world.bulk_add():
+            for entity_id, x, y, args in self._entities:
+                start = clock()
+                entity_type, thing = self.build_entity(world, entity_id, x, y, *args)
+                if thing is not None:
+                    built[x, y] = thing
+                build_times[entity_type] = build_times.get(entity_type, 0.) + clock() - start
+            start = clock()
+        build_times[SPACE_INSERTION] = clock() - start
 
         return world
 
+    def build_entity(self, world: World, entity_id: str, x: int, y: int, *args) -> Tuple[str, Any]:
+        """Add an entity to a world with its factory, builder or the fallback.
+
+        Parameters:
+            world (World): The world to add the entity to.
+            entity_id (str): The id of the entity.
+            x (int): The x grid position of the entity.
+            y (int): The y grid position of the entity.
+            *args: Any additional arguments, passed to the builder for this entity.
+
+        Returns:
+            (tuple<str, *>): The type of the entity, and the entity if its factory
+                             constructed it (otherwise None)
+
+        Raises:
+            KeyError: If there is no associated builder for the entity id and no
+                      fallback builder has been set.
+        """
+        factory = self._factories.get(entity_id)
+        if factory is not None:
+            if factory.create is None:
+                factory.add(world, factory.prototype, x * self._block_size, y * self._block_size)
+                return factory.entity_type, None
+            thing = factory.create()
+            factory.add(world, thing, x * self._block_size, y * self._block_size)
+            return factory.entity_type, thing
+
+        if entity_id in self._builders:
+            self._builders[entity_id](world, entity_id, x, y, *args)
+        elif self._fallback is not None:
+            self._fallback(world, entity_id, x, y, *args)
+        else:
+            raise KeyError(f"Unable to build world,"
+                           f"no matching processor for entity id of {entity_id}")
+        return entity_id, None
+
+    def get_build_times(self) -> Dict[str, float]:
+        """(dict<str: float>) Returns the seconds the last build spent creating each
+        type of entity, and adding them all to the space (under SPACE_INSERTION)
+
+        Entities added by a builder rather than a factory are timed by entity id.
+        """
+        return dict(self._build_times)
+
+    def get_built_things(self) -> Dict[Tuple[int, int], Any]:
+        """(dict<tuple<int, int>: *>) Returns the entities the last build constructed
+        with a factory, by their (x, y) grid position
+
+        Entities added as a prototype, or by a builder, are not included.
+        """
+        return dict(self._built)
+
     def clear(self):
         """
         Removes all the entities that were added
@@ -142,6 +254,24 @@ def level_size(level: str) -> Tuple[int, int]:
     return level.count('\n') + 1, level.find('\n')
 
 
+def level_entity_types(builder: WorldBuilder, level: str) -> Set[str]:
+    """Find the types of the entities a level string builds, without building it.
+
+    Parameters:
+        builder (WorldBuilder): The builder whose factories name the entity types.
+        level (str): The level string.
+
+    Returns:
+        (set<str>): The entity type of each distinct character of the level
+                    (see EntityFactory), or the character if it has no factory.
+    """
+    entity_types = set()
+    for character in set(level) - {'\n', ' '}:
+        factory = builder.get_factory(character)
+        entity_types.add(character if factory is None else factory.entity_type)
+    return entity_types
+
+
 def load_level(filename: str) -> str:
     """Load a level file into a string and returns that string.
 
@@ -169,6 +299,38 @@ def load_level(filename: str) -> str:
     return "\n".join(level)
 
 
+class LevelWatcher:
+    """Notices when a level file is saved, by polling its modification time"""
+
+    def __init__(self):
+        self._filename = None
+        self._modified = None
+
+    def check(self, filename: str) -> Optional[str]:
+        """Load the level file 'filename' if it was modified since it was last checked.
+
+        The first check of a file (or of another file than the last one checked)
+        only notes when it was last modified.
+
+        Parameters:
+            filename (str): The name of the level file to check.
+
+        Returns:
+            (str): The level string of the modified file, as returned by
+                   load_level, or None if the file was not modified.
+        """
+        modified = os.stat(filename).st_mtime_ns
+        if filename != self._filename:
+            self._filename = filename
+            self._modified = modified
+            return None
+        if modified == self._modified:
+            return None
+
+        self._modified = modified
+        return load_level(filename)
+
+
 def load_world(builder: WorldBuilder, filename: str, *args):
     """Loads entities within a file into a world builder.
 
@@ -179,7 +341,19 @@ def load_world(builder: WorldBuilder, filename: str, *args):
     Returns:
         (World): The world produced by adding the found entities.
     """
-    level = load_level(filename)
+    return build_world(builder, load_level(filename), *args)
+
+
+def build_world(builder: WorldBuilder, level: str, *args):
+    """Loads entities within a level string into a world builder.
+
+    Parameters:
+        builder (WorldBuilder): The builder to append found entities to.
+        level (str): The level string, as returned by load_level.
+
+    Returns:
+        (World): The world produced by adding the found entities.
+    """
     for y, line in enumerate(level.split('\n')):
         for x, character in enumerate(line):
             if character in ('\n', ' '):
@@ -188,3 +362,128 @@ def load_world(builder: WorldBuilder, filename: str, *args):
             builder.add_entity(character, x, y, *args)
 
     return builder.build()
+
+
+def diff_levels(old: str, new: str) -> List[Tuple[int, int, str, str]]:
+    """Find the cells of a level which differ between two level strings.
+
+    Lines of different lengths are compared as if padded with spaces.
+
+    Parameters:
+        old (str): The level string before the change.
+        new (str): The level string after the change.
+
+    Returns:
+        (list<tuple<int, int, str, str>>): The x & y grid position, old character
+                                           and new character of each changed cell,
+                                           where ' ' is an empty cell.
+    """
+    old_lines = old.split('\n')
+    new_lines = new.split('\n')
+    changes = []
+    for y in range(max(len(old_lines), len(new_lines))):
+        old_line = old_lines[y] if y < len(old_lines) else ""
+        new_line = new_lines[y] if y < len(new_lines) else ""
+        if old_line == new_line:
+            continue
+
+        width = max(len(old_line), len(new_line))
+        old_line = old_line.ljust(width)
+        new_line = new_line.ljust(width)
+        # long lines are compared a chunk at a time, as edits tend to be few
+        for start in range(0, width, DIFF_CHUNK):
+            end = start + DIFF_CHUNK
+            if old_line[start:end] == new_line[start:end]:
+                continue
+            for x in range(start, min(end, width)):
+                if old_line[x] != new_line[x]:
+                    changes.append((x, y, old_line[x], new_line[x]))
+    return changes
+
+
+class LevelReloader:
+    """Applies edits of a level to the world built from it, in place.
+
+    Only the cells which changed between the level string the world was built
+    from and the edited one are touched: what the old character of a cell added
+    is removed from the world, and the new character's entity is added. The rest
+    of the world, including the player and anything that moved, is kept as is.
+
+    Entities added by a builder or the fallback, rather than a factory, are not
+    tracked, so stay in the world when their cell changes.
+    """
+
+    def __init__(self, builder: WorldBuilder, world: World, level: str):
+        """Construct a reloader of the world just built by 'builder'.
+
+        Parameters:
+            builder (WorldBuilder): The builder which built the world, whose
+                                    factories add the entities of edited cells.
+            world (World): The world built from the level.
+            level (str): The level string the world was built from.
+        """
+        self._builder = builder
+        self._world = world
+        self._level = level
+        # maps grid positions to the entity constructed for them, see WorldBuilder.get_built_things
+        self._built = builder.get_built_things()
+
+    def get_world(self) -> World:
+        """(World) Returns the world the edits are applied to"""
+        return self._world
+
+    def get_level(self) -> str:
+        """(str) Returns the level string the world currently corresponds to"""
+        return self._level
+
+    def reload(self, level: str) -> Optional[int]:
+        """Apply the changes between the current level string and 'level' to the world.
+
+        Parameters:
+            level (str): The edited level string, as returned by load_level.
+
+        Returns:
+            (int): The number of cells changed, or None if the edit cannot be
+                   applied in place because it adds entities outside the world
+                   (in which case nothing is changed, and the level should be
+                   rebuilt instead).
+        """
+        changes = diff_levels(self._level, level)
+        columns, rows = self._world.get_grid_size()
+        if any((x >= columns or y >= rows) and new != ' ' for x, y, _, new in changes):
+            return None
+
+        world = self._world
+        with world.bulk_add():
+            for x, y, old, _ in changes:
+                if old != ' ':
+                    self._remove_entity(old, x, y)
+            for x, y, _, new in changes:
+                if new != ' ':
+                    _, thing = self._builder.build_entity(world, new, x, y)
+                    if thing is not None:
+                        self._built[x, y] = thing
+
+        self._level = level
+        return len(changes)
+
+    def _remove_entity(self, entity_id: str, x: int, y: int):
+        """Remove the entity which the character 'entity_id' at (x, y) added, if
+        it is still in the world"""
+        world = self._world
+        thing = self._built.pop((x, y), None)
+        if thing is not None:
+            if isinstance(thing, Block):
+                # unless it was destroyed, and maybe replaced, during the game
+                if world.get_block(*world.grid_to_xy_centre(x, y)) is thing:
+                    world.remove_block(thing)
+            elif world.has_thing(thing):
+                world.remove_thing(thing)
+            return
+
+        factory = self._builder.get_factory(entity_id)
+        if factory is not None and factory.create is None:
+            # a prototype block, which is found by the cell it fills
+            block = world.get_block(*world.grid_to_xy_centre(x, y))
+            if block is not None and block.get_id() == factory.prototype:
+                world.remove_block(block)
@@ -0,0 +1,280 @@
+"""Generates synthetic level files, in the format read by level.load_world,
+for scale and stress testing the game engine.
+
+Levels can either be generated from scratch with configurable densities or
+produced by tiling an existing (hand-made) level a number of times.
+
+Example:
+    python level_generator.py stress.txt --width 15000 --mobs g=400 @=400 &=40
+    python level_generator.py level1_x100.txt --scale level1.txt 100
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import os
+import random
+from typing import Dict, Iterable, List, Tuple
+
+from level import load_level
+
+GROUND = '#'
+BASE = '%'
+BRICK = '#'
+MYSTERY_COIN = '$'
+MYSTERY_EMPTY = '?'
+BOUNCE = 'b'
+SWITCH = 'S'
+FLAG = 'I'
+EMPTY = ' '
+
+# The flag is the tallest entity and is placed on top of the ground
+FLAG_HEIGHT = 9
+# Columns at either end of the level kept free of hazards
+SAFE_COLUMNS = 6
+
+MIN_HEIGHT = FLAG_HEIGHT + 4
+
+DEFAULT_MOBS = {'&': 1, '@': 8, 'g': 8}
+DEFAULT_ITEMS = {'C': 6, '*': 1, 'f': 1}
+
+FLYING_MOBS = {'&'}
+
+DEFAULT_WORLD_CONFIG = {
+    "gravity": "400",
+}
+
+DEFAULT_PLAYER_CONFIG = {
+    "character": "luigi",
+    "x": "30",
+    "y": "30",
+    "mass": "100",
+    "health": "10",
+    "max_velocity": "100",
+}
+
+
+def _count(rng: random.Random, density: float, width: int) -> int:
+    """(int) Returns the number of entities to place for a per-column 'density'."""
+    expected = density * width
+    count = int(expected)
+    # carry the fractional part over as a probability
+    if rng.random() < expected - count:
+        count += 1
+    return count
+
+
+def _empty_cells(grid: List[List[str]], rows: Iterable[int],
+                 columns: Iterable[int]) -> List[Tuple[int, int]]:
+    """(list<tuple<int, int>>) Returns all empty (column, row) cells in the given range."""
+    rows = list(rows)
+    return [(x, y) for x in columns for y in rows if grid[y][x] == EMPTY]
+
+
+def generate_level(width: int = 150, height: int = 16, ground: float = 0.95,
+                   bricks: float = 0.15, mysteries: float = 0.08,
+                   bounces: float = 0.01, switches: float = 0.005,
+                   mobs: Dict[str, int] = None, items: Dict[str, int] = None,
+                   seed: int = None) -> str:
+    """Generate a random level string.
+
+    The bottom two rows are ground ('#') over a base ('%') with random gaps,
+    a flag is placed at the end of the level and the remaining entities are
+    scattered over the level.
+
+    Parameters:
+        width (int): The number of columns in the level.
+        height (int): The number of rows in the level, at least MIN_HEIGHT.
+        ground (float): The fraction of columns covered by ground.
+        bricks (float): Expected number of floating bricks per column.
+        mysteries (float): Expected number of mystery blocks per column.
+        bounces (float): Expected number of bounce blocks per column.
+        switches (float): Expected number of switches per column.
+        mobs (dict<str: int>): Mapping of mob characters to how many to place.
+        items (dict<str: int>): Mapping of item characters to how many to place.
+        seed (int): Seed of the random generator, for reproducible levels.
+
+    Returns:
+        (str): The level string, each line having exactly 'width' characters.
+    """
+    if height < MIN_HEIGHT:
+        raise ValueError(f"Level height must be at least {MIN_HEIGHT}, got {height}")
+    if width < 2 * SAFE_COLUMNS + 1:
+        raise ValueError(f"Level width must be at least {2 * SAFE_COLUMNS + 1}, got {width}")
+
+    if mobs is None:
+        mobs = DEFAULT_MOBS
+    if items is None:
+        items = DEFAULT_ITEMS
+
+    rng = random.Random(seed)
+    grid = [[EMPTY] * width for _ in range(height)]
+
+    ground_row = height - 2
+    base_row = height - 1
+    floor_row = ground_row - 1
+    play_columns = range(SAFE_COLUMNS, width - SAFE_COLUMNS)
+
+    # ground, with gaps only away from the start and the end of the level
+    for x in range(width):
+        if x in play_columns and rng.random() >= ground:
+            continue
+        grid[ground_row][x] = GROUND
+        grid[base_row][x] = BASE
+    solid = [x for x in play_columns if grid[ground_row][x] == GROUND]
+
+    # runs of floating bricks, kept clear of the floor so the ground is walkable
+    air_rows = range(3, floor_row - 2)
+    for _ in range(_count(rng, bricks / 4, width)):
+        x, y = rng.choice(play_columns), rng.choice(air_rows)
+        for dx in range(rng.randint(2, 6)):
+            if x + dx < width - SAFE_COLUMNS:
+                grid[y][x + dx] = BRICK
+
+    # mystery blocks float, bounce blocks replace ground and switches sit on it
+    for _ in range(_count(rng, mysteries, width)):
+        x, y = rng.choice(play_columns), rng.choice(air_rows)
+        grid[y][x] = rng.choice((MYSTERY_COIN, MYSTERY_EMPTY))
+    for _ in range(_count(rng, bounces, width)):
+        if solid:
+            grid[ground_row][rng.choice(solid)] = BOUNCE
+    for _ in range(_count(rng, switches, width)):
+        if solid:
+            grid[floor_row][rng.choice(solid)] = SWITCH
+
+    grid[floor_row][width - SAFE_COLUMNS // 2] = FLAG
+
+    # mobs walk on the ground, flying mobs near the top of the level
+    floor_cells = _empty_cells(grid, (floor_row,), solid)
+    sky_cells = _empty_cells(grid, range(0, 3), play_columns)
+    air_cells = _empty_cells(grid, air_rows, play_columns)
+    for cells, placements in (
+            (sky_cells, [(c, n) for c, n in mobs.items() if c in FLYING_MOBS]),
+            (floor_cells, [(c, n) for c, n in mobs.items() if c not in FLYING_MOBS]),
+            (air_cells, list(items.items()))):
+        rng.shuffle(cells)
+        for character, count in placements:
+            for _ in range(count):
+                if not cells:
+                    break
+                x, y = cells.pop()
+                grid[y][x] = character
+
+    return "\n".join("".join(row) for row in grid)
+
+
+def scale_level(level: str, factor: int) -> str:
+    """Repeat a level string horizontally 'factor' times.
+
+    Only the last copy keeps its flag, so the scaled level still ends at the
+    same goal as the original level.
+
+    Parameters:
+        level (str): The level string, as returned by level.load_level.
+        factor (int): The number of copies of the level.
+
+    Returns:
+        (str): The scaled level string.
+    """
+    if factor < 1:
+        raise ValueError(f"Scale factor must be positive, got {factor}")
+
+    lines = level.split('\n')
+    width = max(len(line) for line in lines)
+    lines = [line.ljust(width) for line in lines]
+
+    scaled = []
+    for line in lines:
+        copy = line.replace(FLAG, EMPTY)
+        scaled.append(copy * (factor - 1) + line)
+    return "\n".join(scaled)
+
+
+def write_level(filename: str, level: str):
+    """Write a level string to the file 'filename'."""
+    with open(filename, 'w') as file:
+        file.write(level)
+        file.write('\n')
+
+
+def write_configuration(filename: str, levels: List[str], goal: str = "END",
+                        append: bool = True):
+    """Write configuration sections chaining 'levels' through their goals.
+
+    Each level's goal is the next level in the list, the last level's goal
+    is 'goal'. If the configuration file does not exist, or 'append' is False,
+    a new configuration file is written starting at the first level.
+
+    Parameters:
+        filename (str): The configuration file to write to.
+        levels (list<str>): The level file names, in the order they are played.
+        goal (str): The goal of the last level.
+        append (bool): Whether to add the sections to an existing configuration.
+    """
+    sections = []
+    if not append or not os.path.exists(filename):
+        world = dict(DEFAULT_WORLD_CONFIG, start=levels[0])
+        sections.append(("World", world))
+        sections.append(("Player", DEFAULT_PLAYER_CONFIG))
+
+    for level, next_level in zip(levels, levels[1:] + [goal]):
+        sections.append((level, {"goal": next_level}))
+
+    lines = []
+    for heading, attributes in sections:
+        lines.append(f"=={heading}==")
+        lines.extend(f"{attr} : {value}" for attr, value in attributes.items())
+
+    mode = 'a' if append and os.path.exists(filename) else 'w'
+    with open(filename, mode) as file:
+        if mode == 'a':
+            file.write('\n')
+        file.write("\n".join(lines))
+
+
+def _parse_counts(pairs: List[str]) -> Dict[str, int]:
+    """(dict<str: int>) Parses command line 'character=count' pairs."""
+    counts = {}
+    for pair in pairs:
+        character, _, count = pair.partition('=')
+        counts[character] = int(count)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Mario levels")
+    parser.add_argument("output", help="level file to write")
+    parser.add_argument("--scale", nargs=2, metavar=("LEVEL", "FACTOR"),
+                        help="tile an existing level FACTOR times instead of generating one")
+    parser.add_argument("--width", type=int, default=150)
+    parser.add_argument("--height", type=int, default=16)
+    parser.add_argument("--ground", type=float, default=0.95)
+    parser.add_argument("--bricks", type=float, default=0.15)
+    parser.add_argument("--mysteries", type=float, default=0.08)
+    parser.add_argument("--bounces", type=float, default=0.01)
+    parser.add_argument("--switches", type=float, default=0.005)
+    parser.add_argument("--mobs", nargs='*', metavar="CHAR=COUNT")
+    parser.add_argument("--items", nargs='*', metavar="CHAR=COUNT")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--config", help="configuration file to add the level's section to")
+    parser.add_argument("--goal", default="END", help="the goal of the generated level")
+    args = parser.parse_args()
+
+    if args.scale:
+        level_file, factor = args.scale
+        level = scale_level(load_level(level_file), int(factor))
+    else:
+        level = generate_level(args.width, args.height, ground=args.ground,
+                               bricks=args.bricks, mysteries=args.mysteries,
+                               bounces=args.bounces, switches=args.switches,
+                               mobs=_parse_counts(args.mobs) if args.mobs is not None else None,
+                               items=_parse_counts(args.items) if args.items is not None else None,
+                               seed=args.seed)
+
+    write_level(args.output, level)
+    if args.config:
+        write_configuration(args.config, [args.output], goal=args.goal)
+
+
+if __name__ == "__main__":
+    main()
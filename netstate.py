@@ -0,0 +1,381 @@
+"""The state of the things in a world, as streamed by server.py to the thin
+clients of client.py.
+
+Each tick the server takes a snapshot of every thing in the world: the class it
+is drawn as, its id, its quantized position and size, and the flags its sprite
+depends on. A snapshot is sent as a delta against the last snapshot the client
+acknowledged: things spawned since, the changes to things that moved or changed
+sprite (positions as quantized differences), and things despawned since.
+
+Messages are framed by their length, followed by a byte of their kind.
+"""
+
+__version__ = "1.1.0"
+
+import collections
+import json
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from app import (Bounce, BulletLeft, BulletRight, Flag, Flower, Gang, Mushroom, Star, Switch,
+                 Tunnel)
+from game.block import Block, MysteryBlock
+from game.entity import BoundaryWall, Entity
+from game.item import Coin, DroppedItem
+from game.mob import CloudMob, Fireball, Mob
+from player import Player
+
+# The kinds of message, by their kind byte
+WELCOME = b"W"
+SNAPSHOT = b"S"
+ACK = b"A"
+INPUT = b"I"
+
+MESSAGE_HEADER = struct.Struct("<Ic")
+# tick, baseline tick, and the player's health, max health, score and invincibility
+SNAPSHOT_HEADER = struct.Struct("<IIffiB")
+ACK_FORMAT = struct.Struct("<I")
+INPUT_FORMAT = struct.Struct("<B")
+
+# The baseline tick of a snapshot sent in full
+NO_BASELINE = 0xFFFFFFFF
+
+# Positions and sizes are sent in units of 1 / QUANTUM pixels
+QUANTUM = 8
+
+# The number of most recent snapshots kept, to be the baseline of deltas
+HISTORY = 64
+
+# The classes things are drawn as, by their code; a thing is sent as the first
+# class in its method resolution order that is here
+KINDS = (Entity, BoundaryWall, Block, MysteryBlock, Switch, Bounce, Flag, Tunnel,
+         DroppedItem, Coin, Star, Flower, Mob, CloudMob, Fireball, Mushroom, Gang,
+         BulletLeft, BulletRight, Player)
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# The bits of the sprite flags of a thing
+ACTIVE = 1 << 0
+SQUISHED = 1 << 1
+MOVING_LEFT = 1 << 2
+MOVING_RIGHT = 1 << 3
+MOVING_UP = 1 << 4
+MOVING_DOWN = 1 << 5
+
+# The bits of the changes of a thing in a delta
+CHANGED_POSITION = 1 << 0
+CHANGED_FLAGS = 1 << 1
+
+# The state of a thing: (kind code, id, x, y, width, height, flags), where the
+# position of its centre and its size are quantized
+ThingState = Tuple[int, str, int, int, int, int, int]
+
+
+def pack_message(kind: bytes, payload: bytes = b"") -> bytes:
+    """(bytes) Returns a message of 'kind', framed to be sent over a stream"""
+    return MESSAGE_HEADER.pack(len(payload), kind) + payload
+
+
+class MessageReader:
+    """Splits the bytes received from a stream into messages"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Tuple[bytes, bytes]]:
+        """(list<tuple<bytes, bytes>>) Returns the (kind, payload) of every message
+        completed by 'data'"""
+        self._buffer += data
+        messages = []
+        offset = 0
+        while len(self._buffer) - offset >= MESSAGE_HEADER.size:
+            length, kind = MESSAGE_HEADER.unpack_from(self._buffer, offset)
+            end = offset + MESSAGE_HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            messages.append((kind, bytes(self._buffer[offset + MESSAGE_HEADER.size:end])))
+            offset = end
+        del self._buffer[:offset]
+        return messages
+
+
+def pack_welcome(level: str, size: Tuple[float, float], tick_rate: float) -> bytes:
+    """(bytes) Returns the message starting the stream of a world"""
+    return pack_message(WELCOME, json.dumps({"level": level, "size": list(size),
+                                             "tick_rate": tick_rate}).encode())
+
+
+def write_varint(buffer: bytearray, value: int):
+    """Appends an unsigned integer to 'buffer', in 7 bit groups"""
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """(tuple<int, int>) Returns an unsigned integer read from 'data' at 'offset',
+    and the offset after it"""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_signed(buffer: bytearray, value: int):
+    """Appends a signed integer to 'buffer', small magnitudes taking fewest bytes"""
+    write_varint(buffer, value << 1 if value >= 0 else (-value << 1) - 1)
+
+
+def read_signed(data: bytes, offset: int) -> Tuple[int, int]:
+    """(tuple<int, int>) Returns a signed integer read from 'data' at 'offset',
+    and the offset after it"""
+    value, offset = read_varint(data, offset)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+def get_kind_code(thing: Entity) -> int:
+    """(int) Returns the code of the class 'thing' is drawn as"""
+    code = KIND_CODES.get(thing.__class__)
+    if code is None:
+        code = next((KIND_CODES[cls] for cls in thing.__class__.__mro__ if cls in KIND_CODES),
+                     KIND_CODES[Entity])
+        # subclasses are looked up directly from then on
+        KIND_CODES[thing.__class__] = code
+    return code
+
+
+def get_flags(thing: Entity, shape) -> int:
+    """(int) Returns the sprite flags of 'thing'"""
+    flags = 0
+    is_active = getattr(thing, "is_active", None)
+    if is_active is not None and is_active():
+        flags |= ACTIVE
+    is_squished = getattr(thing, "is_squished", None)
+    if is_squished is not None and is_squished():
+        flags |= SQUISHED
+
+    if isinstance(thing, Player):
+        vx, vy = shape.body.velocity
+        flags |= (MOVING_LEFT if vx < 0 else MOVING_RIGHT if vx > 0 else 0) | \
+                 (MOVING_UP if vy < 0 else MOVING_DOWN if vy > 0 else 0)
+    return flags
+
+
+class StateEncoder:
+    """Takes snapshots of a world, and encodes them as deltas against earlier ones"""
+
+    def __init__(self, history: int = HISTORY):
+        """
+        Parameters:
+            history (int): The number of most recent snapshots kept as baselines
+        """
+        self._history_size = history
+        # ticks keep counting when reset, so acknowledgements of earlier worlds are never mistaken
+        self._tick = 0
+        self.reset()
+
+    def reset(self):
+        """Forget every thing and snapshot, e.g. when the world is replaced"""
+        # maps shapes to the network id of their thing
+        self._ids = {}
+        self._next_id = 0
+        # maps static shapes to the (x, y, width, height) of their quantized bounding box
+        self._static_boxes = {}
+        # maps ticks to their snapshot, of the most recent ticks
+        self._snapshots = collections.OrderedDict()
+
+    def get_tick(self) -> int:
+        """(int) Returns the tick of the last snapshot taken"""
+        return self._tick
+
+    def has_snapshot(self, tick: int) -> bool:
+        """(bool) Returns True iff the snapshot of 'tick' is kept as a baseline"""
+        return tick in self._snapshots
+
+    def take_snapshot(self, world, player) -> int:
+        """Take a snapshot of every thing in 'world', and the status of 'player'
+
+        Returns:
+            (int): The tick of the snapshot
+        """
+        static_body = world.get_space().static_body
+        ids = self._ids
+        static_boxes = self._static_boxes
+        things = {}
+        seen = {}
+        for thing, shape in world.get_all_shapes():
+            net_id = ids.get(shape)
+            if net_id is None:
+                net_id = ids[shape] = self._next_id
+                self._next_id += 1
+            seen[shape] = net_id
+
+            box = static_boxes.get(shape) if shape.body is static_body else None
+            if box is None:
+                bb = shape.bb
+                box = (round((bb.left + bb.right) * QUANTUM / 2), round((bb.top + bb.bottom) * QUANTUM / 2),
+                       round((bb.right - bb.left) * QUANTUM), round((bb.top - bb.bottom) * QUANTUM))
+                if shape.body is static_body:
+                    static_boxes[shape] = box
+
+            things[net_id] = (get_kind_code(thing), thing.get_id(), *box, get_flags(thing, shape))
+
+        # forget the shapes removed from the world
+        if len(seen) != len(ids):
+            self._ids = seen
+            self._static_boxes = {shape: box for shape, box in static_boxes.items() if shape in seen}
+
+        self._tick += 1
+        status = (player.get_health(), player.get_max_health(), player.get_score(), player.is_niubi())
+        self._snapshots[self._tick] = (things, status)
+        while len(self._snapshots) > self._history_size:
+            self._snapshots.popitem(last=False)
+        return self._tick
+
+    def encode(self, tick: int, baseline: Optional[int] = None) -> bytes:
+        """(bytes) Returns the snapshot message of 'tick', as a delta against the
+        snapshot of 'baseline', or in full if it is None or no longer kept"""
+        things, (health, max_health, score, niubi) = self._snapshots[tick]
+        if baseline is None or baseline not in self._snapshots:
+            baseline = NO_BASELINE
+            base_things = {}
+        else:
+            base_things = self._snapshots[baseline][0]
+
+        spawns = []
+        changes = []
+        for net_id, state in things.items():
+            base = base_things.get(net_id)
+            if base is None or base[:2] != state[:2] or base[4:6] != state[4:6]:
+                spawns.append(net_id)
+            elif base != state:
+                changes.append(net_id)
+        despawns = [net_id for net_id in base_things if net_id not in things]
+
+        payload = bytearray(SNAPSHOT_HEADER.pack(tick, baseline, health, max_health, int(score), niubi))
+
+        write_varint(payload, len(spawns))
+        previous = 0
+        for net_id in sorted(spawns):
+            kind, thing_id, x, y, width, height, flags = things[net_id]
+            # ids are sent as the gap from the previous one
+            write_varint(payload, net_id - previous)
+            previous = net_id
+            write_varint(payload, kind)
+            thing_id = (thing_id or "").encode()
+            write_varint(payload, len(thing_id))
+            payload += thing_id
+            write_signed(payload, x)
+            write_signed(payload, y)
+            write_varint(payload, width)
+            write_varint(payload, height)
+            write_varint(payload, flags)
+
+        write_varint(payload, len(changes))
+        previous = 0
+        for net_id in sorted(changes):
+            _, _, x, y, _, _, flags = things[net_id]
+            _, _, base_x, base_y, _, _, base_flags = base_things[net_id]
+            write_varint(payload, net_id - previous)
+            previous = net_id
+            changed = (CHANGED_POSITION if (x, y) != (base_x, base_y) else 0) | \
+                      (CHANGED_FLAGS if flags != base_flags else 0)
+            payload.append(changed)
+            if changed & CHANGED_POSITION:
+                write_signed(payload, x - base_x)
+                write_signed(payload, y - base_y)
+            if changed & CHANGED_FLAGS:
+                write_varint(payload, flags)
+
+        write_varint(payload, len(despawns))
+        previous = 0
+        for net_id in sorted(despawns):
+            write_varint(payload, net_id - previous)
+            previous = net_id
+
+        return pack_message(SNAPSHOT, bytes(payload))
+
+
+class StateDecoder:
+    """Rebuilds the snapshots of a world from the deltas of a StateEncoder"""
+
+    def __init__(self, history: int = HISTORY):
+        """
+        Parameters:
+            history (int): The number of most recent snapshots kept as baselines
+        """
+        self._history_size = history
+        self.reset()
+
+    def reset(self):
+        """Forget every snapshot, e.g. when the world is replaced"""
+        # maps ticks to their (things, status), of the most recent ticks
+        self._snapshots = collections.OrderedDict()
+
+    def decode(self, payload: bytes) -> Optional[Tuple[int, Dict[int, ThingState], tuple]]:
+        """Decode the payload of a snapshot message
+
+        Returns:
+            (tuple<int, dict<int: ThingState>, tuple>): The tick, the state of each
+                thing by network id, and the (health, max health, score, niubi) of
+                the player; or None if the baseline of the delta is not known
+        """
+        tick, baseline, health, max_health, score, niubi = SNAPSHOT_HEADER.unpack_from(payload)
+        if baseline == NO_BASELINE:
+            things = {}
+        elif baseline in self._snapshots:
+            things = dict(self._snapshots[baseline][0])
+        else:
+            return None
+
+        offset = SNAPSHOT_HEADER.size
+        count, offset = read_varint(payload, offset)
+        net_id = 0
+        for _ in range(count):
+            gap, offset = read_varint(payload, offset)
+            net_id += gap
+            kind, offset = read_varint(payload, offset)
+            length, offset = read_varint(payload, offset)
+            thing_id = payload[offset:offset + length].decode() or None
+            offset += length
+            x, offset = read_signed(payload, offset)
+            y, offset = read_signed(payload, offset)
+            width, offset = read_varint(payload, offset)
+            height, offset = read_varint(payload, offset)
+            flags, offset = read_varint(payload, offset)
+            things[net_id] = (kind, thing_id, x, y, width, height, flags)
+
+        count, offset = read_varint(payload, offset)
+        net_id = 0
+        for _ in range(count):
+            gap, offset = read_varint(payload, offset)
+            net_id += gap
+            kind, thing_id, x, y, width, height, flags = things[net_id]
+            changed = payload[offset]
+            offset += 1
+            if changed & CHANGED_POSITION:
+                dx, offset = read_signed(payload, offset)
+                dy, offset = read_signed(payload, offset)
+                x += dx
+                y += dy
+            if changed & CHANGED_FLAGS:
+                flags, offset = read_varint(payload, offset)
+            things[net_id] = (kind, thing_id, x, y, width, height, flags)
+
+        count, offset = read_varint(payload, offset)
+        net_id = 0
+        for _ in range(count):
+            gap, offset = read_varint(payload, offset)
+            net_id += gap
+            del things[net_id]
+
+        status = (health, max_health, score, bool(niubi))
+        self._snapshots[tick] = (things, status)
+        while len(self._snapshots) > self._history_size:
+            self._snapshots.popitem(last=False)
+        return tick, things, status
+
@@ -3,11 +3,14 @@
 __version__ = "1.1.0"
 
 from game.entity import DynamicEntity
+from game.state import INVINCIBLE, DUCKING, SHOOTING
 
 
 class Player(DynamicEntity):
     """A player in the game"""
+    _id = "player"
     _type = 3
+    _state_attributes = DynamicEntity._state_attributes + ("_niubi", "_duck", "_shoot")
 
     def __init__(self, name: str = "Mario", max_health: float = 20):
         """Construct a new instance of the player.
@@ -24,6 +27,10 @@ class Player(DynamicEntity):
         self._duck = False
         self._shoot = False
 
+    def get_id(self) -> str:
+        """(str) Returns the unique id of the player entity"""
+        return self._id
+
     def get_name(self) -> str:
         """(str): Returns the name of the player."""
         return self._name
@@ -39,29 +46,57 @@ class Player(DynamicEntity):
     def clear_score(self):
         self._score = 0
 
+    def _export_state(self):
+        state = super()._export_state()
+        state["flags"] |= ((INVINCIBLE if self.is_niubi() else 0)
+                           | (DUCKING if self.is_duck() else 0)
+                           | (SHOOTING if self.is_shoot() else 0))
+        return state
+
+    def _import_state(self, state):
+        super()._import_state(state)
+        self._niubi = bool(state["flags"] & INVINCIBLE)
+        self._duck = bool(state["flags"] & DUCKING)
+        self._shoot = bool(state["flags"] & SHOOTING)
+
     def is_niubi(self):
         """(bool): Return if the player is invincible or not. Niubi means super invincible"""
-        return self._niubi
+        if self._store is None:
+            return self._niubi
+        return self._store.get_flag(self._slot, INVINCIBLE)
 
     def set_niubi(self, niubi: bool):
         """Set the player's invincibility"""
-        self._niubi = niubi
+        if self._store is None:
+            self._niubi = niubi
+        else:
+            self._store.set_flag(self._slot, INVINCIBLE, niubi)
 
     def is_duck(self):
         """(bool): Return if the player is ducking or not."""
-        return self._duck
+        if self._store is None:
+            return self._duck
+        return self._store.get_flag(self._slot, DUCKING)
 
     def set_duck(self, duck: bool):
         """Set the player's state of ducking"""
-        self._duck = duck
+        if self._store is None:
+            self._duck = duck
+        else:
+            self._store.set_flag(self._slot, DUCKING, duck)
 
     def is_shoot(self):
         """(bool): Return if the player is able to shoot bullet or not."""
-        return self._shoot
+        if self._store is None:
+            return self._shoot
+        return self._store.get_flag(self._slot, SHOOTING)
 
     def set_shoot(self, shoot: bool):
         """Set whether the player can shoot bullet or not"""
-        self._shoot = shoot
+        if self._store is None:
+            self._shoot = shoot
+        else:
+            self._store.set_flag(self._slot, SHOOTING, shoot)
 
     def __repr__(self):
         return f"Player({self._name!r})"
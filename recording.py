@@ -0,0 +1,148 @@
+"""Records a game session compactly, so it can be replayed step for step.
+
+Given the same configuration and seed, a GameSession only depends on the
+events it handles (see GameSession.handle_event) and the step at which they
+happen. A recording keeps just those, plus a hash of the state of the world
+at regular checkpoints, so a replay can be checked against the original run.
+"""
+
+__version__ = "1.1.0"
+
+import hashlib
+import json
+import struct
+
+FORMAT_VERSION = 2
+
+# The kinds of event handled by GameSession.handle_event, stored by their first letter
+EVENT_KINDS = ("input", "restart", "load", "edit")
+
+# Steps between each checkpoint hash of the world state
+CHECKPOINT_INTERVAL = 50
+
+
+def hash_state(world, player) -> str:
+    """(str) Returns a hash of the state of 'world' and 'player'
+
+    Covers the simulated time, the block grid, the id, position and velocity of
+    every dynamic thing (regardless of their order), and the player's health and score.
+    """
+    static_body = world.get_space().static_body
+    things = sorted(thing.get_id().encode() + struct.pack("<4d", *shape.body.position, *shape.body.velocity)
+                    for thing, shape in world.get_all_shapes() if shape.body is not static_body)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(struct.pack("<d", world.get_time()))
+    digest.update(world.get_block_grid())
+    for thing in things:
+        digest.update(thing)
+    digest.update(struct.pack("<2d", player.get_health(), player.get_score()))
+    return digest.hexdigest()
+
+
+class Recording:
+    """The seed, configuration and events of a game session"""
+
+    def __init__(self, seed: int, config: dict, level: str, interval: int = CHECKPOINT_INTERVAL):
+        """Constructor
+
+        Parameters:
+            seed (int): The seed of the session
+            config (dict): The configuration of the session, as read by GameSession.read_config
+            level (str): The level the session starts at
+            interval (int): Steps between each checkpoint hash
+        """
+        self._seed = seed
+        self._config = config
+        self._level = level
+        self._interval = interval
+        self._steps = 0
+        # list of (step, kind, argument) in the order they were handled
+        self._events = []
+        # list of (step, hash) of the world state after the step
+        self._checkpoints = []
+
+    def get_seed(self) -> int:
+        """(int) Returns the seed of the recorded session"""
+        return self._seed
+
+    def get_config(self) -> dict:
+        """(dict) Returns the configuration of the recorded session"""
+        return self._config
+
+    def get_level(self) -> str:
+        """(str) Returns the level the recorded session started at"""
+        return self._level
+
+    def get_steps(self) -> int:
+        """(int) Returns the number of steps recorded"""
+        return self._steps
+
+    def get_events(self):
+        """(list<tuple<int, str, str>>) Returns the (step, kind, argument) of each event"""
+        return self._events
+
+    def get_checkpoints(self):
+        """(list<tuple<int, str>>) Returns the (step, hash) of each checkpoint"""
+        return self._checkpoints
+
+    def record(self, step: int, kind: str, argument):
+        """Record an event handled when 'step' steps had been taken"""
+        self._events.append((step, kind, argument))
+
+    def on_step(self, session):
+        """Record that 'session' took a step, hashing its state at each checkpoint"""
+        self._steps = session.get_steps()
+        if self._steps % self._interval == 0:
+            self._checkpoints.append(
+                (self._steps, hash_state(session.get_world(), session.get_player())))
+
+    def save(self, filename: str):
+        """Write the recording to 'filename'
+
+        Event steps are stored as the difference from the previous event's step
+        and repeated arguments are stored once, to keep long recordings small.
+        """
+        arguments = []
+        codes = {}
+        events = []
+        last = 0
+        for step, kind, argument in self._events:
+            if argument not in codes:
+                codes[argument] = len(arguments)
+                arguments.append(argument)
+            events.append([step - last, kind[0], codes[argument]])
+            last = step
+
+        data = {
+            "version": FORMAT_VERSION,
+            "seed": self._seed,
+            "config": self._config,
+            "level": self._level,
+            "interval": self._interval,
+            "steps": self._steps,
+            "arguments": arguments,
+            "events": events,
+            "checkpoints": self._checkpoints,
+        }
+        with open(filename, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename: str) -> 'Recording':
+        """(Recording) Returns the recording written to 'filename' by save"""
+        with open(filename) as file:
+            data = json.load(file)
+        if data["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording version {data['version']}")
+
+        recording = cls(data["seed"], data["config"], data["level"], data["interval"])
+        recording._steps = data["steps"]
+
+        kinds = {kind[0]: kind for kind in EVENT_KINDS}
+        step = 0
+        for delta, kind, code in data["events"]:
+            step += delta
+            recording._events.append((step, kinds[kind], data["arguments"][code]))
+        recording._checkpoints = [tuple(checkpoint) for checkpoint in data["checkpoints"]]
+        return recording
@@ -0,0 +1,85 @@
+"""Replays recorded game sessions headless, as fast as possible.
+
+The replay handles the recorded events at the same steps as the original
+session, hashing the world state after every step, and checks the hashes
+against the recording's checkpoints to confirm the run is identical.
+
+Example:
+    python replay.py session.json --hashes hashes.txt
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import time
+from typing import List, Tuple
+
+from app import GameSession
+from recording import Recording, hash_state
+
+
+def replay(recording: Recording, **world_options) -> Tuple[GameSession, List[str]]:
+    """Replay a recorded session
+
+    Parameters:
+        recording (Recording): The recording to replay
+        **world_options: Any additional World constructor arguments, e.g. to
+                         compare engine options on a real play trace
+
+    Returns:
+        (tuple<GameSession, list<str>>): The session after the last step, and
+                                         the hash of the world state after each step
+    """
+    session = GameSession(recording.get_config() or None, seed=recording.get_seed())
+    session.start(recording.get_level(), **world_options)
+
+    events = recording.get_events()
+    hashes = []
+    index = 0
+    for step in range(recording.get_steps()):
+        while index < len(events) and events[index][0] <= step:
+            _, kind, argument = events[index]
+            session.handle_event(kind, argument)
+            index += 1
+
+        session.step()
+        hashes.append(hash_state(session.get_world(), session.get_player()))
+
+    return session, hashes
+
+
+def find_divergence(recording: Recording, hashes: List[str]) -> int:
+    """(int) Returns the first checkpoint step at which 'hashes' differ from the
+    recording, or None if every checkpoint matches"""
+    for step, expected in recording.get_checkpoints():
+        if hashes[step - 1] != expected:
+            return step
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game session")
+    parser.add_argument("recording", help="recording saved from the game's File menu")
+    parser.add_argument("--hashes", help="file to write the world state hash of each step to")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording)
+    start = time.perf_counter()
+    session, hashes = replay(recording)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(hashes)} steps in {elapsed:.2f}s ({len(hashes) / max(elapsed, 1e-9):.0f} steps/s)")
+    divergence = find_divergence(recording, hashes)
+    if divergence is None:
+        print(f"identical to the recording at all {len(recording.get_checkpoints())} checkpoints")
+    else:
+        print(f"diverged from the recording by step {divergence}")
+
+    if args.hashes:
+        with open(args.hashes, 'w') as file:
+            file.write("\n".join(hashes))
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
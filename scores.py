@@ -0,0 +1,132 @@
+"""Persistent high scores for each level.
+
+Scores are kept in a SQLite database indexed by level and score, and the top
+scores of each level are cached in memory once read, so showing them needs no
+disk access. New scores are written with one small transaction each, which
+either fully happens or not at all.
+"""
+
+__version__ = "1.1.0"
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+SCORE_DATABASE = "high_scores.db"
+# The text file high scores were kept in by earlier versions of the game
+LEGACY_SCORE_FILE = "high_score.txt"
+
+# The number of high scores kept for each level
+TOP_SCORES = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY,
+    level TEXT NOT NULL,
+    name TEXT NOT NULL,
+    score INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_by_level ON scores (level, score DESC, id);
+"""
+
+
+def read_legacy_scores(filename: str) -> Dict[str, List[Tuple[str, int]]]:
+    """Read the score records of a text file written by earlier versions of the game
+
+    Returns:
+        (dict<str: list<tuple<str, int>>>): The (name, score) records of each level
+    """
+    score = {}
+    with open(filename) as hand:
+        for line in hand:
+            line = line.rstrip()
+            if line.startswith("**") and line.endswith("**"):
+                heading = line[2:-2]
+                score[heading] = []
+            elif line:
+                record = line.split(' : ')
+                score[heading].append((record[0], int(record[1])))
+    return score
+
+
+class ScoreStore:
+    """The top scores of every level, cached in memory and persisted in SQLite"""
+
+    def __init__(self, path: str = SCORE_DATABASE, top: int = TOP_SCORES,
+                 legacy_file: str = LEGACY_SCORE_FILE):
+        """Constructor
+
+        Parameters:
+            path (str): The database file, created if it does not exist
+            top (int): The number of scores kept for each level
+            legacy_file (str): A text score file to import into a new database, if it exists
+        """
+        self._top = top
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # a write-ahead log keeps each transaction atomic without syncing the whole database
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        created = not self._connection.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'scores'").fetchone()
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+
+        # maps levels to their top (name, score) records, highest first
+        self._cache = {}
+        # scores may be added from an I/O thread while they are shown
+        self._lock = threading.RLock()
+
+        if created and legacy_file and os.path.exists(legacy_file):
+            for level, records in read_legacy_scores(legacy_file).items():
+                for name, score in records:
+                    self.add(level, name, score)
+
+    def get_top(self, level: str) -> List[Tuple[str, int]]:
+        """(list<tuple<str, int>>) Returns the top (name, score) records of 'level', highest first
+
+        Only the first call for a level reads the database.
+        """
+        with self._lock:
+            records = self._cache.get(level)
+            if records is None:
+                records = self._cache[level] = self._connection.execute(
+                    "SELECT name, score FROM scores WHERE level = ? ORDER BY score DESC, id LIMIT ?",
+                    (level, self._top)).fetchall()
+            return list(records)
+
+    def qualifies(self, level: str, score: int) -> bool:
+        """(bool) Returns True iff 'score' would be one of the top scores of 'level'"""
+        records = self.get_top(level)
+        return len(records) < self._top or score > records[-1][1]
+
+    def add(self, level: str, name: str, score: int) -> bool:
+        """Record the score of a player for a level, if it is one of the top scores
+
+        Scores pushed out of the top scores are deleted in the same transaction.
+
+        Returns:
+            (bool): True iff the score was recorded
+        """
+        with self._lock:
+            if not self.qualifies(level, score):
+                return False
+
+            with self._connection:
+                self._connection.execute("INSERT INTO scores (level, name, score) VALUES (?, ?, ?)",
+                                         (level, name, score))
+                self._connection.execute(
+                    "DELETE FROM scores WHERE level = ? AND id NOT IN "
+                    "(SELECT id FROM scores WHERE level = ? ORDER BY score DESC, id LIMIT ?)",
+                    (level, level, self._top))
+
+            records = self._cache[level]
+            # equal scores keep the order they were set in
+            index = next((i for i, (_, top) in enumerate(records) if score > top), len(records))
+            records.insert(index, (name, score))
+            del records[self._top:]
+            return True
+
+    def close(self):
+        """Close the database"""
+        self._connection.close()
@@ -0,0 +1,240 @@
+"""An authoritative headless game server, streaming the world to thin clients.
+
+The server owns a GameSession and steps it at a fixed rate. After each step it
+sends every connected client the state of the world as a delta against the
+last snapshot that client acknowledged (see netstate), and applies the input
+commands clients send back. Clients only draw what they are sent, see client.py.
+
+Example:
+    python server.py --config configuration.txt --port 5000
+"""
+
+__version__ = "1.1.0"
+
+import argparse
+import selectors
+import socket
+import time
+from typing import Tuple
+
+from app import GameSession
+from netstate import (ACK, ACK_FORMAT, INPUT, INPUT_FORMAT, MessageReader, StateEncoder,
+                      pack_welcome)
+
+DEFAULT_ADDRESS = ("127.0.0.1", 5000)
+
+# Steps of the game per second
+TICK_RATE = 60
+
+# The most bytes waiting to be sent to a client before it is sent no more
+# snapshots, until it catches up
+MAX_PENDING = 1 << 16
+
+
+class ClientConnection:
+    """A client connected to the server"""
+
+    def __init__(self, sock: socket.socket, address):
+        self.socket = sock
+        self.address = address
+        self.reader = MessageReader()
+        # bytes waiting to be sent, as the socket does not block
+        self.pending = bytearray()
+        # the tick of the last snapshot the client acknowledged, the baseline of its deltas
+        self.acked = None
+
+
+class GameServer:
+    """Steps a game session and streams its world to the connected clients"""
+
+    def __init__(self, session: GameSession, address: Tuple[str, int] = DEFAULT_ADDRESS,
+                 tick_rate: float = TICK_RATE):
+        """Construct a server listening on 'address' for clients of 'session'
+
+        Parameters:
+            session (GameSession): The started session to step and stream
+            address (tuple<str, int>): The (host, port) to listen on; port 0
+                                       picks a free port, see get_address
+            tick_rate (float): Steps of the session per second
+        """
+        self._session = session
+        # the game starts over from here when the player dies or finishes
+        self._start_level = session.get_level()
+        self._tick_rate = tick_rate
+        self._encoder = StateEncoder()
+        # the world being streamed, which is replaced when a level is (re)started
+        self._world = None
+
+        self._selector = selectors.DefaultSelector()
+        self._listener = socket.create_server(address)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._clients = {}
+
+    def get_address(self) -> Tuple[str, int]:
+        """(tuple<str, int>) Returns the (host, port) the server listens on"""
+        return self._listener.getsockname()[:2]
+
+    def get_session(self) -> GameSession:
+        """(GameSession) Returns the session the server steps"""
+        return self._session
+
+    def get_clients(self) -> int:
+        """(int) Returns the number of connected clients"""
+        return len(self._clients)
+
+    def poll(self, timeout: float = 0.):
+        """Accept new clients, read their messages and send what is pending,
+        waiting at most 'timeout' seconds for any of them"""
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self._listener:
+                self._accept()
+                continue
+
+            client = key.data
+            if events & selectors.EVENT_READ:
+                self._receive(client)
+            if events & selectors.EVENT_WRITE and client.socket.fileno() != -1:
+                self._flush(client)
+
+    def tick(self):
+        """Step the session, and send every client the new state of the world"""
+        session = self._session
+        player = session.get_player()
+        if player.is_dead() or session.is_finished():
+            session.handle_event("restart", self._start_level)
+        session.step()
+
+        world = session.get_world()
+        if world is not self._world:
+            self._start_world(world)
+
+        tick = self._encoder.take_snapshot(world, session.get_player())
+        # clients with the same baseline are sent the same delta
+        encoded = {}
+        for client in list(self._clients.values()):
+            if len(client.pending) > MAX_PENDING:
+                continue
+            if client.acked not in encoded:
+                encoded[client.acked] = self._encoder.encode(tick, client.acked)
+            self._send(client, encoded[client.acked])
+
+    def serve_forever(self):
+        """Tick at the tick rate, handling clients in between, until interrupted"""
+        interval = 1 / self._tick_rate
+        next_tick = time.perf_counter()
+        while True:
+            self.poll(max(0., next_tick - time.perf_counter()))
+            now = time.perf_counter()
+            if now >= next_tick:
+                self.tick()
+                # ticks missed by a slow step are skipped, rather than run back to back
+                next_tick = max(next_tick + interval, now)
+
+    def close(self):
+        """Disconnect every client and stop listening"""
+        for client in list(self._clients.values()):
+            self._disconnect(client)
+        self._selector.unregister(self._listener)
+        self._listener.close()
+        self._selector.close()
+
+    def _start_world(self, world):
+        """Start streaming a new world, from full snapshots"""
+        self._world = world
+        self._encoder.reset()
+        for client in self._clients.values():
+            client.acked = None
+            self._send(client, self._welcome())
+
+    def _welcome(self) -> bytes:
+        """(bytes) Returns the message starting the stream of the current world"""
+        return pack_welcome(self._session.get_level(), self._world.get_pixel_size(), self._tick_rate)
+
+    def _accept(self):
+        """Connect a waiting client"""
+        sock, address = self._listener.accept()
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = self._clients[sock] = ClientConnection(sock, address)
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        if self._world is not None:
+            self._send(client, self._welcome())
+
+    def _receive(self, client: ClientConnection):
+        """Read and handle the messages of a client"""
+        try:
+            data = client.socket.recv(1 << 16)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._disconnect(client)
+            return
+
+        for kind, payload in client.reader.feed(data):
+            if kind == ACK:
+                tick, = ACK_FORMAT.unpack(payload)
+                if self._encoder.has_snapshot(tick) and (client.acked is None or tick > client.acked):
+                    client.acked = tick
+            elif kind == INPUT:
+                command, = INPUT_FORMAT.unpack(payload)
+                if command != self._session.get_input():
+                    self._session.handle_event("input", command)
+
+    def _send(self, client: ClientConnection, message: bytes):
+        """Send a message to a client, as much of it as the socket takes now"""
+        had_pending = bool(client.pending)
+        client.pending += message
+        if not had_pending:
+            self._flush(client)
+
+    def _flush(self, client: ClientConnection):
+        """Send the pending bytes of a client, watching its socket for when it can
+        take more if they were not all sent"""
+        try:
+            sent = client.socket.send(client.pending)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._disconnect(client)
+            return
+        del client.pending[:sent]
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.pending else 0)
+        self._selector.modify(client.socket, events, client)
+
+    def _disconnect(self, client: ClientConnection):
+        """Forget a client and close its connection"""
+        if self._clients.pop(client.socket, None) is None:
+            return
+        self._selector.unregister(client.socket)
+        client.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a headless Mario server for thin clients")
+    parser.add_argument("--config", default="configuration.txt", help="the game configuration file")
+    parser.add_argument("--level", help="the level to start at, instead of the configured one")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0], help="the address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1], help="the port to listen on")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE, help="steps per second")
+    parser.add_argument("--seed", type=int, help="the seed of the worlds' random generators")
+    args = parser.parse_args()
+
+    session = GameSession(GameSession().read_config(args.config), seed=args.seed)
+    session.start(args.level)
+
+    server = GameServer(session, (args.host, args.port), args.tick_rate)
+    print("Serving on {}:{}".format(*server.get_address()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
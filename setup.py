@@ -40,4 +40,4 @@ def execute(cmd):
 
 
 if __name__ == '__main__':
-    execute([sys.executable, "-m", "pip", "install", "pymunk"])
+    execute([sys.executable, "-m", "pip", "install", "pymunk", "numpy"])
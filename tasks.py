@@ -0,0 +1,69 @@
+"""Runs blocking work (file and database I/O) off the main thread.
+
+Tasks run on a small thread pool, and their results are handed back to the
+thread which polls the runner, e.g. from the Tk loop with Tk.after, so result
+callbacks can safely use the world and the user interface.
+"""
+
+__version__ = "1.1.0"
+
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class TaskRunner:
+    """A thread pool whose completion callbacks run on the polling thread"""
+
+    def __init__(self, workers: int = 1):
+        """Constructor
+
+        Parameters:
+            workers (int): The number of worker threads. With a single worker,
+                           tasks run one at a time in the order submitted.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="io")
+        # (future, on_done, on_error) of finished tasks, waiting to be polled
+        self._finished = queue.SimpleQueue()
+        self._pending = 0
+
+    def submit(self, function, *args, on_done=None, on_error=None) -> Future:
+        """Run 'function' with 'args' on a worker thread
+
+        Parameters:
+            function (callable): The task to run
+            on_done (callable): Called with the task's result when polled
+            on_error (callable): Called with the task's exception when polled;
+                                 if None, the exception is raised by poll
+
+        Returns:
+            (Future): The future result of the task
+        """
+        future = self._executor.submit(function, *args)
+        self._pending += 1
+        future.add_done_callback(lambda done: self._finished.put((done, on_done, on_error)))
+        return future
+
+    def get_pending(self) -> int:
+        """(int) Returns the number of submitted tasks whose callbacks have not run yet"""
+        return self._pending
+
+    def poll(self):
+        """Run the callbacks of all finished tasks on the calling thread"""
+        while True:
+            try:
+                future, on_done, on_error = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            self._pending -= 1
+
+            error = future.exception()
+            if error is not None:
+                if on_error is None:
+                    raise error
+                on_error(error)
+            elif on_done is not None:
+                on_done(future.result())
+
+    def shutdown(self):
+        """Wait for all submitted tasks to finish and stop the worker threads"""
+        self._executor.shutdown(wait=True)